@@ -0,0 +1,70 @@
+"""
+Configuration for the gunicorn server used by the Docker image. Settings given on the gunicorn
+command line override those in this file.
+
+Two serving profiles are supported, selected by the ``GUNICORN_PROFILE`` environment variable:
+
+sync
+    The default. ``GUNICORN_WORKERS`` synchronous worker processes, each handling one request at a
+    time.
+
+threaded
+    ``GUNICORN_WORKERS`` worker processes each running ``GUNICORN_THREADS`` threads. This allows
+    more concurrent requests for the same memory. Combine with persistent database connections
+    by setting ``DJANGO_DB_CONN_MAX_AGE``. Each thread holds its own connection, so the database
+    must accept at least workers × threads connections per container.
+
+Set ``GUNICORN_PRELOAD`` to ``1`` to import the application, including its URLconf, once in the
+master process before forking workers rather than in each worker. Workers then start almost
+immediately and share the memory holding the imported code.
+
+See the "Serving" section of the documentation for benchmarks of each profile.
+
+"""
+import os
+import shutil
+
+#: Serving profile
+profile = os.environ.get('GUNICORN_PROFILE', 'sync')
+
+#: Number of worker processes
+workers = int(os.environ.get('GUNICORN_WORKERS', '3'))
+
+if profile == 'threaded':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+elif profile != 'sync':
+    raise ValueError('Unknown GUNICORN_PROFILE: {}'.format(profile))
+
+#: Import the application in the master process
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+
+
+def on_starting(server):
+    """
+    Empty the Prometheus multiprocess metrics directory, if configured, so that metrics from a
+    previous run of the server are not reported.
+
+    """
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def when_ready(server):
+    """
+    When the application is preloaded, also import the URLconf, which Django otherwise does on
+    the first request to each worker, so that workers inherit it.
+
+    """
+    if server.cfg.preload_app:
+        from django.urls import get_resolver
+        get_resolver().url_patterns
+
+
+def child_exit(server, worker):
+    """Tidy up the Prometheus metrics of workers which have exited."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
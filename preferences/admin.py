@@ -1,3 +1,69 @@
-# from django.contrib import admin
+from django.contrib import admin
 
-# Register your models here.
+from . import models
+
+
+@admin.register(models.Preference)
+class PreferenceAdmin(admin.ModelAdmin):
+    list_display = ('user', 'institution', 'allow_capture', 'request_hold', 'created_at')
+    list_filter = ('allow_capture', 'request_hold')
+    search_fields = ('user__username', 'institution')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    date_hierarchy = 'created_at'
+
+    def has_change_permission(self, request, obj=None):
+        # Preferences are append-only and so can be viewed but not changed.
+        return obj is None and super().has_change_permission(request, obj)
+
+
+@admin.register(models.Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'state', 'attempts', 'run_after', 'created_at', 'finished_at')
+    list_filter = ('state', 'task')
+    search_fields = ('task', 'dedup_key')
+    date_hierarchy = 'created_at'
+    readonly_fields = (
+        'task', 'arguments', 'dedup_key', 'attempts', 'max_attempts', 'lease_expires_at',
+        'worker', 'result', 'error', 'created_at', 'started_at', 'finished_at',
+    )
+
+    def has_add_permission(self, request):
+        # Jobs are queued by code which knows the arguments their task expects.
+        return False
+
+
+@admin.register(models.PreferenceSummary)
+class PreferenceSummaryAdmin(admin.ModelAdmin):
+    list_display = (
+        'institution', 'term', 'allow_capture_count', 'deny_capture_count', 'request_hold_count',
+        'updated_at',
+    )
+    list_filter = ('term',)
+    search_fields = ('institution',)
+
+    def has_add_permission(self, request):
+        # Summaries are maintained from preferences. See preferences.summaries.
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return obj is None and super().has_change_permission(request, obj)
+
+
+@admin.register(models.ArchivedPreference)
+class ArchivedPreferenceAdmin(admin.ModelAdmin):
+    list_display = (
+        'user', 'institution', 'allow_capture', 'request_hold', 'created_at', 'archived_at',
+    )
+    list_filter = ('allow_capture', 'request_hold')
+    search_fields = ('user__username', 'institution')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        # Preferences are archived by the archivepreferences management command.
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return obj is None and super().has_change_permission(request, obj)
@@ -23,6 +23,13 @@ class Config(AppConfig):
         # Import, and thereby register, our custom system checks
         from . import systemchecks  # noqa: F401
 
+        # Import, and thereby connect, the signal handlers which invalidate cached API tokens and
+        # responses and maintain preference summaries
+        from . import receivers  # noqa: F401
+
+        # Import, and thereby register, the tasks which may be run as background jobs
+        from . import tasks  # noqa: F401
+
         # Register default settings in a rather ugly way since Django does not have a cleaner way
         # for apps to register default settings.  https://stackoverflow.com/questions/8428556/
 
@@ -0,0 +1,181 @@
+"""
+Archival of superseded preferences.
+
+Preferences are append-only and so the preference table grows every term, slowing down queries
+for current preferences. The ``archivepreferences`` management command moves preferences which
+have been superseded for longer than
+:py:data:`~preferences.defaultsettings.PREFERENCES_HISTORY_RETENTION_DAYS` days out of the
+preference table, either into the :py:class:`~preferences.models.ArchivedPreference` table or
+into a gzip-compressed JSON Lines file of records in the format used by :py:mod:`preferences.bulk`.
+
+A preference is *superseded* if its user expressed a later preference during the same term. The
+latest preference of each user in each term is never archived and so current preferences, and the
+summaries for every term, may still be rebuilt from the preference table by
+:py:func:`preferences.summaries.refresh`.
+
+Archived preferences are deleted in bulk without sending a signal for each one. Instead, each batch
+invalidates the cached responses of its users and queues a single rebuild of the summaries, as
+deleting them one at a time would.
+
+"""
+import gzip
+import io
+import os
+import zlib
+
+from django.db import connections, router, transaction
+from django.db.models import Max, Min, OuterRef, Subquery
+
+from . import bulk
+from . import caching
+from . import models
+from . import summaries
+
+
+def terms(before):
+    """Return an iterator over the terms containing preferences expressed before *before*."""
+    span = models.Preference.objects.filter(created_at__lt=before).aggregate(
+        first=Min('created_at'), last=Max('created_at'))
+    if span['first'] is None:
+        return
+    term = summaries.term_for(span['first'])
+    while True:
+        yield term
+        end = summaries.term_bounds(term)[1]
+        if end > span['last']:
+            return
+        term = summaries.term_for(end)
+
+
+def superseded(term, before):
+    """
+    Return a queryset of the superseded preferences expressed during *term* and before *before*.
+
+    """
+    start, end = summaries.term_bounds(term)
+    latest_id = (
+        models.Preference.objects
+        .filter(user=OuterRef('user'), created_at__gte=start, created_at__lt=end)
+        .order_by('-created_at', '-id')
+        .values('id')[:1]
+    )
+    return (
+        models.Preference.objects
+        .filter(created_at__gte=start, created_at__lt=min(end, before))
+        .exclude(id=Subquery(latest_id))
+    )
+
+
+class ArchiveFile:
+    """
+    A gzip-compressed JSON Lines file to which archived preferences are appended. Each call to
+    :py:meth:`~.write` appends a complete gzip member and syncs it to disk before returning so that
+    the preferences may then be deleted. If a previous run was killed while writing, the unfinished
+    member it left at the end of the file is discarded on opening; the preferences in it were not
+    deleted. Use as a context manager or call :py:meth:`~.close`.
+
+    """
+    def __init__(self, path):
+        self._file = open(path, 'ab')
+        complete = _complete_length(path)
+        if complete < self._file.tell():
+            self._file.truncate(complete)
+
+    def write(self, preferences):
+        """Append *preferences*, whose users should have been selected, to the file."""
+        with io.TextIOWrapper(gzip.GzipFile(fileobj=self._file, mode='ab'), 'utf8') as stream:
+            writer = bulk.RecordWriter(stream, 'jsonl')
+            for preference in preferences:
+                writer.write(bulk.preference_to_record(preference))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _complete_length(path, chunk_size=64 * 1024):
+    """
+    Return the length of the prefix of the gzip file at *path* which consists of complete members.
+
+    """
+    complete = offset = 0
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    with open(path, 'rb') as f:
+        data = f.read(chunk_size)
+        while data:
+            try:
+                decompressor.decompress(data)
+            except zlib.error:
+                break
+            if decompressor.eof:
+                # Continue with the next member from the data following this one.
+                offset += len(data) - len(decompressor.unused_data)
+                complete = offset
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            else:
+                offset += len(data)
+                data = b''
+            if not data:
+                data = f.read(chunk_size)
+    return complete
+
+
+def archive(preferences, archive_file=None):
+    """
+    Archive *preferences*, a sequence of :py:class:`~preferences.models.Preference` instances, in
+    a single transaction. They are copied to *archive_file*, an :py:class:`~.ArchiveFile`, if
+    given and otherwise to the :py:class:`~preferences.models.ArchivedPreference` table, and then
+    deleted. Returns the number of preferences archived.
+
+    If the transaction fails after the preferences have been written to *archive_file*, they
+    remain in the file and will be written again when next archived.
+
+    """
+    using = router.db_for_write(models.Preference)
+    with transaction.atomic(using=using):
+        if archive_file is not None:
+            archive_file.write(preferences)
+        else:
+            models.ArchivedPreference.objects.using(using).bulk_create([
+                models.ArchivedPreference(
+                    id=preference.id, user_id=preference.user_id,
+                    institution=preference.institution, allow_capture=preference.allow_capture,
+                    request_hold=preference.request_hold, created_at=preference.created_at)
+                for preference in preferences
+            ])
+
+        _delete([preference.id for preference in preferences], using)
+        caching.invalidate(preference.user_id for preference in preferences)
+        summaries.queue_refresh()
+    return len(preferences)
+
+
+def _delete(ids, using):
+    """
+    Delete the preferences with primary keys in *ids* from the database *using* without sending
+    signals.
+
+    QuerySet.delete() would fetch each preference again to send post_delete for it, and each
+    signal would invalidate cached responses and queue a rebuild of the summaries, which
+    :py:func:`~.archive` does once for the batch instead. Nothing refers to preferences by foreign
+    key and so they are deleted with plain SQL, in chunks small enough for the database's limit on
+    query parameters.
+
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(models.Preference._meta.db_table)
+    column = connection.ops.quote_name(models.Preference._meta.pk.column)
+    chunk_size = connection.ops.bulk_batch_size(['id'], ids)
+    with connection.cursor() as cursor:
+        for offset in range(0, len(ids), chunk_size):
+            chunk = ids[offset:offset + chunk_size]
+            cursor.execute('DELETE FROM {} WHERE {} IN ({})'.format(
+                table, column, ', '.join(['%s'] * len(chunk))), chunk)
@@ -0,0 +1,92 @@
+"""
+Token authentication for API clients with cached token resolution.
+
+Django REST framework's :py:class:`~rest_framework.authentication.TokenAuthentication` looks up the
+token and its user on every request. :py:class:`~.CachedTokenAuthentication` keeps the resolved
+token and user, along with the user's permissions, in one of the caches configured in Django's
+``CACHES`` setting for
+:py:data:`~preferences.defaultsettings.PREFERENCES_TOKEN_CACHE_TTL` seconds so that frequent
+machine clients make no authentication queries for most requests.
+
+Cached entries are deleted when a token is changed or deleted, when its user is changed or
+deleted and when the user's groups or permissions, or the permissions of one of their groups,
+change, once the transaction making the change commits. Changes which do not send model signals,
+such as bulk updates, and changes made in other processes when the cache is local to each process
+take effect once the entry expires.
+
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.dispatch import Signal
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+#: Prefix applied to all cache keys
+KEY_PREFIX = 'preferences:token'
+
+#: Signal sent each time the cache is consulted with the number of *hits* and *misses*.
+cache_accessed = Signal()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    A drop-in replacement for :py:class:`~rest_framework.authentication.TokenAuthentication`
+    which caches successfully authenticated tokens. Failed authentication is never cached.
+
+    """
+    def authenticate_credentials(self, key):
+        cache = get_cache()
+        cache_key = token_cache_key(key)
+        cached = cache.get(cache_key)
+        cache_accessed.send(
+            sender=self.__class__, hits=int(cached is not None), misses=int(cached is None))
+        if cached is not None:
+            return cached
+
+        user, token = super().authenticate_credentials(key)
+
+        # Permission checks use permissions cached on the user object and so resolving them now
+        # means that they are cached along with the user.
+        user.get_all_permissions()
+
+        cache.set(cache_key, (user, token), settings.PREFERENCES_TOKEN_CACHE_TTL)
+        return user, token
+
+
+def get_cache():
+    """Return the cache used to store authenticated tokens."""
+    return caches[settings.PREFERENCES_TOKEN_CACHE]
+
+
+def token_cache_key(key):
+    """
+    Return the cache key for the token *key*. Tokens are hashed so that they cannot be read from
+    the cache.
+
+    """
+    return '{}:{}'.format(KEY_PREFIX, hashlib.sha256(key.encode('utf8')).hexdigest())
+
+
+def invalidate_tokens(keys):
+    """
+    Remove the tokens with the given *keys* from the cache once the current transaction, if any,
+    commits. Removing them before then would let a concurrent request cache them again from the
+    rows as they were before the transaction.
+
+    """
+    names = [token_cache_key(key) for key in keys]
+    if len(names) > 0:
+        transaction.on_commit(lambda: get_cache().delete_many(names))
+
+
+def invalidate_users(user_ids):
+    """
+    Remove the tokens of the users with primary keys in *user_ids* from the cache once the current
+    transaction, if any, commits. The tokens are found straight away so that *user_ids* may be a
+    queryset whose results the transaction changes.
+
+    """
+    invalidate_tokens(Token.objects.filter(user_id__in=user_ids).values_list('key', flat=True))
@@ -0,0 +1,233 @@
+"""
+Bulk import and export of preferences.
+
+Preferences are exchanged as *records*: flat dictionaries with the keys listed in
+:py:data:`~.FIELDS`. Records may be read from and written to CSV files, with a header row, or JSON
+Lines files, with one JSON object per line. Both reading and writing are streaming operations and
+so the memory used does not depend on the number of preferences.
+
+"""
+import csv
+import itertools
+import json
+import os
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import caching
+from . import models
+from . import summaries
+
+#: Fields present in each record, in the order they are written.
+FIELDS = ('user', 'institution', 'allow_capture', 'request_hold', 'created_at')
+
+#: Supported file formats.
+FORMATS = ('csv', 'jsonl')
+
+_TRUE_VALUES = {'true', 't', 'yes', 'y', '1'}
+_FALSE_VALUES = {'false', 'f', 'no', 'n', '0', ''}
+
+
+class RecordError(ValueError):
+    """
+    Raised if a record cannot be converted into a preference. The *line* attribute is the line or
+    record number of the offending record.
+
+    """
+    def __init__(self, message, line=None):
+        super().__init__(message if line is None else 'line {}: {}'.format(line, message))
+        self.line = line
+
+
+def guess_format(path):
+    """
+    Guess the format of a file from its extension. Returns None if the format cannot be guessed.
+
+    """
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    extension = {'json': 'jsonl', 'ndjson': 'jsonl'}.get(extension, extension)
+    return extension if extension in FORMATS else None
+
+
+def describe_rate(count, elapsed):
+    """Return a human-readable description of processing *count* records in *elapsed* seconds."""
+    rate = count / elapsed if elapsed > 0 else 0
+    return '{} records in {:.2f}s ({:.0f} records/s)'.format(count, elapsed, rate)
+
+
+def preference_to_record(preference):
+    """
+    Convert a :py:class:`~preferences.models.Preference` into a record. The preference's user
+    should have been fetched via ``select_related('user')`` to avoid a query per preference.
+
+    """
+    return {
+        'user': preference.user.username,
+        'institution': preference.institution,
+        'allow_capture': preference.allow_capture,
+        'request_hold': preference.request_hold,
+        'created_at': preference.created_at.isoformat(),
+    }
+
+
+def read_records(stream, format):
+    """
+    Return an iterator over records read from a text stream in the given format. Each record is
+    returned as a (line number, record) tuple.
+
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif format == 'jsonl':
+        for line_num, line in enumerate(stream, 1):
+            if line.strip() == '':
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise RecordError('invalid JSON: {}'.format(e), line_num)
+            if not isinstance(record, dict):
+                raise RecordError('expected a JSON object', line_num)
+            yield line_num, record
+    else:
+        raise ValueError('Unknown format: {}'.format(format))
+
+
+class RecordWriter:
+    """
+    Write records to a text stream in the given format. Each call to :py:meth:`~.write` returns the
+    text written, which makes the writer usable for streaming HTTP responses when constructed with
+    a stream which simply returns what is written to it.
+
+    """
+    def __init__(self, stream, format):
+        if format not in FORMATS:
+            raise ValueError('Unknown format: {}'.format(format))
+        self.stream = stream
+        self.format = format
+        if format == 'csv':
+            self._writer = csv.DictWriter(stream, fieldnames=FIELDS)
+
+    def write_header(self):
+        """Write any header required by the format."""
+        if self.format == 'csv':
+            return self._writer.writeheader()
+        return ''
+
+    def write(self, record):
+        """Write a single record."""
+        if self.format == 'csv':
+            return self._writer.writerow(record)
+        return self.stream.write(json.dumps(record) + '\n')
+
+
+def record_to_preference(record, user, line=None):
+    """
+    Convert a record into an unsaved :py:class:`~preferences.models.Preference` for *user*. Raises
+    :py:exc:`~.RecordError` if the record is invalid.
+
+    """
+    kwargs = {
+        'user': user,
+        'institution': record.get('institution') or '',
+        'allow_capture': _parse_bool(record, 'allow_capture', line, required=True),
+        'request_hold': _parse_bool(record, 'request_hold', line),
+    }
+
+    created_at = record.get('created_at')
+    if created_at not in (None, ''):
+        parsed = parse_datetime(created_at) if isinstance(created_at, str) else None
+        if parsed is None:
+            raise RecordError('invalid created_at: {!r}'.format(created_at), line)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, timezone.utc)
+        kwargs['created_at'] = parsed
+
+    return models.Preference(**kwargs)
+
+
+def import_records(records, chunk_size=1000, create_users=False, on_chunk=None):
+    """
+    Import (line number, record) tuples as new preferences. Records are processed in chunks of
+    *chunk_size*. For each chunk, the users are fetched with a single query and the preferences are
+    inserted with a single :py:meth:`~django.db.models.query.QuerySet.bulk_create` in a transaction
+    of their own. If a record is invalid, :py:exc:`~.RecordError` is raised and chunks before the
+    one containing the invalid record remain imported.
+
+    Preferences are append-only and so importing never updates existing rows.
+
+    :param create_users: if True, users which do not exist are created with unusable passwords.
+        Otherwise records for unknown users are skipped.
+    :param on_chunk: if not None, called after each chunk is written with the running totals.
+
+    Returns a dictionary with the number of records ``imported``, the number ``skipped`` and the
+    number of ``users_created``.
+
+    """
+    totals = {'imported': 0, 'skipped': 0, 'users_created': 0}
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if len(chunk) == 0:
+            break
+        _import_chunk(chunk, create_users, totals)
+        if on_chunk is not None:
+            on_chunk(totals)
+    return totals
+
+
+def _import_chunk(chunk, create_users, totals):
+    User = get_user_model()
+
+    usernames = set()
+    for line, record in chunk:
+        username = record.get('user')
+        if not isinstance(username, str) or username.strip() == '':
+            raise RecordError('missing user', line)
+        usernames.add(username.strip())
+
+    with transaction.atomic():
+        users = User.objects.in_bulk(usernames, field_name='username')
+
+        missing = usernames - set(users.keys())
+        if create_users and len(missing) > 0:
+            new_users = [User(username=username) for username in sorted(missing)]
+            for user in new_users:
+                user.set_unusable_password()
+            User.objects.bulk_create(new_users)
+            users = User.objects.in_bulk(usernames, field_name='username')
+            totals['users_created'] += len(missing)
+
+        preferences = []
+        for line, record in chunk:
+            user = users.get(record['user'].strip())
+            if user is None:
+                totals['skipped'] += 1
+                continue
+            preferences.append(record_to_preference(record, user, line))
+
+        # bulk_create() does not send post_save and so summaries are updated and cached responses
+        # invalidated explicitly.
+        summaries.record(preferences)
+        models.Preference.objects.bulk_create(preferences)
+        caching.invalidate(preference.user_id for preference in preferences)
+        totals['imported'] += len(preferences)
+
+
+def _parse_bool(record, name, line, required=False):
+    value = record.get(name)
+    if isinstance(value, bool):
+        return value
+    if value is None and not required:
+        return False
+    normalised = str(value).strip().lower() if value is not None else None
+    if normalised in _TRUE_VALUES:
+        return True
+    if normalised in _FALSE_VALUES and not (required and normalised == ''):
+        return False
+    raise RecordError('invalid {}: {!r}'.format(name, value), line)
@@ -0,0 +1,140 @@
+"""
+Caching of rendered responses with exact invalidation.
+
+Views decorated with :py:func:`~.cache_response` store their rendered responses in the cache named
+by the :py:data:`~preferences.defaultsettings.PREFERENCES_RESPONSE_CACHE` setting. Entries are
+per request, and so per user, in the same way as :py:func:`preferences.coalescing.request_key`.
+Responses are not cached unless the setting names a cache shared between all web workers.
+
+Rather than expiring entries after a guessed lifetime, each entry's key includes the current
+*version* of each *scope* its response depends on. A scope is either :py:data:`~.ALL`, which
+changes whenever any preference changes, or a single user's preferences, see
+:py:func:`~.user_scope`. Saving or deleting a preference gives its scopes new versions once the
+transaction commits, and so the next request computes a fresh response. Code which creates
+preferences in bulk, bypassing signals, must call :py:func:`~.invalidate` itself. Entries which
+are no longer reachable are left to expire after
+:py:data:`~preferences.defaultsettings.PREFERENCES_RESPONSE_CACHE_TTL` seconds.
+
+Versions are random tokens rather than counters so that a version evicted from the cache can never
+be recreated with a value used before.
+
+If a database replica is configured, responses may have been computed from data which lags behind
+the primary. Such entries instead expire after
+:py:data:`~project.settings.base.DATABASE_REPLICA_PIN_SECONDS` seconds. See
+:py:mod:`project.replicas`.
+
+"""
+import functools
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.dispatch import Signal
+from rest_framework.response import Response
+
+from project import replicas
+
+from . import coalescing
+
+#: Prefix applied to all cache keys
+KEY_PREFIX = 'preferences:response'
+
+#: Scope which changes whenever any preference changes
+ALL = 'all'
+
+#: Signal sent each time the cache is consulted for a response with the number of *hits* and
+#: *misses*.
+cache_accessed = Signal()
+
+
+def user_scope(user_id):
+    """Return the scope which changes whenever the user with primary key *user_id* changes."""
+    return 'user:{}'.format(user_id)
+
+
+def get_cache():
+    """Return the cache in which responses are stored or None if responses are not cached."""
+    alias = settings.PREFERENCES_RESPONSE_CACHE
+    return caches[alias] if alias is not None else None
+
+
+def cache_response(scopes):
+    """
+    Decorate a Django view, or a Django REST framework view method, so that its successful ``GET``
+    and ``HEAD`` responses are cached until any of their scopes changes. *scopes* is called with
+    the request and the view's arguments and returns a sequence of scopes.
+
+    """
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            cache = get_cache()
+            if cache is None or request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            key = _response_key(cache, request, scopes(request, *args, **kwargs))
+            frozen = cache.get(key)
+            cache_accessed.send(
+                sender=view_func, hits=int(frozen is not None), misses=int(frozen is None))
+            if frozen is not None:
+                return coalescing.thaw_response(frozen)
+
+            response = _render(request, view_func(request, *args, **kwargs), *args, **kwargs)
+            if coalescing.is_shareable(response):
+                timeout = settings.PREFERENCES_RESPONSE_CACHE_TTL
+                if replicas.replica_configured():
+                    timeout = min(timeout, settings.DATABASE_REPLICA_PIN_SECONDS)
+                cache.set(key, coalescing.freeze_response(response), timeout)
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate(user_ids):
+    """
+    Give :py:data:`~.ALL` and the scopes of the users with primary keys in *user_ids* new versions
+    once the current transaction, if any, commits.
+
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+    names = [_version_key(ALL)] + [_version_key(user_scope(pk)) for pk in set(user_ids)]
+    transaction.on_commit(lambda: cache.set_many(
+        {name: uuid.uuid4().hex for name in names}, None))
+
+
+def _render(request, response, *args, **kwargs):
+    """Render *response*, which is otherwise rendered after the view returns."""
+    if isinstance(response, Response):
+        # Django REST framework view methods return responses which have not yet been given a
+        # renderer by the view.
+        view = request.parser_context['view']
+        response = view.finalize_response(request, response, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        response = response.render()
+    return response
+
+
+def _response_key(cache, request, scopes):
+    """Return the cache key for the response to *request* at the current versions of *scopes*."""
+    names = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(names)
+    for name in names:
+        if name not in versions:
+            # Whichever request sets the version first decides it.
+            version = uuid.uuid4().hex
+            if not cache.add(name, version, None):
+                version = cache.get(name, version)
+            versions[name] = version
+
+    hasher = hashlib.sha256(coalescing.request_key(request).encode('utf8'))
+    for name in names:
+        hasher.update('\0{}={}'.format(name, versions[name]).encode('utf8'))
+    return '{}:{}'.format(KEY_PREFIX, hasher.hexdigest())
+
+
+def _version_key(scope):
+    return '{}:version:{}'.format(KEY_PREFIX, scope)
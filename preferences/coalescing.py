@@ -0,0 +1,197 @@
+"""
+Coalescing of identical concurrent requests.
+
+When many clients make the same expensive request at the same time, for example when a fleet of
+scheduled jobs all list preferences on the hour, each would normally compute the same response.
+Views decorated with :py:func:`~.coalesce` instead compute the response once. The first request,
+the *leader*, takes a lock in the cache named by the
+:py:data:`~preferences.defaultsettings.PREFERENCES_COALESCE_CACHE` setting and computes the
+response as usual. Identical requests which arrive while it does so, the *followers*, wait for the
+leader to store its response in the cache and return a copy of it.
+
+Requests are identical if they have the same method, path, query string, user and the request
+headers which affect the response. Only ``GET`` and ``HEAD`` requests are coalesced. A follower
+only ever receives a response computed after it arrived and so coalescing never returns a stale
+response. If the leader does not store a response within
+:py:data:`~preferences.defaultsettings.PREFERENCES_COALESCE_TIMEOUT` seconds, or its response
+cannot be shared because it is streamed, sets cookies or is not a 200 response, followers compute
+their own.
+
+A follower skips the view and so any checks the view makes of each request, such as Django REST
+framework's throttles. Pass a *check* function to :py:func:`~.coalesce` to make them before a
+request follows another.
+
+Coalescing across processes requires a cache shared between them. With a cache local to each
+process, only requests handled by threads of the same process are coalesced.
+
+"""
+import functools
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.dispatch import Signal
+from django.http import HttpResponse
+
+#: Prefix applied to all cache keys
+KEY_PREFIX = 'preferences:coalesce'
+
+#: Request headers which may change the response and so are part of a request's identity.
+VARY_HEADERS = (
+    'HTTP_ACCEPT', 'HTTP_ACCEPT_ENCODING', 'HTTP_AUTHORIZATION', 'HTTP_IF_NONE_MATCH',
+    'HTTP_IF_MODIFIED_SINCE',
+)
+
+#: Signal sent for each coalesced request with the argument *outcome*: ``"leader"`` if the request
+#: computed its response, ``"shared"`` if it received the leader's response or ``"unshared"`` if it
+#: waited but then had to compute its response itself.
+request_coalesced = Signal()
+
+# Value stored in place of a response which cannot be shared.
+_UNSHAREABLE = 'unshareable'
+
+# Response headers which are set afresh for each response and so are not copied to followers.
+_PER_RESPONSE_HEADERS = {'server-timing', 'set-cookie'}
+
+
+def coalesce(view_func, check=None):
+    """
+    Decorate a Django view so that identical concurrent requests to it are coalesced. If *check*
+    is not None, it is called with the request and the view's arguments before a request waits for
+    another's response. If it returns a response, that response is returned instead.
+
+    """
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view_func(request, *args, **kwargs)
+
+        cache = caches[settings.PREFERENCES_COALESCE_CACHE]
+        timeout = settings.PREFERENCES_COALESCE_TIMEOUT
+        lock_key = '{}:lock:{}'.format(KEY_PREFIX, request_key(request))
+
+        flight = uuid.uuid4().hex
+        if cache.add(lock_key, flight, timeout):
+            return _lead(cache, timeout, lock_key, flight, view_func, request, *args, **kwargs)
+
+        leader = cache.get(lock_key)
+        if leader is not None:
+            if check is not None:
+                response = check(request, *args, **kwargs)
+                if response is not None:
+                    return response
+            result = _follow(cache, timeout, lock_key, leader)
+            if result is not None:
+                request_coalesced.send(sender=coalesce, outcome='shared')
+                return thaw_response(result)
+            request_coalesced.send(sender=coalesce, outcome='unshared')
+
+        return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def request_key(request):
+    """Return a string which is the same for all requests which would have the same response."""
+    hasher = hashlib.sha256()
+    user = getattr(request, 'user', None)
+    parts = [
+        request.method, request.get_full_path(),
+        str(user.pk) if user is not None and user.is_authenticated else '',
+    ]
+    parts.extend(request.META.get(header, '') for header in VARY_HEADERS)
+    for part in parts:
+        hasher.update(part.encode('utf8'))
+        hasher.update(b'\0')
+    return hasher.hexdigest()
+
+
+def is_shareable(response):
+    """
+    Return True if a rendered *response* may be returned to other clients: it is a complete 200
+    response which sets no cookies.
+
+    """
+    return not response.streaming and response.status_code == 200 and not response.cookies
+
+
+def freeze_response(response):
+    """
+    Return a picklable copy of a rendered *response*, suitable for storing in a cache, omitting
+    headers which are specific to the original response. Pass it to :py:func:`~.thaw_response`
+    to create a new response.
+
+    """
+    return (
+        response.status_code,
+        [(header, value) for header, value in response.items()
+         if header.lower() not in _PER_RESPONSE_HEADERS],
+        response.content,
+    )
+
+
+def thaw_response(frozen):
+    """Return a new response from the copy returned by :py:func:`~.freeze_response`."""
+    status, headers, content = frozen
+    response = HttpResponse(content, status=status)
+    for header, value in headers:
+        response[header] = value
+    return response
+
+
+def _lead(cache, timeout, lock_key, flight, view_func, request, *args, **kwargs):
+    """Compute the response to *request* and share it with any followers."""
+    request_coalesced.send(sender=coalesce, outcome='leader')
+    result = _UNSHAREABLE
+    try:
+        response = view_func(request, *args, **kwargs)
+        # Django REST framework and template responses are rendered after the view returns.
+        if hasattr(response, 'render') and callable(response.render):
+            response = response.render()
+        if is_shareable(response):
+            result = freeze_response(response)
+        return response
+    finally:
+        # Responses are only stored if there is someone waiting for them. The response must be
+        # stored before the lock is released since followers stop waiting once it is.
+        result_key = _result_key(flight)
+        if cache.get(result_key + ':waiters'):
+            cache.set(result_key, result, timeout)
+        cache.delete(lock_key)
+
+
+def _follow(cache, timeout, lock_key, leader):
+    """
+    Wait for the request holding *lock_key*, whose flight is *leader*, to share its response and
+    return the response or None if it is not shared.
+
+    """
+    result_key = _result_key(leader)
+    waiters_key = result_key + ':waiters'
+    cache.add(waiters_key, 0, timeout)
+    try:
+        cache.incr(waiters_key)
+    except ValueError:
+        # The counter expired in the meantime and so the leader has long finished.
+        return None
+
+    deadline, delay = time.monotonic() + timeout, 0.005
+    while time.monotonic() < deadline:
+        result = cache.get(result_key)
+        if result is None and cache.get(lock_key) != leader:
+            # The leader has finished. Check once more in case it stored its response between
+            # the two cache lookups.
+            result = cache.get(result_key)
+            return result if result != _UNSHAREABLE else None
+        if result == _UNSHAREABLE:
+            return None
+        if result is not None:
+            return result
+        time.sleep(delay)
+        delay = min(2 * delay, 0.1)
+    return None
+
+
+def _result_key(flight):
+    return '{}:result:{}'.format(KEY_PREFIX, flight)
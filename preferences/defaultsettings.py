@@ -6,3 +6,74 @@ Default settings values for the :py:mod:`preferences` application.
 # used as default settings for the assets application. See .apps.Config how this is achieved. This
 # is a bit mucky but, at the moment, Django does not have a standard way to specify default values
 # for settings.  See: https://stackoverflow.com/questions/8428556/
+
+#: Alias of the cache in the ``CACHES`` setting used to cache responses from Lookup. Use a cache
+#: shared between processes, such as memcached, in production so that all web workers benefit.
+PREFERENCES_LOOKUP_CACHE = 'default'
+
+#: Number of seconds for which a cached Lookup response is considered fresh.
+PREFERENCES_LOOKUP_CACHE_TTL = 60 * 60
+
+#: Number of seconds after becoming stale for which a cached Lookup response is still returned
+#: while a fresh copy is fetched in the background.
+PREFERENCES_LOOKUP_CACHE_STALE_TTL = 24 * 60 * 60
+
+#: Alias of the cache in the ``CACHES`` setting used by
+#: :py:class:`~preferences.authentication.CachedTokenAuthentication` to cache authenticated API
+#: tokens.
+PREFERENCES_TOKEN_CACHE = 'default'
+
+#: Number of seconds for which an authenticated API token is cached. This bounds how long a
+#: change to a token or its user which is not seen by the cache, for example because it was made
+#: in another process with a cache local to each process, takes to have effect.
+PREFERENCES_TOKEN_CACHE_TTL = 60
+
+#: Alias of the cache in the ``CACHES`` setting used by the throttles in
+#: :py:mod:`preferences.throttling` to record request histories. Use a cache shared between
+#: processes in production so that limits apply across all web workers.
+PREFERENCES_THROTTLE_CACHE = 'default'
+
+#: Alias of the cache in the ``CACHES`` setting used to coalesce identical concurrent requests. See
+#: :py:mod:`preferences.coalescing`.
+PREFERENCES_COALESCE_CACHE = 'default'
+
+#: Maximum number of seconds for which a request waits for an identical request to finish before
+#: computing its response itself.
+PREFERENCES_COALESCE_TIMEOUT = 10
+
+#: Alias of the cache in the ``CACHES`` setting used to store rendered responses or None, the
+#: default, to not cache responses. See :py:mod:`preferences.caching`. The cache must be shared
+#: between all web workers, since a response cached by one worker is only invalidated when the
+#: worker which saves a preference records a new version in the same cache. A cache local to each
+#: process is rejected by a system check.
+PREFERENCES_RESPONSE_CACHE = None
+
+#: Number of seconds after which a cached response is discarded. Cached responses are invalidated
+#: as soon as the preferences they depend on change and so this only limits the space used by
+#: responses which are no longer requested.
+PREFERENCES_RESPONSE_CACHE_TTL = 60 * 60
+
+#: Default number of times a background job is started before it is marked as failed. See
+#: :py:mod:`preferences.jobs`.
+PREFERENCES_JOB_MAX_ATTEMPTS = 3
+
+#: Default number of seconds before a failed background job is first retried. Each further retry
+#: waits twice as long.
+PREFERENCES_JOB_RETRY_DELAY = 60
+
+#: Number of seconds a worker may run a background job for before the job is assumed to have been
+#: abandoned and may be started by another worker.
+PREFERENCES_JOB_LEASE = 60 * 60
+
+#: Number of seconds after being inserted before preferences are returned by the changes feed.
+#: This must exceed the time for which a transaction which inserts preferences stays open after
+#: inserting them, since preferences from such a transaction may become visible after those with
+#: larger ids. See :py:meth:`preferences.views.PreferenceViewSet.changes`.
+PREFERENCES_CHANGES_DELAY = 30
+
+#: Number of rows fetched from the database at a time when streaming preference reports.
+PREFERENCES_EXPORT_CHUNK_SIZE = 2000
+
+#: Number of days for which superseded preferences are kept in the preference table before the
+#: ``archivepreferences`` management command archives them. See :py:mod:`preferences.archival`.
+PREFERENCES_HISTORY_RETENTION_DAYS = 2 * 365
@@ -0,0 +1,54 @@
+"""
+Filters for the Lecture Capture Preferences API.
+
+"""
+from django_filters import rest_framework as filters
+
+from . import models
+
+
+class PreferenceFilter(filters.FilterSet):
+    """
+    Filter preferences by user, department and when they were expressed.
+
+    """
+    #: Only include preferences for the user with this username.
+    user = filters.CharFilter(field_name='user__username', help_text='Username of user')
+
+    #: Only include preferences for this department.
+    institution = filters.CharFilter(
+        field_name='institution', help_text='Lookup institution id of department')
+
+    #: Only include preferences expressed at or after this time.
+    updated_since = filters.IsoDateTimeFilter(
+        field_name='created_at', lookup_expr='gte',
+        help_text='Only include preferences expressed at or after this ISO 8601 date and time')
+
+    class Meta:
+        model = models.Preference
+        fields = ('user', 'institution', 'updated_since')
+
+
+class PreferenceSummaryFilter(filters.FilterSet):
+    """
+    Filter preference summaries by department and term. Unless a term is given, only summaries of
+    current preferences are included.
+
+    """
+    #: Only include the summary for this department.
+    institution = filters.CharFilter(
+        field_name='institution', help_text='Lookup institution id of department')
+
+    #: Only include summaries for this term.
+    term = filters.CharFilter(
+        field_name='term',
+        help_text='Term, such as "2026-michaelmas". Omit for current preferences')
+
+    class Meta:
+        model = models.PreferenceSummary
+        fields = ('institution', 'term')
+
+    def filter_queryset(self, queryset):
+        if self.form.cleaned_data.get('term') in (None, ''):
+            queryset = queryset.filter(term='')
+        return super().filter_queryset(queryset)
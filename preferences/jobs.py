@@ -0,0 +1,286 @@
+"""
+A lightweight background job queue stored in the database.
+
+Work which takes too long to do within a request, such as refreshing Lookup data for every user
+or building a large report, is instead queued as a :py:class:`~preferences.models.Job` and run by
+the ``runjobs`` management command. No message broker is needed: workers poll the job table.
+
+Functions are made available to run as jobs by decorating them with :py:func:`~.task`. Queue a
+job by calling the task's ``enqueue()`` method, or :py:func:`~.enqueue`, with the keyword
+arguments to pass to it. Arguments and return values must be serialisable as JSON.
+
+.. code-block:: python
+
+    @jobs.task(max_attempts=5)
+    def refresh_person(crsid):
+        ...
+
+    job = refresh_person.enqueue(crsid='spqr1', dedup_key='refresh_person:spqr1')
+
+Jobs which raise an exception are retried up to their task's *max_attempts* times with an
+exponentially increasing delay starting at *retry_delay* seconds. Queuing a job with the same
+*dedup_key* as a job which is pending or running returns the existing job rather than queuing
+another.
+
+Workers claim jobs by atomically marking them as running with a lease of
+:py:data:`~preferences.defaultsettings.PREFERENCES_JOB_LEASE` seconds. A job whose lease expires
+before it finishes, for example because its worker was killed, is started again by another worker
+or, if it has no attempts left, marked as failed. Tasks should therefore be safe to run more than
+once.
+
+"""
+import concurrent.futures
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+
+import django
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Q, TextField, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from . import models
+
+LOG = logging.getLogger(__name__)
+
+# Registered tasks keyed by name
+_tasks = {}
+
+
+class Task:
+    """
+    A function which may be run as a job. Create instances with the :py:func:`~.task` decorator.
+    Calling a task calls the function directly.
+
+    """
+    def __init__(self, func, name, max_attempts=None, retry_delay=None):
+        self.func = func
+        self.name = name
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+
+    @property
+    def max_attempts(self):
+        return (
+            self._max_attempts if self._max_attempts is not None
+            else settings.PREFERENCES_JOB_MAX_ATTEMPTS
+        )
+
+    @property
+    def retry_delay(self):
+        return (
+            self._retry_delay if self._retry_delay is not None
+            else settings.PREFERENCES_JOB_RETRY_DELAY
+        )
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, dedup_key=None, run_after=None, **kwargs):
+        """Queue a job running this task. See :py:func:`~.enqueue`."""
+        return enqueue(self.name, dedup_key=dedup_key, run_after=run_after, **kwargs)
+
+
+def task(name=None, max_attempts=None, retry_delay=None):
+    """
+    Decorate a function to register it as a task which may be run as a job. The task is named
+    *name*, which defaults to the function's module and name. Any argument which is None is taken
+    from the corresponding ``PREFERENCES_JOB_...`` setting.
+
+    :param max_attempts: Number of times a job is started before it is marked as failed.
+    :param retry_delay: Seconds to wait before the first retry. Each further retry waits twice as
+        long as the previous one.
+
+    """
+    def decorator(func):
+        registered = Task(
+            func, name if name is not None else '{}.{}'.format(func.__module__, func.__name__),
+            max_attempts=max_attempts, retry_delay=retry_delay)
+        _tasks[registered.name] = registered
+        return registered
+    return decorator
+
+
+def get_task(name):
+    """Return the registered :py:class:`~.Task` called *name*. Raises KeyError if none is."""
+    return _tasks[name]
+
+
+def enqueue(task, dedup_key=None, run_after=None, **kwargs):
+    """
+    Queue a job which runs *task*, a :py:class:`~.Task` or task name, with the passed keyword
+    arguments and return the :py:class:`~preferences.models.Job`. The job is not started before
+    *run_after*, which defaults to now.
+
+    If *dedup_key* is not None and a pending or running job has the same key, no job is queued and
+    the existing job is returned instead.
+
+    """
+    registered = get_task(task.name if isinstance(task, Task) else task)
+    fields = {
+        'task': registered.name,
+        'arguments': json.dumps(kwargs, sort_keys=True),
+        'dedup_key': dedup_key,
+        'max_attempts': registered.max_attempts,
+        'run_after': run_after if run_after is not None else timezone.now(),
+    }
+
+    # The unique constraint on dedup_key means that only one of several concurrent attempts to
+    # queue equivalent jobs succeeds. The others then find the job it created, unless that job
+    # finished in the meantime, in which case they try again.
+    for _ in range(3):
+        try:
+            with transaction.atomic():
+                return models.Job.objects.create(**fields)
+        except IntegrityError:
+            if dedup_key is None:
+                raise
+            existing = models.Job.objects.filter(dedup_key=dedup_key).first()
+            if existing is not None:
+                return existing
+    return models.Job.objects.create(**fields)
+
+
+def claim(worker, limit=1):
+    """
+    Mark up to *limit* jobs which are due to run as running on behalf of *worker* and return a
+    list of their primary keys. Running jobs whose lease has expired and which have no attempts
+    left are marked as failed.
+
+    """
+    now = timezone.now()
+    expired = Q(state=models.Job.RUNNING, lease_expires_at__lt=now)
+    models.Job.objects.filter(expired, attempts__gte=F('max_attempts')).update(
+        state=models.Job.FAILED, dedup_key=None, lease_expires_at=None, finished_at=now,
+        error=Concat(
+            Value('The job was abandoned by worker '), F('worker'), Value(' before it finished'),
+            output_field=TextField()))
+
+    claimable = Q(state=models.Job.PENDING, run_after__lte=now) | expired
+    # Fetch a few more candidates than needed since other workers may claim some first.
+    candidates = list(
+        models.Job.objects.filter(claimable)
+        .order_by('run_after', 'id').values_list('id', flat=True)[:2 * limit]
+    )
+
+    claimed = []
+    lease_expires_at = now + datetime.timedelta(seconds=settings.PREFERENCES_JOB_LEASE)
+    for pk in candidates:
+        if len(claimed) >= limit:
+            break
+        # Whichever worker's update matches the job first claims it.
+        updated = models.Job.objects.filter(claimable, pk=pk).update(
+            state=models.Job.RUNNING, worker=worker, attempts=F('attempts') + 1,
+            started_at=now, lease_expires_at=lease_expires_at)
+        if updated == 1:
+            claimed.append(pk)
+    return claimed
+
+
+def run(pk):
+    """Run the job with primary key *pk*, which must have been claimed, and record the outcome."""
+    job = models.Job.objects.get(pk=pk)
+    # Only record the outcome if the job has not been claimed again after its lease expired.
+    claimed = models.Job.objects.filter(pk=pk, state=models.Job.RUNNING, attempts=job.attempts)
+    try:
+        registered = get_task(job.task)
+        LOG.info('Starting %s (attempt %s of %s)', job, job.attempts, job.max_attempts)
+        result = json.dumps(registered.func(**json.loads(job.arguments)))
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if job.task in _tasks and job.attempts < job.max_attempts:
+            delay = get_task(job.task).retry_delay * 2 ** (job.attempts - 1)
+            LOG.warning('%s failed and will be retried in %ss', job, delay, exc_info=True)
+            claimed.update(
+                state=models.Job.PENDING, error=error, lease_expires_at=None,
+                run_after=now + datetime.timedelta(seconds=delay))
+        else:
+            LOG.error('%s failed', job, exc_info=True)
+            claimed.update(
+                state=models.Job.FAILED, error=error, dedup_key=None, lease_expires_at=None,
+                finished_at=now)
+    else:
+        LOG.info('%s succeeded', job)
+        claimed.update(
+            state=models.Job.SUCCEEDED, result=result, error='', dedup_key=None,
+            lease_expires_at=None, finished_at=timezone.now())
+
+
+class Worker:
+    """
+    Claim and run jobs using a pool of *concurrency* threads or, if *processes* is True,
+    processes. When no jobs are due, the worker checks again every *poll_interval* seconds.
+
+    """
+    def __init__(self, concurrency=1, processes=False, poll_interval=1.0, name=None):
+        self.concurrency = concurrency
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self.name = name if name is not None else '{}:{}'.format(socket.gethostname(), os.getpid())
+        self._stopping = False
+
+    def run(self, burst=False):
+        """
+        Run jobs until :py:meth:`~.stop` is called or, if *burst* is True, until no jobs are due.
+        Return the number of jobs run.
+
+        """
+        if self.processes:
+            # Worker processes are started afresh rather than forked so that they do not share
+            # this process's database connections.
+            executor = concurrent.futures.ProcessPoolExecutor(
+                self.concurrency, mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                self.concurrency, thread_name_prefix='job')
+
+        running, count = set(), 0
+        with executor:
+            while not self._stopping:
+                claimed = []
+                if len(running) < self.concurrency:
+                    claimed = claim(self.name, self.concurrency - len(running))
+                for pk in claimed:
+                    running.add(executor.submit(_run_and_close, pk))
+                count += len(claimed)
+
+                if len(claimed) == 0 and len(running) == 0 and burst:
+                    break
+                if len(claimed) == 0 or len(running) >= self.concurrency:
+                    running = self._wait(running)
+        return count
+
+    def stop(self):
+        """Stop claiming jobs. Jobs which are running are allowed to finish."""
+        self._stopping = True
+
+    def _wait(self, running):
+        """Wait for a job to finish or the poll interval to elapse and return those running."""
+        if len(running) == 0:
+            time.sleep(self.poll_interval)
+            return running
+        done, running = concurrent.futures.wait(
+            running, timeout=self.poll_interval,
+            return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            # Exceptions raised by tasks are recorded by run(). Others are unexpected.
+            if future.exception() is not None:
+                LOG.error('Error running job', exc_info=future.exception())
+        return running
+
+
+def _run_and_close(pk):
+    try:
+        run(pk)
+    finally:
+        # Each thread has its own database connections which would otherwise be left open.
+        connections.close_all()
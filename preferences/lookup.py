@@ -0,0 +1,279 @@
+"""
+Cached access to person and institution information held in Lookup.
+
+Every attribute of a user beyond their CRSid, such as their name or the institutions they are a
+member of, comes from Lookup and each Lookup request is a round-trip to a remote service. The
+:py:class:`~.LookupCache` class memoises Lookup responses in one of the caches configured in
+Django's ``CACHES`` setting. Cached entries are *fresh* for
+:py:data:`~preferences.defaultsettings.PREFERENCES_LOOKUP_CACHE_TTL` seconds. After that they are
+*stale* for a further
+:py:data:`~preferences.defaultsettings.PREFERENCES_LOOKUP_CACHE_STALE_TTL` seconds during which
+they are still returned immediately but are refreshed from Lookup in the background.
+
+Fetching a list of people or institutions makes one cache request and at most one Lookup request
+per :py:data:`~.MAX_BATCH_SIZE` entries which are not already cached.
+
+The client used to talk to Lookup is pluggable. Any object with ``get_people()`` and
+``get_institutions()`` methods with the same signatures as :py:class:`~.IbisLookupClient` may be
+used.
+
+"""
+import concurrent.futures
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.dispatch import Signal
+
+LOG = logging.getLogger(__name__)
+
+#: Maximum number of identifiers passed to Lookup in a single request. Lookup limits the length of
+#: the URL and so only a few hundred identifiers may be requested at once.
+MAX_BATCH_SIZE = 100
+
+#: How long, in seconds, a background refresh of a stale entry may take before another refresh may
+#: be started.
+REFRESH_LOCK_TIMEOUT = 60
+
+#: Signal sent each time the cache is consulted with the arguments *kind*, either ``"person"`` or
+#: ``"inst"``, and the number of *hits* and *misses*. Stale entries count as hits.
+cache_accessed = Signal()
+
+# Executor used for background refreshes. Created on first use.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _default_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix='lookup-refresh')
+    return _executor
+
+
+class IbisLookupClient:
+    """
+    A Lookup client which uses the ibisclient library bundled with :py:mod:`ucamlookup`.
+
+    People are returned as dictionaries with the keys ``crsid``, ``visible_name`` and
+    ``institutions``, the latter being a list of instids. Institutions are returned as dictionaries
+    with the keys ``instid`` and ``name``. Identifiers which Lookup does not know about are omitted
+    from the results.
+
+    """
+    def __init__(self, connection=None):
+        self._connection = connection
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            from ucamlookup.utils import get_connection
+            self._connection = get_connection()
+        return self._connection
+
+    def get_people(self, crsids):
+        """Return a dictionary mapping CRSids to people."""
+        from ucamlookup.ibisclient import PersonMethods
+        people = PersonMethods(self.connection).listPeople(','.join(crsids), fetch='all_insts')
+        return {
+            person.identifier.value: {
+                'crsid': person.identifier.value,
+                'visible_name': person.visibleName,
+                'institutions': [inst.instid for inst in (person.institutions or [])],
+            }
+            for person in people
+        }
+
+    def get_institutions(self, instids):
+        """Return a dictionary mapping instids to institutions."""
+        from ucamlookup.ibisclient import InstitutionMethods
+        insts = InstitutionMethods(self.connection).listInsts(','.join(instids))
+        return {inst.instid: {'instid': inst.instid, 'name': inst.name} for inst in insts}
+
+
+class LookupCache:
+    """
+    Cache responses from a Lookup client. Any argument which is None is taken from the
+    corresponding ``PREFERENCES_LOOKUP_...`` setting when used.
+
+    :param client: Lookup client. Defaults to a :py:class:`~.IbisLookupClient`.
+    :param cache_alias: Alias of the Django cache to use.
+    :param ttl: Number of seconds for which entries are fresh.
+    :param stale_ttl: Number of seconds after becoming stale for which entries are still used.
+    :param executor: A :py:class:`concurrent.futures.Executor` used to refresh stale entries.
+
+    """
+    #: Prefix applied to all cache keys
+    key_prefix = 'preferences:lookup'
+
+    def __init__(self, client=None, cache_alias=None, ttl=None, stale_ttl=None, executor=None):
+        self._client = client
+        self._cache_alias = cache_alias
+        self._ttl = ttl
+        self._stale_ttl = stale_ttl
+        self._executor = executor
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = IbisLookupClient()
+        return self._client
+
+    @property
+    def cache(self):
+        return caches[self._cache_alias or settings.PREFERENCES_LOOKUP_CACHE]
+
+    @property
+    def ttl(self):
+        return self._ttl if self._ttl is not None else settings.PREFERENCES_LOOKUP_CACHE_TTL
+
+    @property
+    def stale_ttl(self):
+        return (
+            self._stale_ttl if self._stale_ttl is not None
+            else settings.PREFERENCES_LOOKUP_CACHE_STALE_TTL
+        )
+
+    @property
+    def executor(self):
+        return self._executor if self._executor is not None else _default_executor()
+
+    def get_person(self, crsid):
+        """Return the person with the given CRSid or None if they do not exist."""
+        return self.get_people([crsid]).get(crsid)
+
+    def get_people(self, crsids):
+        """
+        Return a dictionary mapping CRSids to people for the given CRSids. CRSids which do not
+        correspond to a person are omitted.
+
+        """
+        return self._get_many('person', crsids, self.client.get_people)
+
+    def get_institution(self, instid):
+        """Return the institution with the given instid or None if it does not exist."""
+        return self.get_institutions([instid]).get(instid)
+
+    def get_institutions(self, instids):
+        """
+        Return a dictionary mapping instids to institutions for the given instids. Instids which do
+        not correspond to an institution are omitted.
+
+        """
+        return self._get_many('inst', instids, self.client.get_institutions)
+
+    def prefetch_people(self, crsids):
+        """
+        Ensure that the given people are cached, fetching any which are not in batches. Use this
+        before rendering a list of users so that the subsequent per-user lookups hit the cache.
+
+        """
+        self.get_people(crsids)
+
+    def refresh_people(self, crsids):
+        """
+        Fetch the given people from Lookup in batches and replace any cached copies, whether or not
+        they are stale. Return the number found in Lookup.
+
+        """
+        values = self._fetch('person', list(dict.fromkeys(crsids)), self.client.get_people)
+        return sum(1 for value in values.values() if value is not None)
+
+    def refresh_institutions(self, instids):
+        """
+        Fetch the given institutions from Lookup in batches and replace any cached copies. Return
+        the number found in Lookup.
+
+        """
+        values = self._fetch('inst', list(dict.fromkeys(instids)), self.client.get_institutions)
+        return sum(1 for value in values.values() if value is not None)
+
+    def invalidate_people(self, crsids):
+        """Remove the given people from the cache."""
+        self.cache.delete_many([self._key('person', crsid) for crsid in crsids])
+
+    def invalidate_institutions(self, instids):
+        """Remove the given institutions from the cache."""
+        self.cache.delete_many([self._key('inst', instid) for instid in instids])
+
+    def _key(self, kind, identifier):
+        return '{}:{}:{}'.format(self.key_prefix, kind, identifier)
+
+    def _get_many(self, kind, identifiers, fetch):
+        identifiers = list(dict.fromkeys(identifiers))
+        entries = self.cache.get_many([self._key(kind, i) for i in identifiers])
+
+        now = time.time()
+        results, missing, stale = {}, [], []
+        for identifier in identifiers:
+            entry = entries.get(self._key(kind, identifier))
+            if entry is None:
+                missing.append(identifier)
+                continue
+            results[identifier] = entry['value']
+            if now - entry['fetched_at'] > self.ttl:
+                stale.append(identifier)
+
+        cache_accessed.send(
+            sender=self.__class__, kind=kind, hits=len(results), misses=len(missing))
+
+        if len(missing) > 0:
+            results.update(self._fetch(kind, missing, fetch))
+
+        if len(stale) > 0:
+            self._revalidate(kind, stale, fetch)
+
+        # Identifiers not found in Lookup are cached as None so that we do not repeatedly ask
+        # Lookup for them. Omit them from the results.
+        return {identifier: value for identifier, value in results.items() if value is not None}
+
+    def _fetch(self, kind, identifiers, fetch):
+        """Fetch identifiers from Lookup in batches and store the results in the cache."""
+        values = {}
+        for start in range(0, len(identifiers), MAX_BATCH_SIZE):
+            values.update(fetch(identifiers[start:start + MAX_BATCH_SIZE]))
+
+        fetched_at = time.time()
+        values = {identifier: values.get(identifier) for identifier in identifiers}
+        self.cache.set_many(
+            {
+                self._key(kind, identifier): {'value': value, 'fetched_at': fetched_at}
+                for identifier, value in values.items()
+            },
+            timeout=self.ttl + self.stale_ttl
+        )
+        return values
+
+    def _revalidate(self, kind, identifiers, fetch):
+        """
+        Schedule a background refresh of stale identifiers. A lock is taken in the cache for each
+        identifier so that only one refresh is in flight for an identifier at any time, even across
+        processes sharing the cache.
+
+        """
+        lock_keys = {}
+        for identifier in identifiers:
+            lock_key = self._key(kind, identifier) + ':refreshing'
+            if self.cache.add(lock_key, True, timeout=REFRESH_LOCK_TIMEOUT):
+                lock_keys[identifier] = lock_key
+
+        if len(lock_keys) == 0:
+            return
+
+        def refresh():
+            try:
+                self._fetch(kind, list(lock_keys.keys()), fetch)
+            except Exception:
+                LOG.exception('Error refreshing stale Lookup %s entries', kind)
+            finally:
+                self.cache.delete_many(list(lock_keys.values()))
+
+        self.executor.submit(refresh)
+
+
+#: A shared :py:class:`~.LookupCache` configured from settings.
+lookup_cache = LookupCache()
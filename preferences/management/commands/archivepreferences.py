@@ -0,0 +1,77 @@
+"""
+Archive superseded preferences in batches.
+
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from preferences import archival
+from preferences import bulk
+
+
+class Command(BaseCommand):
+    help = (
+        'Move superseded preferences older than the retention period out of the preference table '
+        'into the archived preference table or a gzip-compressed JSON Lines file. The latest '
+        'preference of each user in each term is kept. Preferences are archived in batches, each '
+        'in its own short transaction.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days', type=int, default=settings.PREFERENCES_HISTORY_RETENTION_DAYS,
+            help='Number of days for which superseded preferences are kept (default: {})'.format(
+                settings.PREFERENCES_HISTORY_RETENTION_DAYS))
+        parser.add_argument(
+            '--output',
+            help='Append archived preferences to this gzip-compressed JSON Lines file rather '
+                 'than the archived preference table')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of preferences archived by each transaction (default: 5000)')
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds to wait between batches (default: 0)')
+
+    def handle(self, *args, **options):
+        batch_size, retention_days = options['batch_size'], options['retention_days']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+        if retention_days < 0:
+            raise CommandError('--retention-days must not be negative')
+        before = timezone.now() - datetime.timedelta(days=retention_days)
+
+        archive_file = None
+        if options['output'] is not None:
+            archive_file = archival.ArchiveFile(options['output'])
+
+        start, archived, batches = time.monotonic(), 0, 0
+        try:
+            for term in archival.terms(before):
+                queryset = archival.superseded(term, before).order_by('id')
+                if archive_file is not None:
+                    queryset = queryset.select_related('user')
+                last_id = 0
+                while True:
+                    preferences = list(queryset.filter(id__gt=last_id)[:batch_size])
+                    if len(preferences) == 0:
+                        break
+                    if batches > 0 and options['pause'] > 0:
+                        time.sleep(options['pause'])
+                    archived += archival.archive(preferences, archive_file)
+                    batches += 1
+                    last_id = preferences[-1].id
+                    self.stdout.write('{}: archived {} preference(s), {} in total'.format(
+                        term, len(preferences), archived))
+                    if len(preferences) < batch_size:
+                        break
+        finally:
+            if archive_file is not None:
+                archive_file.close()
+
+        self.stdout.write('Archived {} in {} batch(es)'.format(
+            bulk.describe_rate(archived, time.monotonic() - start), batches))
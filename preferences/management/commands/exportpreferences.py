@@ -0,0 +1,61 @@
+"""
+Export preferences to a CSV or JSON Lines file.
+
+"""
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from preferences import bulk
+from preferences import models
+
+
+class Command(BaseCommand):
+    help = (
+        'Export preferences to a CSV or JSON Lines file. By default only the current '
+        'preference for each user is exported. Preferences are streamed from the database in '
+        'chunks so memory use is constant.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='File to export to or "-" for standard output')
+        parser.add_argument(
+            '--format', choices=bulk.FORMATS,
+            help='File format. By default this is guessed from the file extension')
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Number of rows fetched from the database at a time (default: 2000)')
+        parser.add_argument(
+            '--all', action='store_true', dest='all_history',
+            help='Export the entire preference history rather than current preferences')
+
+    def handle(self, *args, **options):
+        path, chunk_size = options['path'], options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+        format = options['format'] or ('csv' if path == '-' else bulk.guess_format(path))
+        if format is None:
+            raise CommandError('Cannot guess format of "{}": use --format'.format(path))
+
+        queryset = models.Preference.objects.select_related('user').order_by('created_at', 'id')
+        if not options['all_history']:
+            queryset = queryset.current()
+
+        start = time.monotonic()
+        stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf8')
+        try:
+            writer = bulk.RecordWriter(stream, format)
+            writer.write_header()
+            count = 0
+            for preference in queryset.iterator(chunk_size=chunk_size):
+                writer.write(bulk.preference_to_record(preference))
+                count += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        # Report on stderr if the export itself is written to standard output.
+        (self.stderr if path == '-' else self.stdout).write(
+            'Exported ' + bulk.describe_rate(count, time.monotonic() - start))
@@ -0,0 +1,62 @@
+"""
+Import preferences from a CSV or JSON Lines file.
+
+"""
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from preferences import bulk
+
+
+class Command(BaseCommand):
+    help = (
+        'Import preferences from a CSV or JSON Lines file. Each record has the fields: '
+        + ', '.join(bulk.FIELDS) + '. The file is streamed and inserted in batches so memory use '
+        'is constant.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='File to import from or "-" for standard input')
+        parser.add_argument(
+            '--format', choices=bulk.FORMATS,
+            help='File format. By default this is guessed from the file extension')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of records inserted per transaction (default: 1000)')
+        parser.add_argument(
+            '--create-users', action='store_true',
+            help='Create users which do not exist rather than skipping their records')
+
+    def handle(self, *args, **options):
+        path, chunk_size = options['path'], options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+        format = options['format'] or bulk.guess_format(path)
+        if format is None:
+            raise CommandError('Cannot guess format of "{}": use --format'.format(path))
+
+        start = time.monotonic()
+
+        def report(totals):
+            if options['verbosity'] >= 2:
+                self.stdout.write(bulk.describe_rate(
+                    totals['imported'] + totals['skipped'], time.monotonic() - start))
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf8')
+        try:
+            totals = bulk.import_records(
+                bulk.read_records(stream, format), chunk_size=chunk_size,
+                create_users=options['create_users'], on_chunk=report)
+        except bulk.RecordError as e:
+            raise CommandError('Error importing {}: {}'.format(path, e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(
+            'Imported {imported} preferences, skipped {skipped}, created {users_created} '
+            'users. '.format(**totals) + bulk.describe_rate(
+                totals['imported'] + totals['skipped'], time.monotonic() - start))
@@ -0,0 +1,80 @@
+"""
+Report the time taken to start the application, broken down by installed app.
+
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from preferences import startup
+
+
+class Command(BaseCommand):
+    help = (
+        'Report the time taken to import each installed app, import its models and run its '
+        'ready() method, followed by the time taken to load the URLconf and WSGI application. '
+        'Each measurement is made in a fresh Python process so that nothing is already imported.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Number of processes to measure. The median of each timing is reported '
+                 '(default: 3)')
+        parser.add_argument(
+            '--modules', type=int, default=0, metavar='N',
+            help='Also report the N top-level modules with the largest cumulative import time')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be positive')
+
+        runs = [self._measure(options['modules'] > 0) for _ in range(options['repeat'])]
+
+        def median(get):
+            return statistics.median(get(run) for run in runs)
+
+        self.stdout.write('{:<32} {:>9} {:>9} {:>9} {:>9}'.format(
+            'app', 'import', 'models', 'ready', 'total'))
+        for label in runs[0]['apps']:
+            timings = [median(lambda run: run['apps'][label][phase]) for phase in startup.PHASES]
+            self.stdout.write('{:<32} {:>7.1f}ms {:>7.1f}ms {:>7.1f}ms {:>7.1f}ms'.format(
+                label, *(1000 * timing for timing in timings), 1000 * sum(timings)))
+
+        self.stdout.write('')
+        for step in ('setup', 'urls', 'wsgi', 'total'):
+            self.stdout.write('{:<32} {:>7.1f}ms'.format(
+                step, 1000 * median(lambda run: run['steps'][step])))
+
+        if options['modules'] > 0:
+            modules = {}
+            for run in runs:
+                for name, duration in run['modules'].items():
+                    modules.setdefault(name, []).append(duration)
+            slowest = sorted(
+                ((statistics.median(durations), name) for name, durations in modules.items()),
+                reverse=True)
+            self.stdout.write('')
+            self.stdout.write('{:<32} {:>9}'.format('module', 'import'))
+            for duration, name in slowest[:options['modules']]:
+                self.stdout.write('{:<32} {:>7.1f}ms'.format(name, 1000 * duration))
+
+    def _measure(self, importtime):
+        """Measure start up in a new process and return its timings."""
+        args = [sys.executable]
+        if importtime:
+            args.extend(['-X', 'importtime'])
+        args.extend(['-m', startup.__name__])
+        process = subprocess.run(
+            args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+            cwd=settings.BASE_DIR)
+        if process.returncode != 0:
+            raise CommandError('Profiling start up failed:\n{}'.format(process.stderr))
+        # Settings modules may print to standard output and so the timings are on the last line.
+        timings = json.loads(process.stdout.strip().splitlines()[-1])
+        timings['modules'] = startup.parse_importtime(process.stderr) if importtime else {}
+        return timings
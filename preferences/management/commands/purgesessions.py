@@ -0,0 +1,55 @@
+"""
+Delete expired sessions from the database in batches.
+
+"""
+import importlib
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired sessions from the database. Unlike clearsessions, sessions are deleted '
+        'in batches, each in its own short transaction, so that the session table is not locked '
+        'for long while logins continue. Does nothing if sessions are not stored in the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of sessions deleted by each query (default: 5000)')
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds to wait between batches (default: 0)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        store_class = importlib.import_module(settings.SESSION_ENGINE).SessionStore
+        if not hasattr(store_class, 'get_model_class'):
+            self.stdout.write('Sessions are not stored in the database: nothing to do')
+            return
+        model = store_class.get_model_class()
+
+        # Sessions which expire while the command runs are left for the next run so that the
+        # number of batches is bounded.
+        now, deleted, batches = timezone.now(), 0, 0
+        while True:
+            keys = list(
+                model.objects.filter(expire_date__lt=now)
+                .values_list('session_key', flat=True)[:batch_size])
+            if len(keys) == 0:
+                break
+            deleted += model.objects.filter(session_key__in=keys).delete()[0]
+            batches += 1
+            if len(keys) < batch_size:
+                break
+            if options['pause'] > 0:
+                time.sleep(options['pause'])
+
+        self.stdout.write('Deleted {} expired session(s) in {} batch(es)'.format(deleted, batches))
@@ -0,0 +1,21 @@
+"""
+Rebuild preference summaries from the preference history.
+
+"""
+from django.core.management.base import BaseCommand
+
+from preferences import models
+from preferences import summaries
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the summaries of preferences by institution and term from the preference '
+        'history. Summaries are usually maintained as preferences are expressed. Run this after '
+        'changing preferences by other means, such as directly in the database.'
+    )
+
+    def handle(self, *args, **options):
+        summaries.refresh()
+        self.stdout.write('Rebuilt {} summary row(s)'.format(
+            models.PreferenceSummary.objects.count()))
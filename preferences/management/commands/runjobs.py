@@ -0,0 +1,56 @@
+"""
+Run background jobs queued in the database.
+
+"""
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from preferences import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Run background jobs queued in the database using a pool of threads or processes. Runs '
+        'until interrupted, finishing any jobs which have been started, unless --burst is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Number of jobs run at once (default: 1)')
+        parser.add_argument(
+            '--processes', action='store_true',
+            help='Run jobs in a pool of processes rather than threads. Use this for jobs which '
+                 'are limited by CPU rather than by waiting for the database or Lookup')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds between checks for new jobs when none are due (default: 1)')
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Exit once there are no jobs due rather than waiting for more')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be positive')
+        if options['poll_interval'] <= 0:
+            raise CommandError('--poll-interval must be positive')
+
+        worker = jobs.Worker(
+            concurrency=options['concurrency'], processes=options['processes'],
+            poll_interval=options['poll_interval'])
+
+        def stop(signum, frame):
+            self.stderr.write('Stopping once running jobs have finished')
+            worker.stop()
+
+        previous = {
+            signum: signal.signal(signum, stop) for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        try:
+            count = worker.run(burst=options['burst'])
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+        self.stdout.write('Ran {} job(s)'.format(count))
@@ -0,0 +1,40 @@
+"""
+Render the OpenAPI schema and write it to the directory from which it is served.
+
+"""
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from project import schema
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the OpenAPI schema in each format and write it to the API_SCHEMA_ROOT directory, '
+        'from which it is then served instead of being generated on the first request to each '
+        'process.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output-dir', default=getattr(settings, 'API_SCHEMA_ROOT', None),
+            help='Directory to write the schema to (default: the API_SCHEMA_ROOT setting)')
+        parser.add_argument(
+            '--format', action='append', choices=list(schema.FORMATS), dest='formats',
+            help='Format to write. May be given more than once (default: all formats)')
+
+    def handle(self, *args, **options):
+        if options['output_dir'] is None:
+            raise CommandError('--output-dir must be given if API_SCHEMA_ROOT is not set')
+
+        os.makedirs(options['output_dir'], exist_ok=True)
+        for format in options['formats'] or schema.FORMATS:
+            path = schema.schema_path(format, root=options['output_dir'])
+            # Write to a temporary file first so that the schema is never served part written.
+            temporary = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temporary, 'wb') as fobj:
+                fobj.write(schema.render_schema(format))
+            os.replace(temporary, path)
+            self.stdout.write('Wrote {}'.format(path))
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Preference',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('institution', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('allow_capture', models.BooleanField()),
+                ('request_hold', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='preferences', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-created_at', '-id'),
+                'get_latest_by': 'created_at',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='preference',
+            index=models.Index(fields=['user', 'created_at'], name='preference_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preferences', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='preference',
+            index=models.Index(fields=['created_at', 'id'], name='preference_created_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preferences', '0003_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreferenceSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('institution', models.CharField(blank=True, max_length=255)),
+                ('term', models.CharField(blank=True, max_length=32)),
+                ('allow_capture_count', models.IntegerField(default=0)),
+                ('deny_capture_count', models.IntegerField(default=0)),
+                ('request_hold_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'preference summaries',
+                'ordering': ('term', 'institution'),
+                'unique_together': {('term', 'institution')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('preferences', '0004_preferencesummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPreference',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('institution', models.CharField(blank=True, max_length=255)),
+                ('allow_capture', models.BooleanField()),
+                ('request_hold', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_preferences', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-created_at', '-id'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedpreference',
+            index=models.Index(fields=['user', 'created_at'], name='archived_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:18
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preferences', '0005_archivedpreference'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='preference',
+            name='recorded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preferences', '0006_preference_recorded_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreferenceDeletions',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'preference deletions',
+            },
+        ),
+    ]
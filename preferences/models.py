@@ -1,3 +1,288 @@
-# from django.db import models
+"""
+Models for Lecture Capture Preferences.
 
-# Create your models here.
+Preferences are stored as an append-only history: expressing a new preference adds a new row
+rather than modifying an existing one. The *current* preference for a user is the most recently
+created row for that user.
+
+"""
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+
+class PreferenceQuerySet(models.QuerySet):
+    """
+    A custom queryset for :py:class:`~.Preference` which adds methods to select the current
+    preference for users in bulk.
+
+    """
+    def current(self):
+        """
+        Filter the queryset to contain only the most recent preference for each user. This is
+        performed as a single query with a correlated sub-query which is satisfied by the
+        ``(user, created_at)`` index and so does not need one query per user.
+
+        """
+        latest_id = (
+            Preference.objects
+            .filter(user=OuterRef('user'))
+            .order_by('-created_at', '-id')
+            .values('id')[:1]
+        )
+        return self.filter(id=Subquery(latest_id))
+
+    def for_users(self, users):
+        """
+        Filter the queryset to contain only the current preference for each of the passed users.
+        Users may be specified as :py:class:`~django.contrib.auth.models.User` instances,
+        primary keys or a queryset. Users without any preference are omitted.
+
+        """
+        return self.current().filter(user__in=users)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Insert preferences in bulk as :py:meth:`django.db.models.query.QuerySet.bulk_create` does
+        after setting their :py:attr:`~.Preference.recorded_at` times to now.
+
+        """
+        objs, now = list(objs), timezone.now()
+        for obj in objs:
+            obj.recorded_at = now
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class Preference(models.Model):
+    """
+    A preference expressed by a user about the recording of their lectures.
+
+    Preferences are append-only. Attempting to save changes to an existing preference raises
+    :py:exc:`ValueError`. Express a new preference by creating a new object instead.
+
+    """
+    #: User who expressed the preference
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='preferences')
+
+    #: Lookup institution id of the department to which this preference applies. This is blank
+    #: if no department was recorded.
+    institution = models.CharField(max_length=255, blank=True, db_index=True)
+
+    #: Does the user allow their lectures to be recorded?
+    allow_capture = models.BooleanField()
+
+    #: Does the user request that recordings be held for review before publication?
+    request_hold = models.BooleanField(default=False)
+
+    #: When this preference was expressed
+    created_at = models.DateTimeField(default=timezone.now)
+
+    #: When this preference was inserted into the database. Unlike :py:attr:`created_at`, which
+    #: may be in the past when history is imported, this is set just before the row is inserted.
+    #: The changes feed uses it to wait for transactions which may still be open.
+    recorded_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = PreferenceQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-created_at', '-id')
+        get_latest_by = 'created_at'
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='preference_user_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='preference_created_idx'),
+        ]
+
+    def __str__(self):
+        return '{} allow_capture={} request_hold={} at {}'.format(
+            self.user, self.allow_capture, self.request_hold, self.created_at.isoformat())
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Preferences are append-only and may not be modified once saved')
+        # Signal handlers, such as the one maintaining summaries, run in the same transaction as
+        # the insert.
+        using = kwargs.get('using') or router.db_for_write(Preference)
+        with transaction.atomic(using=using, savepoint=False):
+            self.recorded_at = timezone.now()
+            return super().save(*args, **kwargs)
+
+
+class Job(models.Model):
+    """
+    A unit of background work run by the ``runjobs`` management command. Jobs are created with
+    :py:func:`preferences.jobs.enqueue` rather than directly. See :py:mod:`preferences.jobs`.
+
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    STATE_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    #: Name of the registered task to run
+    task = models.CharField(max_length=255)
+
+    #: Keyword arguments passed to the task, encoded as JSON
+    arguments = models.TextField(default='{}')
+
+    #: Key identifying equivalent jobs. At most one pending or running job may have a given key.
+    #: The key is cleared when the job finishes so that an equivalent job may be queued again.
+    dedup_key = models.CharField(max_length=255, null=True, blank=True, unique=True)
+
+    #: Current state of the job
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=PENDING)
+
+    #: Number of times the job has been started
+    attempts = models.PositiveIntegerField(default=0)
+
+    #: Number of times the job may be started before it is marked as failed
+    max_attempts = models.PositiveIntegerField(default=1)
+
+    #: The job is not started before this time
+    run_after = models.DateTimeField(default=timezone.now)
+
+    #: A running job whose lease has expired is assumed to have been abandoned by its worker and
+    #: may be started again
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    #: Identifier of the worker which last started the job
+    worker = models.CharField(max_length=255, blank=True)
+
+    #: Value returned by the task, encoded as JSON
+    result = models.TextField(blank=True)
+
+    #: Traceback of the last failed attempt
+    error = models.TextField(blank=True)
+
+    #: When the job was queued
+    created_at = models.DateTimeField(default=timezone.now)
+
+    #: When the job was last started
+    started_at = models.DateTimeField(null=True, blank=True)
+
+    #: When the job succeeded or finally failed
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-created_at', '-id')
+        indexes = [
+            models.Index(fields=['state', 'run_after'], name='job_state_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return '{} #{} ({})'.format(self.task, self.id, self.state)
+
+
+class PreferenceSummary(models.Model):
+    """
+    Counts of the preferences of the users in an institution, maintained as preferences are
+    expressed so that dashboards need not aggregate the preference history. See
+    :py:mod:`preferences.summaries`.
+
+    Each user with a preference in the scope of the summary is counted once according to their
+    latest preference in that scope. The scope is either all time, in which case :py:attr:`term`
+    is blank and the counts are of current preferences, or an academic term, in which case the
+    counts are of the latest preference each user expressed during that term.
+
+    """
+    #: Lookup institution id of the department
+    institution = models.CharField(max_length=255, blank=True)
+
+    #: Term, such as ``2026-michaelmas``, or blank for current preferences
+    term = models.CharField(max_length=32, blank=True)
+
+    #: Number of users who allow their lectures to be recorded
+    allow_capture_count = models.IntegerField(default=0)
+
+    #: Number of users who do not allow their lectures to be recorded
+    deny_capture_count = models.IntegerField(default=0)
+
+    #: Number of users who request that recordings be held for review
+    request_hold_count = models.IntegerField(default=0)
+
+    #: When the counts last changed
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ('term', 'institution')
+        unique_together = (('term', 'institution'),)
+        verbose_name_plural = 'preference summaries'
+
+    def __str__(self):
+        return '{} {}: {} allow, {} deny'.format(
+            self.institution or '(none)', self.term or 'current', self.allow_capture_count,
+            self.deny_capture_count)
+
+
+class ArchivedPreference(models.Model):
+    """
+    A superseded :py:class:`~.Preference` moved out of the preference table by the
+    ``archivepreferences`` management command so that the table stays small while the audit trail
+    is kept. See :py:mod:`preferences.archival`.
+
+    """
+    #: Primary key of the preference before it was archived
+    id = models.IntegerField(primary_key=True)
+
+    #: User who expressed the preference
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_preferences')
+
+    #: Lookup institution id of the department to which this preference applied
+    institution = models.CharField(max_length=255, blank=True)
+
+    #: Did the user allow their lectures to be recorded?
+    allow_capture = models.BooleanField()
+
+    #: Did the user request that recordings be held for review before publication?
+    request_hold = models.BooleanField(default=False)
+
+    #: When the preference was expressed
+    created_at = models.DateTimeField()
+
+    #: When the preference was archived
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ('-created_at', '-id')
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='archived_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return '{} allow_capture={} request_hold={} at {} (archived)'.format(
+            self.user, self.allow_capture, self.request_hold, self.created_at.isoformat())
+
+
+class PreferenceDeletions(models.Model):
+    """
+    The number of preferences ever deleted, kept in a single row. Preferences are otherwise only
+    inserted and so the largest preference id together with this count changes whenever the
+    preference table does. Incremented by a ``post_delete`` signal handler. Deleting preferences
+    without sending signals, as archiving does, must only delete superseded preferences.
+
+    """
+    #: Number of preferences deleted
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'preference deletions'
+
+    def __str__(self):
+        return '{} preference(s) deleted'.format(self.count)
+
+    @classmethod
+    def increment(cls):
+        """Increment the count in the current transaction."""
+        if cls.objects.filter(pk=1).update(count=F('count') + 1) == 0:
+            _, created = cls.objects.get_or_create(pk=1, defaults={'count': 1})
+            if not created:
+                cls.objects.filter(pk=1).update(count=F('count') + 1)
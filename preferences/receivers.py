@@ -0,0 +1,89 @@
+"""
+Signal handlers which keep caches and preference summaries up to date.
+
+The handlers are connected by the :py:class:`~preferences.apps.Config` class's
+:py:meth:`~preferences.apps.Config.ready` method. This module imports only Django and the models
+which send the signals. The modules which do the work, and which import Django REST framework,
+are imported by each handler when it is first called so that they are not imported at startup.
+
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import models
+
+
+@receiver(post_save, sender=models.Preference)
+def _preference_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    from . import caching, summaries
+    if created:
+        summaries.record([instance])
+    caching.invalidate([instance.user_id])
+
+
+@receiver(post_delete, sender=models.Preference)
+def _preference_deleted(sender, instance, **kwargs):
+    from . import caching, summaries
+    # Working out which preference becomes the latest when one is deleted is not possible once
+    # all of a user's preferences have been deleted and so summaries are rebuilt instead.
+    summaries.queue_refresh()
+    # The list ETag depends on the number of deletions. See PreferenceViewSet.list.
+    models.PreferenceDeletions.increment()
+    caching.invalidate([instance.user_id])
+
+
+# The token model is given by name, which model signals resolve once the model is loaded, so that
+# Django REST framework is not imported.
+@receiver(post_save, sender='authtoken.Token')
+@receiver(post_delete, sender='authtoken.Token')
+def _token_changed(sender, instance, **kwargs):
+    from . import authentication
+    authentication.invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=get_user_model())
+def _user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Logging in only updates last_login, which is of no concern to API clients, and happens for
+    # every interactive log in.
+    if created or (update_fields is not None and set(update_fields) == {'last_login'}):
+        return
+    from . import authentication
+    authentication.invalidate_users([instance.pk])
+
+
+# Many-to-many changes after which cached users may have the wrong permissions. Clearing a
+# relation is handled before it happens, while the affected objects can still be found.
+_M2M_ACTIONS = {'post_add', 'post_remove', 'pre_clear'}
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+@receiver(m2m_changed, sender=get_user_model().user_permissions.through)
+def _user_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in _M2M_ACTIONS:
+        return
+    from . import authentication
+    if not reverse:
+        authentication.invalidate_users([instance.pk])
+    elif action == 'pre_clear':
+        # instance is a group or permission which is being removed from all of its users.
+        authentication.invalidate_users(instance.user_set.values_list('pk', flat=True))
+    else:
+        authentication.invalidate_users(pk_set)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def _group_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in _M2M_ACTIONS:
+        return
+    from . import authentication
+    if not reverse:
+        authentication.invalidate_users(instance.user_set.values_list('pk', flat=True))
+        return
+    # instance is a permission and pk_set the groups it was added to or removed from.
+    groups = instance.group_set.all() if action == 'pre_clear' else pk_set
+    authentication.invalidate_users(
+        get_user_model().objects.filter(groups__in=groups).values_list('pk', flat=True))
@@ -0,0 +1,75 @@
+"""
+Serializers for the Lecture Capture Preferences API.
+
+"""
+import json
+
+from rest_framework import serializers
+
+from . import models
+
+
+class PreferenceSerializer(serializers.ModelSerializer):
+    """
+    Serialise a :py:class:`~preferences.models.Preference`. The user is represented by their
+    username. Views using this serializer should use ``select_related('user')`` to avoid one query
+    per preference.
+
+    """
+    user = serializers.SlugRelatedField(slug_field='username', read_only=True)
+
+    class Meta:
+        model = models.Preference
+        fields = ('id', 'user', 'institution', 'allow_capture', 'request_hold', 'created_at')
+        read_only_fields = ('id', 'user', 'created_at')
+
+
+class PreferenceBatchItemSerializer(serializers.ModelSerializer):
+    """
+    Validate one item of a batch of preferences expressed on behalf of users. The user is given by
+    username and is not looked up by the serializer so that the users of a whole batch may be
+    fetched with a single query.
+
+    """
+    user = serializers.CharField(max_length=150)
+
+    class Meta:
+        model = models.Preference
+        fields = ('user', 'institution', 'allow_capture', 'request_hold')
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """
+    Serialise a :py:class:`~preferences.models.Job`. Arguments and results are decoded from JSON.
+
+    """
+    arguments = serializers.SerializerMethodField()
+    result = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.Job
+        fields = (
+            'id', 'task', 'arguments', 'state', 'attempts', 'max_attempts', 'run_after',
+            'created_at', 'started_at', 'finished_at', 'result', 'error',
+        )
+        read_only_fields = fields
+
+    def get_arguments(self, job):
+        return json.loads(job.arguments)
+
+    def get_result(self, job):
+        return json.loads(job.result) if job.result != '' else None
+
+
+class PreferenceSummarySerializer(serializers.ModelSerializer):
+    """
+    Serialise a :py:class:`~preferences.models.PreferenceSummary`.
+
+    """
+    class Meta:
+        model = models.PreferenceSummary
+        fields = (
+            'institution', 'term', 'allow_capture_count', 'deny_capture_count',
+            'request_hold_count', 'updated_at',
+        )
+        read_only_fields = fields
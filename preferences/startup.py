@@ -0,0 +1,108 @@
+"""
+Profile application start up.
+
+Run this module as a script, with ``DJANGO_SETTINGS_MODULE`` set, to set up Django and print the
+time taken by each phase of start up for each installed app as JSON. It is run by the
+:any:`profilestartup <profilestartup>` management command in a fresh process so that nothing is
+already imported. Only the standard library is imported at module level so that as much as
+possible of start up is measured.
+
+"""
+import importlib
+import json
+import re
+import sys
+import time
+
+#: Phases timed for each app, in the order in which Django performs them.
+PHASES = ('import', 'models', 'ready')
+
+IMPORTTIME_PATTERN = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$')
+
+
+def parse_importtime(output):
+    """
+    Return a dictionary mapping top-level module names to their cumulative import time in seconds
+    from the output of ``python -X importtime``.
+
+    """
+    modules = {}
+    for line in output.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        # Top-level imports are indented by a single space.
+        if match is None or len(match.group(3)) != 1:
+            continue
+        name = match.group(4).split('.')[0]
+        modules[name] = modules.get(name, 0) + int(match.group(2)) / 1e6
+    return modules
+
+
+def profile_startup():
+    """
+    Set up Django, timing each phase of start up for each app, then load the URLconf and WSGI
+    application. Must be called in a process in which Django has not been set up. Returns a
+    dictionary of timings in seconds.
+
+    """
+    start = time.perf_counter()
+
+    import django
+    from django.apps import AppConfig
+
+    app_timings = {}
+
+    def timed(label, phase, func, *args, **kwargs):
+        phase_start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings = app_timings.setdefault(label, dict.fromkeys(PHASES, 0.0))
+            timings[phase] += time.perf_counter() - phase_start
+
+    create = AppConfig.create.__func__
+    import_models = AppConfig.import_models
+
+    def timed_create(cls, entry):
+        create_start = time.perf_counter()
+        app_config = create(cls, entry)
+        timings = app_timings.setdefault(app_config.name, dict.fromkeys(PHASES, 0.0))
+        timings['import'] += time.perf_counter() - create_start
+        return app_config
+
+    def timed_import_models(self, *args, **kwargs):
+        # Time ready() by shadowing it with an instance attribute. Django calls it once all
+        # models have been imported.
+        ready = self.ready
+        self.ready = lambda: timed(self.name, 'ready', ready)
+        return timed(self.name, 'models', import_models, self, *args, **kwargs)
+
+    AppConfig.create = classmethod(timed_create)
+    AppConfig.import_models = timed_import_models
+    try:
+        django.setup()
+    finally:
+        AppConfig.create = classmethod(create)
+        AppConfig.import_models = import_models
+    setup_done = time.perf_counter()
+
+    from django.conf import settings
+    importlib.import_module(settings.ROOT_URLCONF)
+    urls_done = time.perf_counter()
+
+    from django.core.wsgi import get_wsgi_application
+    get_wsgi_application()
+    wsgi_done = time.perf_counter()
+
+    return {
+        'apps': app_timings,
+        'steps': {
+            'setup': setup_done - start,
+            'urls': urls_done - setup_done,
+            'wsgi': wsgi_done - urls_done,
+            'total': wsgi_done - start,
+        },
+    }
+
+
+if __name__ == '__main__':
+    json.dump(profile_startup(), sys.stdout)
@@ -0,0 +1,283 @@
+"""
+Materialised summaries of preferences by institution and term.
+
+Counting preferences by institution means finding the latest preference of every user, which
+takes time proportional to the size of the preference history. The
+:py:class:`~preferences.models.PreferenceSummary` table instead holds the counts for each
+institution, both for current preferences and for each academic term, and so dashboards read a
+single row per institution.
+
+Summaries are kept up to date incrementally. Saving a new preference updates the affected rows in
+the same transaction via a ``post_save`` signal handler. Code which creates preferences in bulk,
+bypassing signals, must call :py:func:`~.record` itself before inserting them. Deleting
+preferences, which happens when users are deleted or superseded preferences are archived, queues a
+background job which rebuilds all summaries with :py:func:`~.refresh`. Code which deletes
+preferences without sending signals must call :py:func:`~.queue_refresh` itself. The
+``refreshsummaries`` management command rebuilds summaries straight away.
+
+Terms are approximated by calendar months: Lent term runs from January to March, Easter term from
+April to September and Michaelmas term from October to December. See :py:data:`~.TERMS`.
+
+"""
+import collections
+import datetime
+import functools
+import operator
+
+from django.contrib.auth import get_user_model
+from django.db import connections, router, transaction
+from django.db.models import Count, F, Max, Min, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from . import caching
+from . import jobs
+from . import models
+
+#: Terms of the academic year as (name, first month) tuples in calendar order. Each term lasts
+#: until the next begins.
+TERMS = (('lent', 1), ('easter', 4), ('michaelmas', 10))
+
+#: Name of the background job task which rebuilds all summaries
+REFRESH_TASK = 'refresh_summaries'
+
+# Maximum number of users whose preferences are fetched by a single query
+_USER_BATCH_SIZE = 500
+
+# Count fields of a summary and the conditions on preferences which they count
+_COUNTS = {
+    'allow_capture_count': Q(allow_capture=True),
+    'deny_capture_count': Q(allow_capture=False),
+    'request_hold_count': Q(request_hold=True),
+}
+
+
+def term_for(when):
+    """Return the term, for example ``"2026-michaelmas"``, containing the datetime *when*."""
+    when = timezone.localtime(when)
+    name = [name for name, month in TERMS if month <= when.month][-1]
+    return '{}-{}'.format(when.year, name)
+
+
+def term_bounds(term):
+    """Return the first moment of *term* and the first moment after it as aware datetimes."""
+    year, name = term.split('-')
+    year, index = int(year), [name for name, _ in TERMS].index(name)
+    next_year, next_index = (year, index + 1) if index + 1 < len(TERMS) else (year + 1, 0)
+    return (
+        timezone.make_aware(datetime.datetime(year, TERMS[index][1], 1)),
+        timezone.make_aware(datetime.datetime(next_year, TERMS[next_index][1], 1)),
+    )
+
+
+def record(preferences):
+    """
+    Update summaries to include *preferences*, a sequence of new
+    :py:class:`~preferences.models.Preference` instances. Call this in the same transaction as
+    the preferences are saved, either before they are saved or, if they are saved one at a time
+    and so have primary keys, afterwards. The users of the preferences are locked until the
+    transaction ends.
+
+    The number of queries made depends on the number of users, terms and institutions involved
+    rather than on the number of preferences.
+
+    """
+    preferences = [_as_row(preference) for preference in preferences]
+    if len(preferences) == 0:
+        return
+    exclude = [preference['id'] for preference in preferences if preference['id'] is not None]
+    user_ids = sorted({preference['user_id'] for preference in preferences})
+
+    # Two transactions expressing preferences for the same user would otherwise both find the
+    # same previous preference and both remove it from the counts. Locking the users' rows
+    # serialises them: the second continues once the first commits and then sees its preference.
+    _lock_users(user_ids)
+
+    scopes = {'': preferences}
+    for preference in preferences:
+        scopes.setdefault(term_for(preference['created_at']), []).append(preference)
+
+    # The latest existing preference of each user is fetched first. In the usual case, where new
+    # preferences are later than existing ones, it also gives the latest existing preference in
+    # each term and so terms need a query only for users with a later preference.
+    current = _latest_preferences(user_ids, '', exclude)
+
+    deltas = collections.defaultdict(collections.Counter)
+    for term, in_scope in scopes.items():
+        # Only the latest new preference of each user can change the summary.
+        latest = {}
+        for preference in in_scope:
+            other = latest.get(preference['user_id'])
+            if other is None or _order_key(preference) > _order_key(other):
+                latest[preference['user_id']] = preference
+
+        if term == '':
+            previous = current
+        else:
+            start, end = term_bounds(term)
+            previous = {
+                user_id: preference for user_id, preference in current.items()
+                if user_id in latest and start <= preference['created_at'] < end
+            }
+            previous.update(_latest_preferences(sorted(
+                user_id for user_id in latest
+                if user_id in current and current[user_id]['created_at'] >= end
+            ), term, exclude))
+
+        for user_id, preference in latest.items():
+            replaced = previous.get(user_id)
+            if replaced is not None:
+                if _order_key(replaced) > _order_key(preference):
+                    # A later preference already exists, for example when importing history.
+                    continue
+                _count(deltas[(replaced['institution'], term)], replaced, -1)
+            _count(deltas[(preference['institution'], term)], preference, 1)
+
+    _apply(deltas)
+
+
+def refresh():
+    """
+    Rebuild all summaries from the preference history and invalidate cached responses. Preferences
+    expressed while the summaries are rebuilt may not be counted until the next rebuild, depending
+    on the database's isolation level.
+
+    """
+    summaries = {}
+
+    def add(term, queryset):
+        rows = queryset.order_by().values('institution').annotate(**{
+            field: Count('id', filter=condition) for field, condition in _COUNTS.items()
+        })
+        for row in rows:
+            institution = row.pop('institution')
+            summaries[(institution, term)] = models.PreferenceSummary(
+                institution=institution, term=term, **row)
+
+    with transaction.atomic():
+        add('', models.Preference.objects.current())
+
+        span = models.Preference.objects.aggregate(
+            first=Min('created_at'), last=Max('created_at'))
+        if span['first'] is not None:
+            term = term_for(span['first'])
+            while True:
+                start, end = term_bounds(term)
+                add(term, _latest_queryset(term).filter(created_at__gte=start, created_at__lt=end))
+                if end > span['last']:
+                    break
+                term = term_for(end)
+
+        models.PreferenceSummary.objects.all().delete()
+        models.PreferenceSummary.objects.bulk_create(summaries.values())
+
+        # Cached summary responses are in the ALL scope, whose version changes once rebuilt
+        # summaries are committed.
+        caching.invalidate([])
+
+
+def _lock_users(user_ids):
+    """
+    Lock the rows of the users with primary keys in *user_ids* until the current transaction ends.
+    Rows are locked in primary key order so that transactions locking several users cannot
+    deadlock. Databases without row locks, such as SQLite, serialise writing transactions anyway
+    and so nothing is locked.
+
+    """
+    User = get_user_model()
+    if not connections[router.db_for_write(User)].features.has_select_for_update:
+        return
+    list(User.objects.select_for_update().filter(pk__in=user_ids).order_by('pk')
+         .values_list('pk', flat=True))
+
+
+def _as_row(preference):
+    """Return a dictionary describing *preference* in the same way as a row from the database."""
+    return {
+        'id': preference.pk, 'user_id': preference.user_id, 'institution': preference.institution,
+        'allow_capture': preference.allow_capture, 'request_hold': preference.request_hold,
+        'created_at': preference.created_at,
+    }
+
+
+def _order_key(preference):
+    """Key ordering preferences by creation. Unsaved preferences are later than saved ones."""
+    return (
+        preference['created_at'],
+        preference['id'] if preference['id'] is not None else float('inf'),
+    )
+
+
+def _latest_queryset(term, exclude=()):
+    """Return a queryset of the latest preference of each user in the scope *term*."""
+    latest = models.Preference.objects.filter(user=OuterRef('user'))
+    if term != '':
+        start, end = term_bounds(term)
+        latest = latest.filter(created_at__gte=start, created_at__lt=end)
+    if len(exclude) > 0:
+        latest = latest.exclude(pk__in=exclude)
+    latest_id = latest.order_by('-created_at', '-id').values('id')[:1]
+    return models.Preference.objects.filter(id=Subquery(latest_id))
+
+
+def _latest_preferences(user_ids, term, exclude):
+    """
+    Return a dictionary mapping the ids of users to dictionaries describing their latest
+    preference in the scope *term* other than those with primary keys in *exclude*.
+
+    """
+    latest = {}
+    for start in range(0, len(user_ids), _USER_BATCH_SIZE):
+        rows = _latest_queryset(term, exclude).filter(
+            user_id__in=user_ids[start:start + _USER_BATCH_SIZE]
+        ).order_by().values(
+            'id', 'user_id', 'institution', 'allow_capture', 'request_hold', 'created_at')
+        latest.update((row['user_id'], row) for row in rows)
+    return latest
+
+
+def _count(counts, preference, sign):
+    """Add *sign* to each count in *counts* which *preference* is counted in."""
+    counts['allow_capture_count' if preference['allow_capture'] else 'deny_capture_count'] += sign
+    if preference['request_hold']:
+        counts['request_hold_count'] += sign
+
+
+def _apply(deltas):
+    """
+    Add counts to summaries, creating them if necessary. *deltas* maps (institution, term) tuples
+    to the changes in each count.
+
+    """
+    # Summaries whose counts change by the same amounts, typically the current and term summaries
+    # of one institution, are updated by a single query.
+    changes = collections.defaultdict(list)
+    for (institution, term), counts in deltas.items():
+        counts = tuple(sorted((field, delta) for field, delta in counts.items() if delta != 0))
+        if len(counts) > 0:
+            changes[counts].append((institution, term))
+    if len(changes) == 0:
+        return
+
+    # Create any missing summaries with zero counts. Summaries created concurrently by another
+    # transaction are left alone.
+    models.PreferenceSummary.objects.bulk_create([
+        models.PreferenceSummary(institution=institution, term=term)
+        for keys in changes.values() for institution, term in keys
+    ], ignore_conflicts=True)
+
+    now = timezone.now()
+    for counts, keys in changes.items():
+        condition = functools.reduce(operator.or_, (
+            Q(institution=institution, term=term) for institution, term in keys))
+        models.PreferenceSummary.objects.filter(condition).update(
+            updated_at=now, **{field: F(field) + delta for field, delta in counts})
+
+
+def queue_refresh():
+    """
+    Queue a background job which rebuilds all summaries once the current transaction, if any,
+    commits. At most one such job is pending at a time. Call this after deleting preferences
+    without sending signals.
+
+    """
+    transaction.on_commit(lambda: jobs.enqueue(REFRESH_TASK, dedup_key=REFRESH_TASK))
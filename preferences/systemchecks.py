@@ -9,8 +9,13 @@ the :py:class:`~preferences.apps.Config` class's
     The `Django System Check Framework <https://docs.djangoproject.com/en/2.0/ref/checks/>`_.
 
 """
+import os
+
 from django.conf import settings
-from django.core.checks import register, Error
+from django.contrib.staticfiles.storage import ManifestFilesMixin, staticfiles_storage
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import register, Error, Tags, Warning
+from django.utils.module_loading import import_string
 
 
 REQUIRED_SETTINGS = [
@@ -38,3 +43,126 @@ def required_settings_check(app_configs, **kwargs):
                 hint='Add {} to settings.'.format(name)))
 
     return errors
+
+
+@register(Tags.caches)
+def response_cache_check(app_configs, **kwargs):
+    """
+    A system check ensuring that, if responses are cached, they are cached in a cache shared
+    between processes. Otherwise a preference saved by one web worker would not invalidate the
+    responses cached by the others. See :py:mod:`preferences.caching`.
+
+    """
+    alias = settings.PREFERENCES_RESPONSE_CACHE
+    if alias is None:
+        return []
+    if alias not in settings.CACHES:
+        return [Error(
+            'PREFERENCES_RESPONSE_CACHE names an unknown cache: {}'.format(alias),
+            id='preferences.E101',
+            hint='Add the cache to CACHES or set PREFERENCES_RESPONSE_CACHE to None.')]
+    if issubclass(import_string(settings.CACHES[alias]['BACKEND']), LocMemCache):
+        return [Error(
+            'Responses are cached in a cache local to each process: {}'.format(alias),
+            id='preferences.E102',
+            hint='Set PREFERENCES_RESPONSE_CACHE to a cache shared between web workers, such as '
+                 'memcached, or to None to disable response caching.')]
+    return []
+
+
+#: Maximum number of file names listed by each static files warning.
+STATIC_FILES_LISTED = 10
+
+
+@register('staticfiles', deploy=True)
+def static_files_check(app_configs, **kwargs):
+    """
+    A deployment system check ensuring that collected static files may be cached forever and are
+    served compressed. Each file in ``STATIC_ROOT`` must have a hash of its content in its name
+    and, unless compression would not make it smaller, gzip and Brotli compressed variants.
+
+    Nothing is checked if static files have not been collected. Run this check after
+    ``collectstatic`` with ``./manage.py check --deploy --tag staticfiles``.
+
+    """
+    root = settings.STATIC_ROOT
+    if root is None or not os.path.isdir(root):
+        return []
+
+    if not isinstance(staticfiles_storage, ManifestFilesMixin):
+        return [Warning(
+            'Static files storage does not add hashes to file names',
+            id='preferences.W001',
+            hint='Set STATICFILES_STORAGE to a manifest storage such as '
+                 'whitenoise.storage.CompressedManifestStaticFilesStorage.')]
+
+    # Imported here so that registering the checks does not import whitenoise.
+    from whitenoise.compress import Compressor
+
+    hashed = set(staticfiles_storage.load_manifest().values())
+    compressor = Compressor(quiet=True)
+    warnings, unhashed, uncompressed = [], [], []
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            if name == staticfiles_storage.manifest_name:
+                continue
+            base, extension = os.path.splitext(path)
+            if extension in ('.gz', '.br') and os.path.exists(base):
+                continue
+            if name not in hashed:
+                unhashed.append(name)
+            if compressor.should_compress(filename) and _is_missing_compressed(
+                    compressor, path):
+                uncompressed.append(name)
+
+    if len(unhashed) > 0:
+        warnings.append(Warning(
+            '{} static file(s) do not have hashed names: {}'.format(
+                len(unhashed), _list_names(unhashed)),
+            id='preferences.W002',
+            hint='Collect static files into an empty STATIC_ROOT with '
+                 'WHITENOISE_KEEP_ONLY_HASHED_FILES set.'))
+    if len(uncompressed) > 0:
+        warnings.append(Warning(
+            '{} static file(s) do not have compressed variants: {}'.format(
+                len(uncompressed), _list_names(uncompressed)),
+            id='preferences.W003',
+            hint='Collect static files with a compressing storage such as '
+                 'whitenoise.storage.CompressedManifestStaticFilesStorage.'))
+    if not compressor.use_brotli:
+        warnings.append(Warning(
+            'Static files are not compressed with Brotli',
+            id='preferences.W004',
+            hint='Install the brotli package before collecting static files.'))
+    return warnings
+
+
+def _is_missing_compressed(compressor, path):
+    """
+    Return True if a compressed variant of the file at *path* which would be smaller than the file
+    is missing.
+
+    """
+    encodings = [('.gz', 'gzip', compressor.compress_gzip)]
+    if compressor.use_brotli:
+        encodings.append(('.br', 'Brotli', compressor.compress_brotli))
+    missing = [
+        (name, compress) for extension, name, compress in encodings
+        if not os.path.exists(path + extension)
+    ]
+    if len(missing) == 0:
+        return False
+    with open(path, 'rb') as fobj:
+        data = fobj.read()
+    return any(
+        compressor.is_compressed_effectively(name, path, len(data), compress(data))
+        for name, compress in missing
+    )
+
+
+def _list_names(names):
+    names = sorted(names)
+    listed = ', '.join(names[:STATIC_FILES_LISTED])
+    return listed if len(names) <= STATIC_FILES_LISTED else listed + ', ...'
@@ -0,0 +1,63 @@
+"""
+Tasks which may be run as background jobs. See :py:mod:`preferences.jobs`.
+
+"""
+import io
+
+from django.core.management import call_command
+
+from . import jobs
+from . import lookup
+from . import models
+from . import summaries
+
+
+@jobs.task(name='refresh_lookup')
+def refresh_lookup(chunk_size=1000):
+    """
+    Refresh the cached Lookup entries of every user with a preference and of every institution
+    named by a current preference. Users are read from the database *chunk_size* at a time.
+    Return the number of people and institutions found in Lookup.
+
+    """
+    people = 0
+    crsids = (
+        models.Preference.objects.current().order_by()
+        .values_list('user__username', flat=True).iterator(chunk_size=chunk_size)
+    )
+    batch = []
+    for crsid in crsids:
+        batch.append(crsid)
+        if len(batch) >= chunk_size:
+            people += lookup.lookup_cache.refresh_people(batch)
+            batch = []
+    if len(batch) > 0:
+        people += lookup.lookup_cache.refresh_people(batch)
+
+    instids = (
+        models.Preference.objects.current().exclude(institution='').order_by()
+        .values_list('institution', flat=True).distinct()
+    )
+    institutions = lookup.lookup_cache.refresh_institutions(list(instids))
+    return {'people': people, 'institutions': institutions}
+
+
+@jobs.task(name='export_preferences', max_attempts=1)
+def export_preferences(path, format=None, all_history=False):
+    """
+    Export preferences to the file *path* on the worker as the ``exportpreferences`` management
+    command does. Return the path and the command's summary.
+
+    """
+    args = [path, '--all'] if all_history else [path]
+    if format is not None:
+        args.extend(['--format', format])
+    stdout = io.StringIO()
+    call_command('exportpreferences', *args, stdout=stdout)
+    return {'path': path, 'summary': stdout.getvalue().strip()}
+
+
+@jobs.task(name=summaries.REFRESH_TASK)
+def refresh_summaries():
+    """Rebuild all preference summaries. See :py:func:`preferences.summaries.refresh`."""
+    summaries.refresh()
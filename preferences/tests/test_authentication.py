@@ -0,0 +1,104 @@
+"""
+Test cached token authentication.
+
+"""
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+from django.test import TestCase
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+
+from preferences import authentication
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        authentication.get_cache().clear()
+        self.addCleanup(authentication.get_cache().clear)
+        self.user = get_user_model().objects.create_user(username='spqr1')
+        self.token = Token.objects.create(user=self.user)
+        self.permission = Permission.objects.get(codename='add_preference')
+
+        # Test cases run in a transaction which never commits. Run callbacks straight away.
+        patcher = mock.patch('django.db.transaction.on_commit', lambda func: func())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def authenticate(self, key=None):
+        request = APIRequestFactory().get(
+            '/', HTTP_AUTHORIZATION='Token {}'.format(key or self.token.key))
+        return authentication.CachedTokenAuthentication().authenticate(request)
+
+    def test_cached(self):
+        """Once a token has been authenticated, authenticating it again makes no queries."""
+        user, token = self.authenticate()
+        self.assertEqual(user, self.user)
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+            self.assertEqual(user, self.user)
+            self.assertEqual(token.key, self.token.key)
+            self.assertFalse(user.has_perm('preferences.add_preference'))
+
+    def test_invalid_token(self):
+        """Invalid tokens are rejected and not cached."""
+        for _ in range(2):
+            with self.assertRaises(exceptions.AuthenticationFailed):
+                self.authenticate('not-a-token')
+
+    def test_token_deleted(self):
+        """Deleted tokens are removed from the cache."""
+        self.authenticate()
+        self.token.delete()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+    def test_invalidated_on_commit(self):
+        """Tokens are removed from the cache once the transaction revoking them commits."""
+        self.authenticate()
+        # Deleting the token clears its key.
+        key = self.token.key
+        cache_key = authentication.token_cache_key(key)
+        callbacks = []
+        with mock.patch('django.db.transaction.on_commit', callbacks.append):
+            with transaction.atomic():
+                self.token.delete()
+                # A concurrent request could cache the token again until the deletion commits.
+                self.assertIsNotNone(authentication.get_cache().get(cache_key))
+        self.assertEqual(len(callbacks), 1)
+
+        callbacks[0]()
+        self.assertIsNone(authentication.get_cache().get(cache_key))
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate(key)
+
+    def test_user_deactivated(self):
+        """Changing a user removes their token from the cache."""
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+    def test_user_permissions_changed(self):
+        """Changing a user's permissions removes their token from the cache."""
+        self.authenticate()
+        self.user.user_permissions.add(self.permission)
+        user, _ = self.authenticate()
+        self.assertTrue(user.has_perm('preferences.add_preference'))
+
+    def test_group_permissions_changed(self):
+        """Changing the permissions of a user's group removes their token from the cache."""
+        group = Group.objects.create(name='bots')
+        group.user_set.add(self.user)
+        self.authenticate()
+        self.permission.group_set.add(group)
+        user, _ = self.authenticate()
+        self.assertTrue(user.has_perm('preferences.add_preference'))
+
+        group.permissions.clear()
+        user, _ = self.authenticate()
+        self.assertFalse(user.has_perm('preferences.add_preference'))
@@ -0,0 +1,105 @@
+"""
+Test caching of rendered responses.
+
+"""
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from preferences import bulk
+from preferences.models import Preference
+
+
+@override_settings(PREFERENCES_RESPONSE_CACHE='default')
+class ResponseCachingTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+
+        # Versions change when transactions commit, which they never do in a TestCase.
+        patcher = mock.patch('django.db.transaction.on_commit', lambda func: func())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        User = get_user_model()
+        self.users = [User.objects.create(username='test{:04d}'.format(i)) for i in range(2)]
+        for user in self.users:
+            Preference.objects.create(user=user, institution='INST0', allow_capture=True)
+        self.me_url = reverse('preferences:preference-me')
+        self.summary_url = reverse('preferences:summary-list')
+
+    def get(self, url, query_count):
+        with self.assertNumQueries(query_count):
+            r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        return r.json()
+
+    def test_me(self):
+        """The user's current preference is cached until they express another."""
+        self.client.force_login(self.users[0])
+        # Session and user queries, then the preference itself
+        self.assertTrue(self.get(self.me_url, 3)['allow_capture'])
+        self.assertTrue(self.get(self.me_url, 2)['allow_capture'])
+
+        # Another user's preference does not invalidate the response.
+        Preference.objects.create(user=self.users[1], allow_capture=False)
+        self.get(self.me_url, 2)
+
+        Preference.objects.create(user=self.users[0], allow_capture=False)
+        self.assertFalse(self.get(self.me_url, 3)['allow_capture'])
+
+    def test_per_user(self):
+        """Responses are cached per user."""
+        self.client.force_login(self.users[0])
+        self.get(self.me_url, 3)
+        self.client.force_login(self.users[1])
+        self.get(self.me_url, 3)
+
+    def test_no_preference(self):
+        """Users without a preference receive a 404 response which is not cached."""
+        user = get_user_model().objects.create(username='test9999')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(self.me_url).status_code, 404)
+        self.assertEqual(self.client.get(self.me_url).status_code, 404)
+
+    def test_summaries(self):
+        """Summaries are cached until any preference changes, including by bulk import."""
+        self.assertEqual(self.get(self.summary_url, 1)['results'][0]['allow_capture_count'], 2)
+        self.get(self.summary_url, 0)
+
+        Preference.objects.create(user=self.users[1], institution='INST0', allow_capture=False)
+        self.assertEqual(self.get(self.summary_url, 1)['results'][0]['allow_capture_count'], 1)
+
+        bulk.import_records([(1, {'user': 'test0000', 'allow_capture': False,
+                                  'institution': 'INST0'})])
+        self.assertEqual(self.get(self.summary_url, 1)['results'][0]['allow_capture_count'], 0)
+
+    def test_disabled(self):
+        """Responses are not cached unless a cache is configured."""
+        caches['default'].clear()
+        self.client.force_login(self.users[0])
+        with self.settings(PREFERENCES_RESPONSE_CACHE=None):
+            self.get(self.me_url, 3)
+            self.get(self.me_url, 3)
+            Preference.objects.create(user=self.users[0], allow_capture=False)
+        self.assertEqual(caches['default'].get_many(
+            ['preferences:response:version:all']), {})
+
+    def test_batch_invalidates(self):
+        """Preferences expressed in a batch invalidate cached responses."""
+        staff = get_user_model().objects.create(username='staff0001', is_staff=True)
+        self.client.force_login(self.users[0])
+        self.get(self.me_url, 3)
+
+        self.client.force_login(staff)
+        self.client.post(
+            reverse('preferences:preference-batch'),
+            json.dumps([{'user': 'test0000', 'allow_capture': False}]),
+            content_type='application/json')
+
+        self.client.force_login(self.users[0])
+        self.assertFalse(self.get(self.me_url, 3)['allow_capture'])
@@ -2,12 +2,19 @@
 Test that the registered system checks work as expected.
 
 """
+import os
+import shutil
+import tempfile
+
+from django.contrib.staticfiles.storage import staticfiles_storage
 from django.core.management import call_command
 # Q: is this a documented import location for SystemCheckError?
 from django.core.management.base import SystemCheckError
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, override_settings
+from whitenoise.middleware import WhiteNoiseMiddleware
 
-from preferences.systemchecks import REQUIRED_SETTINGS
+from preferences.systemchecks import (
+    REQUIRED_SETTINGS, response_cache_check, static_files_check)
 
 
 class RequiredSettings(TestCase):
@@ -28,3 +35,102 @@ class RequiredSettings(TestCase):
                 call_command('check')
             with self.settings(**{name: None}), self.assertRaises(SystemCheckError):
                 call_command('check')
+
+
+class ResponseCacheTests(TestCase):
+    """
+    Responses are only cached in a cache shared between processes.
+
+    """
+    def ids(self):
+        return [message.id for message in response_cache_check(None)]
+
+    def test_disabled(self):
+        """Response caching is disabled by default."""
+        self.assertEqual(self.ids(), [])
+
+    def test_local_cache(self):
+        """A cache local to each process is rejected."""
+        with self.settings(PREFERENCES_RESPONSE_CACHE='default'):
+            self.assertEqual(self.ids(), ['preferences.E102'])
+        with self.settings(PREFERENCES_RESPONSE_CACHE='missing'):
+            self.assertEqual(self.ids(), ['preferences.E101'])
+
+    def test_shared_cache(self):
+        """A shared cache is accepted."""
+        caches = {'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '127.0.0.1:11211',
+        }}
+        with self.settings(CACHES=caches, PREFERENCES_RESPONSE_CACHE='default'):
+            self.assertEqual(self.ids(), [])
+
+
+@override_settings(
+    STATICFILES_STORAGE='whitenoise.storage.CompressedManifestStaticFilesStorage',
+    WHITENOISE_KEEP_ONLY_HASHED_FILES=True)
+class StaticFilesTests(TestCase):
+    """
+    Collected static files are hashed, compressed and served with long-lived caching.
+
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.mkdtemp()
+        with override_settings(STATIC_ROOT=cls.static_root):
+            call_command('collectstatic', interactive=False, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.static_root)
+        super().tearDownClass()
+
+    def setUp(self):
+        settings = override_settings(STATIC_ROOT=self.static_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.manifest = staticfiles_storage.load_manifest()
+
+    def ids(self):
+        # Whether Brotli is installed depends on the environment.
+        return {
+            warning.id for warning in static_files_check(None)
+            if warning.id != 'preferences.W004'
+        }
+
+    def test_collected(self):
+        """Freshly collected static files pass the check."""
+        self.assertEqual(self.ids(), set())
+
+    def test_unhashed(self):
+        """Files without hashed names are flagged."""
+        path = os.path.join(self.static_root, 'bundle.js')
+        with open(path, 'w') as fobj:
+            fobj.write('console.log("unhashed");\n' * 100)
+        self.addCleanup(os.remove, path)
+        self.assertIn('preferences.W002', self.ids())
+
+    def test_uncompressed(self):
+        """Compressible files without compressed variants are flagged."""
+        path = os.path.join(self.static_root, self.manifest['admin/css/base.css'] + '.gz')
+        with open(path, 'rb') as fobj:
+            content = fobj.read()
+        os.remove(path)
+
+        def restore():
+            with open(path, 'wb') as fobj:
+                fobj.write(content)
+        self.addCleanup(restore)
+        self.assertEqual(self.ids(), {'preferences.W003'})
+
+    def test_immutable(self):
+        """Hashed files are served compressed with a far-future immutable Cache-Control."""
+        middleware = WhiteNoiseMiddleware(lambda request: None)
+        request = RequestFactory().get(
+            staticfiles_storage.url('admin/css/base.css'), HTTP_ACCEPT_ENCODING='gzip')
+        response = middleware(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=315360000', response['Cache-Control'])
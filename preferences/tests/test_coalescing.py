@@ -0,0 +1,120 @@
+"""
+Test coalescing of identical concurrent requests.
+
+"""
+import threading
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+
+from preferences import coalescing
+
+
+class CoalesceTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        self.calls = []
+        self.outcomes = []
+        coalescing.request_coalesced.connect(self.record_outcome)
+        self.addCleanup(coalescing.request_coalesced.disconnect, self.record_outcome)
+
+    def record_outcome(self, sender, outcome, **kwargs):
+        self.outcomes.append(outcome)
+
+    def make_view(self, set_cookie=False, check=None):
+        started = threading.Event()
+
+        def view(request):
+            self.calls.append(request.path)
+            started.set()
+            # Give the other requests time to arrive.
+            time.sleep(0.2)
+            response = HttpResponse('call {}'.format(len(self.calls)))
+            response['X-Test'] = 'yes'
+            if set_cookie:
+                response.set_cookie('test', 'value')
+            return response
+
+        return coalescing.coalesce(view, check=check), started
+
+    def request(self, method='get', path='/'):
+        request = getattr(RequestFactory(), method)(path)
+        request.user = AnonymousUser()
+        return request
+
+    def run_concurrently(self, view, started, count, path='/'):
+        """Make a request and then *count* - 1 more while it is being handled."""
+        responses = []
+
+        def run():
+            responses.append(view(self.request(path=path)))
+
+        threads = [threading.Thread(target=run) for _ in range(count)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_coalesced(self):
+        """Identical concurrent requests share one response."""
+        view, started = self.make_view()
+        responses = self.run_concurrently(view, started, 4)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual([r.content for r in responses], [b'call 1'] * 4)
+        self.assertEqual([r['X-Test'] for r in responses], ['yes'] * 4)
+        self.assertEqual(sorted(self.outcomes), ['leader', 'shared', 'shared', 'shared'])
+
+    def test_sequential(self):
+        """Requests made one after the other are each computed afresh."""
+        view, _ = self.make_view()
+        self.assertEqual(view(self.request()).content, b'call 1')
+        self.assertEqual(view(self.request()).content, b'call 2')
+
+    def test_different_requests(self):
+        """Requests for different URLs are not coalesced."""
+        view, started = self.make_view()
+        responses = []
+        first = threading.Thread(target=lambda: responses.append(view(self.request(path='/a'))))
+        first.start()
+        started.wait()
+        responses.append(view(self.request(path='/b')))
+        first.join()
+        self.assertEqual(sorted(self.calls), ['/a', '/b'])
+
+    def test_unshareable(self):
+        """Responses which set cookies are not shared."""
+        view, started = self.make_view(set_cookie=True)
+        self.run_concurrently(view, started, 3)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(sorted(self.outcomes), ['leader', 'unshared', 'unshared'])
+
+    def test_check(self):
+        """Requests are checked before following another and may be refused."""
+        checked = []
+
+        def check(request):
+            checked.append(request.path)
+            if len(checked) > 1:
+                return HttpResponse('throttled', status=429)
+            return None
+
+        view, started = self.make_view(check=check)
+        responses = self.run_concurrently(view, started, 3)
+        self.assertEqual(len(self.calls), 1)
+        # The leader is checked by the view itself.
+        self.assertEqual(len(checked), 2)
+        self.assertEqual(
+            sorted(r.status_code for r in responses), [200, 200, 429])
+
+    def test_post(self):
+        """Only GET and HEAD requests are coalesced."""
+        view, _ = self.make_view()
+        view(self.request(method='post'))
+        self.assertEqual(self.outcomes, [])
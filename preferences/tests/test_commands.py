@@ -0,0 +1,349 @@
+"""
+Test the preferences management commands.
+
+"""
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from preferences import caching, jobs, startup, summaries
+from preferences.models import ArchivedPreference, Job, Preference, PreferenceSummary
+
+
+class ImportExportTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def write_csv(self, name, rows):
+        with open(self.path(name), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        return self.path(name)
+
+    def call(self, *args, **kwargs):
+        stdout = io.StringIO()
+        call_command(*args, stdout=stdout, stderr=io.StringIO(), **kwargs)
+        return stdout.getvalue()
+
+
+class ImportPreferencesTests(ImportExportTestCase):
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.users = [User.objects.create(username='test{:04d}'.format(i)) for i in range(5)]
+
+    def test_import_csv(self):
+        """Preferences are imported from CSV in chunks."""
+        path = self.write_csv('prefs.csv', [
+            {'user': user.username, 'institution': 'UIS', 'allow_capture': 'yes',
+             'request_hold': 'no', 'created_at': '2018-10-01T12:00:00Z'}
+            for user in self.users
+        ])
+        output = self.call('importpreferences', path, chunk_size=2)
+        self.assertIn('Imported 5 preferences', output)
+        self.assertIn('records/s', output)
+        self.assertEqual(Preference.objects.count(), 5)
+        p = Preference.objects.get(user=self.users[0])
+        self.assertTrue(p.allow_capture)
+        self.assertFalse(p.request_hold)
+        self.assertEqual(p.institution, 'UIS')
+        self.assertEqual(p.created_at.isoformat(), '2018-10-01T12:00:00+00:00')
+
+    def test_import_jsonl(self):
+        """Preferences are imported from JSON Lines."""
+        with open(self.path('prefs.jsonl'), 'w') as f:
+            for user in self.users:
+                f.write(json.dumps({'user': user.username, 'allow_capture': False}) + '\n')
+        self.call('importpreferences', self.path('prefs.jsonl'))
+        self.assertEqual(Preference.objects.filter(allow_capture=False).count(), 5)
+
+    def test_unknown_users(self):
+        """Records for unknown users are skipped unless users are to be created."""
+        path = self.write_csv('prefs.csv', [
+            {'user': 'test0000', 'allow_capture': 'true'},
+            {'user': 'newuser', 'allow_capture': 'true'},
+        ])
+        output = self.call('importpreferences', path)
+        self.assertIn('skipped 1', output)
+        self.assertEqual(Preference.objects.count(), 1)
+
+        output = self.call('importpreferences', path, create_users=True)
+        self.assertIn('created 1 users', output)
+        self.assertEqual(Preference.objects.filter(user__username='newuser').count(), 1)
+
+    def test_invalid_record(self):
+        """An invalid record aborts the import leaving earlier chunks imported."""
+        path = self.write_csv('prefs.csv', [
+            {'user': 'test0000', 'allow_capture': 'true'},
+            {'user': 'test0001', 'allow_capture': 'true'},
+            {'user': 'test0002', 'allow_capture': 'maybe'},
+        ])
+        with self.assertRaisesRegex(CommandError, 'line 4'):
+            self.call('importpreferences', path, chunk_size=2)
+        self.assertEqual(Preference.objects.count(), 2)
+
+    def test_unknown_format(self):
+        """Files whose format cannot be guessed are rejected."""
+        with self.assertRaises(CommandError):
+            self.call('importpreferences', self.path('prefs.txt'))
+
+    def test_chunk_queries(self):
+        """The number of queries depends on the number of chunks, not the number of records."""
+        path = self.write_csv('prefs.csv', [
+            {'user': user.username, 'allow_capture': 'true'} for user in self.users * 4
+        ])
+        # Per chunk: savepoint, user query, latest preferences query, insert and release savepoint.
+        # The first chunk also creates and updates the summaries.
+        with self.assertNumQueries(5 * 2 + 2):
+            self.call('importpreferences', path, chunk_size=10)
+        self.assertEqual(Preference.objects.count(), 20)
+
+
+class ExportPreferencesTests(ImportExportTestCase):
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        for i in range(5):
+            user = User.objects.create(username='test{:04d}'.format(i))
+            Preference.objects.create(user=user, allow_capture=False)
+            Preference.objects.create(user=user, allow_capture=True, institution='UIS')
+
+    def test_export_current(self):
+        """By default, current preferences are exported."""
+        self.call('exportpreferences', self.path('out.csv'))
+        with open(self.path('out.csv')) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(all(row['allow_capture'] == 'True' for row in rows))
+
+    def test_export_all(self):
+        """The entire history may be exported."""
+        self.call('exportpreferences', self.path('out.jsonl'), all_history=True)
+        with open(self.path('out.jsonl')) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(len(rows), 10)
+
+    def test_round_trip(self):
+        """Exported preferences may be re-imported."""
+        self.call('exportpreferences', self.path('out.jsonl'), all_history=True)
+        Preference.objects.all().delete()
+        self.call('importpreferences', self.path('out.jsonl'))
+        self.assertEqual(Preference.objects.count(), 10)
+        self.assertTrue(all(p.allow_capture for p in Preference.objects.current()))
+
+
+class ArchivePreferencesTests(ImportExportTestCase):
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.users = [User.objects.create(username='test{:04d}'.format(i)) for i in range(2)]
+        self.old = [
+            # Three preferences in one term, the latest of which is kept, and one in another.
+            self.express(self.users[0], 2024, 1, 1, allow_capture=False),
+            self.express(self.users[0], 2024, 2, 1, allow_capture=False),
+            self.express(self.users[0], 2024, 3, 1),
+            self.express(self.users[0], 2024, 5, 1),
+            self.express(self.users[1], 2024, 5, 1),
+            self.express(self.users[1], 2024, 5, 2),
+        ]
+        # Recent preferences are kept even if superseded.
+        self.express(self.users[1], 2026, 10, 1, allow_capture=False)
+        self.express(self.users[1], 2026, 10, 2)
+
+    def express(self, user, year, month, day, allow_capture=True):
+        return Preference.objects.create(
+            user=user, allow_capture=allow_capture,
+            created_at=timezone.make_aware(datetime.datetime(year, month, day, 12)))
+
+    def counts(self):
+        return sorted(PreferenceSummary.objects.values_list(
+            'term', 'institution', 'allow_capture_count', 'deny_capture_count'))
+
+    def test_archive(self):
+        """Superseded preferences older than the retention period are moved in batches."""
+        counts = self.counts()
+        out = self.call('archivepreferences', '--retention-days', '365', '--batch-size', '1')
+        self.assertIn('2024-lent: archived 1 preference(s), 2 in total', out)
+        self.assertIn('Archived 3 records in', out)
+        self.assertIn('in 3 batch(es)', out)
+
+        archived = {self.old[0].id, self.old[1].id, self.old[4].id}
+        self.assertEqual(set(ArchivedPreference.objects.values_list('id', flat=True)), archived)
+        self.assertFalse(Preference.objects.filter(id__in=archived).exists())
+        self.assertEqual(Preference.objects.count(), 5)
+        self.assertFalse(ArchivedPreference.objects.get(id=self.old[0].id).allow_capture)
+
+        # Summaries are unchanged, including when rebuilt.
+        summaries.refresh()
+        self.assertEqual(self.counts(), counts)
+
+        self.assertIn('Archived 0 records', self.call('archivepreferences'))
+
+    @override_settings(PREFERENCES_RESPONSE_CACHE='default')
+    def test_invalidates(self):
+        """Archiving invalidates cached responses and queues a single rebuild of summaries."""
+        cache = caches['default']
+        cache.clear()
+        self.addCleanup(cache.clear)
+        version_keys = ['preferences:response:version:{}'.format(scope) for scope in (
+            caching.ALL, caching.user_scope(self.users[0].pk))]
+        counts = self.counts()
+
+        with mock.patch('django.db.transaction.on_commit', lambda func: func()):
+            self.client.get(reverse('preferences:summary-list'))
+            self.client.force_login(self.users[0])
+            me = self.client.get(reverse('preferences:preference-me')).json()
+            versions = cache.get_many(version_keys)
+            self.assertEqual(len(versions), 2)
+
+            self.call('archivepreferences', '--retention-days', '365', '--batch-size', '1')
+
+            new_versions = cache.get_many(version_keys)
+            self.assertTrue(all(new_versions[key] != versions[key] for key in version_keys))
+            self.assertEqual(self.client.get(reverse('preferences:preference-me')).json(), me)
+
+        self.assertEqual(Job.objects.filter(task=summaries.REFRESH_TASK).count(), 1)
+        for pk in jobs.claim('test'):
+            jobs.run(pk)
+        self.assertEqual(self.counts(), counts)
+
+    def test_retention(self):
+        """Preferences within the retention period are kept."""
+        self.call('archivepreferences', '--retention-days', '3650')
+        self.assertEqual(Preference.objects.count(), 8)
+
+    def test_output(self):
+        """Preferences may instead be appended to a compressed JSON Lines file."""
+        path = self.path('archive.jsonl.gz')
+        self.express(self.users[1], 2024, 5, 3)
+        self.call('archivepreferences', '--output', path, '--retention-days', '365')
+        self.assertFalse(ArchivedPreference.objects.exists())
+        self.assertEqual(Preference.objects.count(), 5)
+
+        # A later run appends to the file.
+        self.express(self.users[1], 2024, 5, 4)
+        self.call('archivepreferences', '--output', path, '--retention-days', '365')
+        with gzip.open(path, 'rt') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(
+            [(record['user'], record['created_at'][:10]) for record in records],
+            [('test0000', '2024-01-01'), ('test0000', '2024-02-01'),
+             ('test0001', '2024-05-01'), ('test0001', '2024-05-02'),
+             ('test0001', '2024-05-03')])
+
+    def test_output_after_crash(self):
+        """An unfinished member left by a run which was killed is discarded by the next run."""
+        path = self.path('archive.jsonl.gz')
+        self.call('archivepreferences', '--output', path, '--retention-days', '365')
+
+        # Simulate a run killed while writing a batch. Its preferences were not deleted.
+        with open(path, 'ab') as f:
+            f.write(gzip.compress(b'{"user": "test0001"}\n' * 1000)[:20])
+
+        self.express(self.users[1], 2024, 5, 3)
+        self.call('archivepreferences', '--output', path, '--retention-days', '365')
+        with gzip.open(path, 'rt') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(
+            [(record['user'], record['created_at'][:10]) for record in records],
+            [('test0000', '2024-01-01'), ('test0000', '2024-02-01'),
+             ('test0001', '2024-05-01'), ('test0001', '2024-05-02')])
+
+    def test_bad_options(self):
+        """The batch size must be positive and the retention period must not be negative."""
+        with self.assertRaises(CommandError):
+            call_command('archivepreferences', '--batch-size', '0')
+        with self.assertRaises(CommandError):
+            call_command('archivepreferences', '--retention-days', '-1')
+
+
+class ProfileStartupTests(TestCase):
+    def test_report(self):
+        """Start up time is reported for each installed app."""
+        out = io.StringIO()
+        call_command('profilestartup', '--repeat', '1', '--modules', '3', stdout=out)
+        report = out.getvalue()
+        for label in ('django.contrib.auth', 'preferences', 'urls', 'total', 'module'):
+            self.assertIn(label, report)
+
+    def test_bad_repeat(self):
+        """The number of repeats must be positive."""
+        with self.assertRaises(CommandError):
+            call_command('profilestartup', '--repeat', '0')
+
+    def test_parse_importtime(self):
+        """Cumulative import times are summed by top-level package."""
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       100 |        100 |   django.utils',
+            'import time:       200 |       1000 | django',
+            'import time:       300 |       3000 | django.urls',
+            'import time:       400 |        400 | yaml',
+        ])
+        self.assertEqual(startup.parse_importtime(output), {'django': 0.004, 'yaml': 0.0004})
+
+
+class WriteAPISchemaTests(TestCase):
+    def test_write(self):
+        """The schema is written to the output directory."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            call_command(
+                'writeapischema', '--output-dir', tmpdir, '--format', '.json',
+                stdout=io.StringIO())
+            with open(os.path.join(tmpdir, 'swagger.json')) as fobj:
+                self.assertIn('/preferences/', json.load(fobj)['paths'])
+
+    def test_no_output_dir(self):
+        """An output directory must be given if API_SCHEMA_ROOT is not set."""
+        with self.settings(API_SCHEMA_ROOT=None):
+            with self.assertRaises(CommandError):
+                call_command('writeapischema')
+
+
+class PurgeSessionsTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for index in range(5):
+            Session.objects.create(
+                session_key='expired{}'.format(index), session_data='',
+                expire_date=now - datetime.timedelta(days=1))
+        Session.objects.create(
+            session_key='current', session_data='', expire_date=now + datetime.timedelta(days=1))
+
+    def test_purge(self):
+        """Expired sessions are deleted in batches and current sessions are kept."""
+        out = io.StringIO()
+        with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.db'):
+            call_command('purgesessions', '--batch-size', '2', stdout=out)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['current'])
+        self.assertIn('Deleted 5 expired session(s) in 3 batch(es)', out.getvalue())
+
+    def test_signed_cookies(self):
+        """Nothing is deleted if sessions are not stored in the database."""
+        with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies'):
+            call_command('purgesessions', stdout=io.StringIO())
+        self.assertEqual(Session.objects.count(), 6)
+
+    def test_bad_batch_size(self):
+        """The batch size must be positive."""
+        with self.assertRaises(CommandError):
+            call_command('purgesessions', '--batch-size', '0')
@@ -0,0 +1,213 @@
+"""
+Test the background job queue.
+
+"""
+import datetime
+import io
+import json
+import os
+import tempfile
+import threading
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from preferences import jobs, tasks
+from preferences.models import Job, Preference
+
+calls = []
+
+
+@jobs.task(name='test_add', max_attempts=2, retry_delay=30)
+def add(a, b):
+    calls.append((a, b))
+    return a + b
+
+
+@jobs.task(name='test_fail', max_attempts=2, retry_delay=30)
+def fail():
+    raise RuntimeError('expected')
+
+
+class JobTestCase(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def run_due(self):
+        """Claim and run every job which is due."""
+        for pk in jobs.claim('test', limit=100):
+            jobs.run(pk)
+
+
+class EnqueueTests(JobTestCase):
+    def test_enqueue(self):
+        """Queued jobs record their task and arguments."""
+        job = add.enqueue(a=1, b=2)
+        self.assertEqual(job.task, 'test_add')
+        self.assertEqual(json.loads(job.arguments), {'a': 1, 'b': 2})
+        self.assertEqual(job.state, Job.PENDING)
+        self.assertEqual(job.max_attempts, 2)
+
+    def test_unknown_task(self):
+        """Only registered tasks may be queued."""
+        with self.assertRaises(KeyError):
+            jobs.enqueue('not-a-task')
+
+    def test_dedup(self):
+        """Jobs with the key of a pending or running job are not queued."""
+        first = add.enqueue(a=1, b=2, dedup_key='add')
+        self.assertEqual(add.enqueue(a=1, b=2, dedup_key='add').pk, first.pk)
+        self.assertEqual(Job.objects.count(), 1)
+
+        # Once the job has finished, an equivalent job may be queued.
+        self.run_due()
+        self.assertNotEqual(add.enqueue(a=1, b=2, dedup_key='add').pk, first.pk)
+
+
+class RunTests(JobTestCase):
+    def test_success(self):
+        """Successful jobs record their result."""
+        job = add.enqueue(a=1, b=2)
+        self.run_due()
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.SUCCEEDED)
+        self.assertEqual(json.loads(job.result), 3)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_not_due(self):
+        """Jobs are not run before they are due."""
+        add.enqueue(a=1, b=2, run_after=timezone.now() + datetime.timedelta(hours=1))
+        self.run_due()
+        self.assertEqual(calls, [])
+
+    def test_retry(self):
+        """Failed jobs are retried after a delay and then marked as failed."""
+        job = fail.enqueue()
+        self.run_due()
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.PENDING)
+        self.assertIn('expected', job.error)
+        self.assertGreater(job.run_after, timezone.now() + datetime.timedelta(seconds=20))
+
+        Job.objects.update(run_after=timezone.now())
+        self.run_due()
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_claimed_once(self):
+        """A job is only claimed by one worker."""
+        add.enqueue(a=1, b=2)
+        self.assertEqual(len(jobs.claim('one')), 1)
+        self.assertEqual(jobs.claim('two'), [])
+
+    def test_abandoned(self):
+        """Jobs whose lease has expired are started again or, if out of attempts, failed."""
+        job = add.enqueue(a=1, b=2)
+        jobs.claim('crashed')
+        Job.objects.update(lease_expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(jobs.claim('other'), [job.pk])
+
+        Job.objects.update(lease_expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(jobs.claim('third'), [])
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.FAILED)
+        self.assertEqual(job.error, 'The job was abandoned by worker other before it finished')
+
+
+class WorkerTests(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_runjobs(self):
+        """The worker command runs all due jobs in a pool of threads."""
+        for value in range(5):
+            add.enqueue(a=value, b=1)
+        out = io.StringIO()
+        call_command('runjobs', '--burst', '--concurrency', '3', stdout=out)
+        self.assertIn('Ran 5 job(s)', out.getvalue())
+        self.assertEqual(sorted(calls), [(value, 1) for value in range(5)])
+        self.assertEqual(Job.objects.filter(state=Job.SUCCEEDED).count(), 5)
+
+    def test_stop(self):
+        """Stopping a worker lets running jobs finish."""
+        worker = jobs.Worker(poll_interval=0.01)
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+        add.enqueue(a=1, b=2)
+        while Job.objects.filter(state=Job.SUCCEEDED).count() == 0:
+            thread.join(0.01)
+        worker.stop()
+        thread.join()
+        self.assertEqual(calls, [(1, 2)])
+
+    def test_bad_concurrency(self):
+        """Concurrency must be positive."""
+        with self.assertRaises(CommandError):
+            call_command('runjobs', '--concurrency', '0')
+
+
+class TaskTests(JobTestCase):
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        for idx in range(3):
+            Preference.objects.create(
+                user=User.objects.create(username='spqr{}'.format(idx)), institution='UIS',
+                allow_capture=True)
+
+    def test_refresh_lookup(self):
+        """Lookup entries are refreshed for every user and institution with a preference."""
+        with mock.patch('preferences.lookup.lookup_cache') as lookup_cache:
+            lookup_cache.refresh_people.side_effect = len
+            lookup_cache.refresh_institutions.side_effect = len
+            result = tasks.refresh_lookup(chunk_size=2)
+        self.assertEqual(result, {'people': 3, 'institutions': 1})
+        self.assertEqual(lookup_cache.refresh_people.call_count, 2)
+
+    def test_export_preferences(self):
+        """Preferences may be exported by a job."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'export.csv')
+            job = tasks.export_preferences.enqueue(path=path)
+            self.run_due()
+            job.refresh_from_db()
+            self.assertEqual(job.state, Job.SUCCEEDED, job.error)
+            with open(path) as fobj:
+                self.assertEqual(len(fobj.readlines()), 4)
+
+
+class JobViewSetTests(JobTestCase):
+    def setUp(self):
+        super().setUp()
+        self.job = add.enqueue(a=1, b=2)
+        self.run_due()
+        self.staff = get_user_model().objects.create(username='staff', is_staff=True)
+
+    def test_staff_only(self):
+        """Only staff may see jobs."""
+        r = self.client.get(reverse('preferences:job-list'))
+        self.assertIn(r.status_code, (401, 403))
+
+    def test_detail(self):
+        """Job status and results are available from the API."""
+        self.client.force_login(self.staff)
+        r = self.client.get(reverse('preferences:job-detail', kwargs={'pk': self.job.pk}))
+        self.assertEqual(r.status_code, 200)
+        body = r.json()
+        self.assertEqual(body['state'], Job.SUCCEEDED)
+        self.assertEqual(body['arguments'], {'a': 1, 'b': 2})
+        self.assertEqual(body['result'], 3)
+
+    def test_filter(self):
+        """Jobs may be filtered by state."""
+        fail.enqueue()
+        self.client.force_login(self.staff)
+        r = self.client.get(reverse('preferences:job-list'), {'state': Job.PENDING})
+        self.assertEqual([job['task'] for job in r.json()['results']], ['test_fail'])
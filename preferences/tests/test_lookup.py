@@ -0,0 +1,144 @@
+"""
+Test caching of Lookup responses.
+
+"""
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from preferences import lookup
+
+
+class FakeLookupClient:
+    """A Lookup client which serves a fixed set of people and records the requests made."""
+    def __init__(self):
+        self.people = {
+            'spqr{}'.format(i): {
+                'crsid': 'spqr{}'.format(i), 'visible_name': 'Person {}'.format(i),
+                'institutions': ['UIS'],
+            }
+            for i in range(250)
+        }
+        self.institutions = {'UIS': {'instid': 'UIS', 'name': 'University Information Services'}}
+        self.requests = []
+
+    def get_people(self, crsids):
+        self.requests.append(('person', list(crsids)))
+        return {crsid: self.people[crsid] for crsid in crsids if crsid in self.people}
+
+    def get_institutions(self, instids):
+        self.requests.append(('inst', list(instids)))
+        return {
+            instid: self.institutions[instid] for instid in instids if instid in self.institutions
+        }
+
+
+class SynchronousExecutor:
+    """An executor which runs submitted functions immediately."""
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'lookup': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'lookup-tests',
+    },
+})
+class LookupCacheTests(TestCase):
+    def setUp(self):
+        caches['lookup'].clear()
+        self.client = FakeLookupClient()
+        self.lookup = lookup.LookupCache(
+            client=self.client, cache_alias='lookup', ttl=100, stale_ttl=1000,
+            executor=SynchronousExecutor())
+
+    def test_person_cached(self):
+        """A person is only fetched from Lookup once."""
+        self.assertEqual(self.lookup.get_person('spqr1')['visible_name'], 'Person 1')
+        self.assertEqual(self.lookup.get_person('spqr1')['visible_name'], 'Person 1')
+        self.assertEqual(self.client.requests, [('person', ['spqr1'])])
+
+    def test_institution_cached(self):
+        """An institution is only fetched from Lookup once."""
+        self.assertEqual(self.lookup.get_institution('UIS')['instid'], 'UIS')
+        self.assertEqual(self.lookup.get_institution('UIS')['instid'], 'UIS')
+        self.assertEqual(len(self.client.requests), 1)
+
+    def test_missing_cached(self):
+        """People not in Lookup are not returned but the negative result is cached."""
+        self.assertIsNone(self.lookup.get_person('notfound'))
+        self.assertIsNone(self.lookup.get_person('notfound'))
+        self.assertEqual(len(self.client.requests), 1)
+
+    def test_batched_prefetch(self):
+        """Prefetching people only fetches the missing ones and does so in batches."""
+        self.lookup.get_person('spqr0')
+        crsids = ['spqr{}'.format(i) for i in range(250)]
+        self.lookup.prefetch_people(crsids)
+        self.assertEqual(
+            [len(crsids) for _, crsids in self.client.requests],
+            [1, lookup.MAX_BATCH_SIZE, lookup.MAX_BATCH_SIZE, 249 - 2 * lookup.MAX_BATCH_SIZE])
+
+        del self.client.requests[:]
+        people = self.lookup.get_people(crsids)
+        self.assertEqual(len(people), 250)
+        self.assertEqual(self.client.requests, [])
+
+    def test_stale_while_revalidate(self):
+        """Stale entries are returned immediately and refreshed."""
+        with mock.patch('time.time', return_value=1000):
+            self.lookup.get_person('spqr1')
+        self.client.people['spqr1']['visible_name'] = 'New name'
+
+        # While fresh, the cached value is used without asking Lookup
+        with mock.patch('time.time', return_value=1050):
+            self.assertEqual(self.lookup.get_person('spqr1')['visible_name'], 'Person 1')
+        self.assertEqual(len(self.client.requests), 1)
+
+        # When stale, the cached value is returned and a refresh is made
+        with mock.patch('time.time', return_value=1200):
+            self.assertEqual(self.lookup.get_person('spqr1')['visible_name'], 'Person 1')
+        self.assertEqual(len(self.client.requests), 2)
+
+        # The refreshed value is now used
+        with mock.patch('time.time', return_value=1250):
+            self.assertEqual(self.lookup.get_person('spqr1')['visible_name'], 'New name')
+        self.assertEqual(len(self.client.requests), 2)
+
+    def test_single_refresh_in_flight(self):
+        """Only one refresh of a stale entry is started at a time."""
+        submitted = []
+        self.lookup = lookup.LookupCache(
+            client=self.client, cache_alias='lookup', ttl=100, stale_ttl=1000,
+            executor=mock.Mock(submit=submitted.append))
+        with mock.patch('time.time', return_value=1000):
+            self.lookup.get_person('spqr1')
+        with mock.patch('time.time', return_value=1200):
+            self.lookup.get_person('spqr1')
+            self.lookup.get_person('spqr1')
+        self.assertEqual(len(submitted), 1)
+
+    def test_refresh_error(self):
+        """An error refreshing a stale entry leaves the stale entry in place."""
+        with mock.patch('time.time', return_value=1000):
+            self.lookup.get_person('spqr1')
+        with mock.patch.object(self.client, 'get_people', side_effect=RuntimeError()), \
+                mock.patch('time.time', return_value=1200):
+            self.assertEqual(self.lookup.get_person('spqr1')['visible_name'], 'Person 1')
+
+    def test_invalidate(self):
+        """Invalidated people are re-fetched."""
+        self.lookup.get_person('spqr1')
+        self.lookup.invalidate_people(['spqr1'])
+        self.lookup.get_person('spqr1')
+        self.assertEqual(len(self.client.requests), 2)
+
+    @override_settings(PREFERENCES_LOOKUP_CACHE='lookup', PREFERENCES_LOOKUP_CACHE_TTL=5)
+    def test_settings(self):
+        """Unspecified options are taken from settings."""
+        cache = lookup.LookupCache(client=self.client)
+        self.assertIs(cache.cache, caches['lookup'])
+        self.assertEqual(cache.ttl, 5)
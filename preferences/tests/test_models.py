@@ -0,0 +1,71 @@
+"""
+Test the preference model and its custom queryset.
+
+"""
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from preferences.models import Preference
+
+
+class PreferenceTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='test0001')
+
+    def test_append_only(self):
+        """Saving changes to an existing preference fails."""
+        p = Preference.objects.create(user=self.user, allow_capture=True)
+        p.allow_capture = False
+        with self.assertRaises(ValueError):
+            p.save()
+        p.refresh_from_db()
+        self.assertTrue(p.allow_capture)
+
+
+class CurrentPreferenceTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.users = [User.objects.create(username='test{:04d}'.format(i)) for i in range(5)]
+        self.user_without_preference = User.objects.create(username='test9999')
+
+        # Create a history of preferences for each user. The most recent preference for each user
+        # has allow_capture set and all others do not.
+        now = timezone.now()
+        self.expected = {}
+        for user in self.users:
+            for days_ago in (3, 2, 1):
+                p = Preference.objects.create(
+                    user=user, allow_capture=days_ago == 1,
+                    created_at=now - datetime.timedelta(days=days_ago))
+            self.expected[user.id] = p.id
+
+    def test_current(self):
+        """current() returns exactly the most recent preference for each user."""
+        current = Preference.objects.current()
+        self.assertEqual({p.user_id: p.id for p in current}, self.expected)
+        self.assertTrue(all(p.allow_capture for p in current))
+
+    def test_current_tie_break(self):
+        """Preferences with identical timestamps are ordered by primary key."""
+        latest = Preference.objects.filter(user=self.users[0]).first()
+        newer = Preference.objects.create(
+            user=self.users[0], allow_capture=False, created_at=latest.created_at)
+        self.assertEqual(
+            Preference.objects.current().get(user=self.users[0]).id, newer.id)
+
+    def test_for_users(self):
+        """for_users() filters current preferences to the passed users."""
+        users = self.users[:2] + [self.user_without_preference]
+        current = Preference.objects.for_users(users)
+        self.assertEqual(
+            {p.user_id: p.id for p in current},
+            {user.id: self.expected[user.id] for user in self.users[:2]}
+        )
+
+    def test_single_query(self):
+        """Current preferences for many users are fetched in one query."""
+        with self.assertNumQueries(1):
+            list(Preference.objects.for_users(self.users).select_related('user'))
@@ -0,0 +1,225 @@
+"""
+Test materialised preference summaries.
+
+"""
+import datetime
+import io
+import threading
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from preferences import bulk, jobs, summaries
+from preferences.models import Job, Preference, PreferenceSummary
+
+
+def counts():
+    """Return the summaries as a dictionary keyed by (institution, term)."""
+    return {
+        (summary.institution, summary.term): (
+            summary.allow_capture_count, summary.deny_capture_count, summary.request_hold_count)
+        for summary in PreferenceSummary.objects.all()
+        if (summary.allow_capture_count, summary.deny_capture_count,
+            summary.request_hold_count) != (0, 0, 0)
+    }
+
+
+def at(year, month, day):
+    return timezone.make_aware(datetime.datetime(year, month, day, 12))
+
+
+class TermTests(TestCase):
+    def test_term_for(self):
+        """Terms are named by year and the term containing the month."""
+        self.assertEqual(summaries.term_for(at(2026, 1, 1)), '2026-lent')
+        self.assertEqual(summaries.term_for(at(2026, 3, 31)), '2026-lent')
+        self.assertEqual(summaries.term_for(at(2026, 4, 1)), '2026-easter')
+        self.assertEqual(summaries.term_for(at(2026, 12, 31)), '2026-michaelmas')
+
+    def test_term_bounds(self):
+        """Each term ends where the next begins, including across years."""
+        start, end = summaries.term_bounds('2026-michaelmas')
+        self.assertEqual((start.month, end.year, end.month), (10, 2027, 1))
+        self.assertEqual(summaries.term_for(start), '2026-michaelmas')
+        self.assertEqual(summaries.term_for(end), '2027-lent')
+
+
+class SummaryTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.users = [User.objects.create(username='test{:04d}'.format(i)) for i in range(4)]
+
+    def express(self, user, when, institution='INST0', allow_capture=True, request_hold=False):
+        return Preference.objects.create(
+            user=user, institution=institution, allow_capture=allow_capture,
+            request_hold=request_hold, created_at=when)
+
+    def assertMatchesRefresh(self):
+        """Assert that the incrementally maintained summaries match rebuilt ones."""
+        incremental = counts()
+        summaries.refresh()
+        self.assertEqual(incremental, counts())
+
+    def test_express(self):
+        """Expressing a preference replaces the user's previous one in the counts."""
+        self.express(self.users[0], at(2026, 10, 2), allow_capture=False)
+        self.express(self.users[1], at(2026, 10, 3), request_hold=True)
+        self.express(self.users[0], at(2026, 10, 4), institution='INST1')
+        self.assertEqual(counts(), {
+            ('INST0', ''): (1, 0, 1),
+            ('INST1', ''): (1, 0, 0),
+            ('INST0', '2026-michaelmas'): (1, 0, 1),
+            ('INST1', '2026-michaelmas'): (1, 0, 0),
+        })
+        self.assertMatchesRefresh()
+
+    def test_terms(self):
+        """Each term counts the latest preference expressed during it."""
+        self.express(self.users[0], at(2026, 2, 1), allow_capture=False)
+        self.express(self.users[0], at(2026, 5, 1))
+        self.assertEqual(counts(), {
+            ('INST0', ''): (1, 0, 0),
+            ('INST0', '2026-lent'): (0, 1, 0),
+            ('INST0', '2026-easter'): (1, 0, 0),
+        })
+        self.assertMatchesRefresh()
+
+    def test_history(self):
+        """Preferences older than the latest ones do not change current counts."""
+        self.express(self.users[0], at(2026, 5, 2))
+        self.express(self.users[0], at(2026, 5, 1), allow_capture=False)
+        self.assertEqual(counts(), {('INST0', ''): (1, 0, 0), ('INST0', '2026-easter'): (1, 0, 0)})
+        self.assertMatchesRefresh()
+
+    def test_import(self):
+        """Imported preferences are counted, including several for one user in one chunk."""
+        self.express(self.users[0], at(2026, 2, 1), allow_capture=False)
+        records = [
+            {'user': user.username, 'institution': 'INST{}'.format(idx % 2),
+             'allow_capture': idx % 3 != 0, 'created_at': when.isoformat()}
+            for idx, (user, when) in enumerate(
+                (user, when) for when in (at(2025, 11, 1), at(2026, 3, 1), at(2026, 6, 1))
+                for user in self.users)
+        ]
+        bulk.import_records(enumerate(records), chunk_size=5)
+        self.assertMatchesRefresh()
+        self.assertEqual(sum(counts()[(i, '')][0] + counts()[(i, '')][1]
+                             for i in ('INST0', 'INST1')), len(self.users))
+
+    def test_refresh_command(self):
+        """The refreshsummaries command rebuilds summaries."""
+        self.express(self.users[0], at(2026, 5, 1))
+        PreferenceSummary.objects.all().delete()
+        stdout = io.StringIO()
+        call_command('refreshsummaries', stdout=stdout)
+        self.assertIn('Rebuilt 2 summary row(s)', stdout.getvalue())
+        self.assertEqual(counts(), {('INST0', ''): (1, 0, 0), ('INST0', '2026-easter'): (1, 0, 0)})
+
+    def test_delete_queues_refresh(self):
+        """Deleting preferences queues a single job which rebuilds summaries."""
+        for user in self.users:
+            self.express(user, at(2026, 5, 1))
+        with mock.patch('django.db.transaction.on_commit', lambda func: func()):
+            self.users[0].delete()
+            self.users[1].delete()
+        self.assertEqual(Job.objects.filter(task=summaries.REFRESH_TASK).count(), 1)
+
+        for pk in jobs.claim('test'):
+            jobs.run(pk)
+        self.assertEqual(counts(), {('INST0', ''): (2, 0, 0), ('INST0', '2026-easter'): (2, 0, 0)})
+
+    @override_settings(PREFERENCES_RESPONSE_CACHE='default')
+    def test_refresh_invalidates(self):
+        """Rebuilding summaries invalidates cached summary responses once committed."""
+        cache = caches['default']
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.express(self.users[0], at(2026, 5, 1))
+        url = reverse('preferences:summary-list')
+
+        # Cache summaries which are out of date, as they are between deleting preferences and the
+        # queued rebuild.
+        PreferenceSummary.objects.all().delete()
+        self.assertEqual(self.client.get(url).json()['results'], [])
+
+        with mock.patch('django.db.transaction.on_commit', lambda func: func()):
+            summaries.refresh()
+        self.assertEqual(
+            [(s['institution'], s['term'], s['allow_capture_count'])
+             for s in self.client.get(url).json()['results']],
+            [('INST0', '', 1)])
+
+
+class SummaryConcurrencyTests(TransactionTestCase):
+    def test_concurrent_expressions(self):
+        """
+        A preference expressed while another transaction is expressing one for the same user
+        replaces that preference rather than the one both found to be current.
+
+        """
+        user = get_user_model().objects.create(username='test0000')
+        Preference.objects.create(user=user, institution='INST0', allow_capture=True)
+        recorded, release, errors = threading.Event(), threading.Event(), []
+
+        def express(**kwargs):
+            try:
+                with transaction.atomic():
+                    Preference.objects.create(user=user, institution='INST0', **kwargs)
+                    recorded.set()
+                    release.wait(5)
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+            finally:
+                connection.close()
+
+        first = threading.Thread(target=express, kwargs={'allow_capture': False})
+        first.start()
+        self.assertTrue(recorded.wait(5))
+
+        # The second transaction starts while the first is still open and waits for it to commit.
+        second = threading.Thread(
+            target=express, kwargs={'allow_capture': True, 'request_hold': True})
+        second.start()
+        second.join(0.5)
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(errors, [])
+
+        incremental = counts()
+        summaries.refresh()
+        self.assertEqual(incremental, counts())
+        self.assertEqual(incremental[('INST0', '')], (1, 0, 1))
+
+
+class PreferenceSummaryViewSetTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        for idx in range(3):
+            Preference.objects.create(
+                user=User.objects.create(username='test{:04d}'.format(idx)),
+                institution='INST{}'.format(idx % 2), allow_capture=True,
+                created_at=at(2026, 10, 1))
+        self.url = reverse('preferences:summary-list')
+
+    def test_current(self):
+        """Summaries of current preferences are listed by default with a single query."""
+        with self.assertNumQueries(1):
+            r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            [(s['institution'], s['term'], s['allow_capture_count']) for s in r.json()['results']],
+            [('INST0', '', 2), ('INST1', '', 1)])
+
+    def test_filter(self):
+        """Summaries may be filtered by term and institution."""
+        r = self.client.get(self.url, {'term': '2026-michaelmas', 'institution': 'INST1'})
+        self.assertEqual(
+            [(s['institution'], s['term']) for s in r.json()['results']],
+            [('INST1', '2026-michaelmas')])
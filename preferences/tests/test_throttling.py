@@ -0,0 +1,86 @@
+"""
+Test rate limiting of API clients.
+
+"""
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.throttling import SimpleRateThrottle
+
+from preferences import coalescing
+
+
+@override_settings(PREFERENCES_THROTTLE_CACHE='default')
+class ThrottlingTests(TestCase):
+    rates = {
+        'anon': '100/minute', 'user': '100/minute', 'token': '3/minute',
+        'preferences_list': '2/minute', 'preferences_export': '1/minute',
+    }
+
+    def setUp(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        patcher = mock.patch.dict(SimpleRateThrottle.THROTTLE_RATES, self.rates)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = get_user_model().objects.create(username='spqr1', is_staff=True)
+        self.list_url = reverse('preferences:preference-list')
+
+    def get_statuses(self, url, count, **kwargs):
+        return [self.client.get(url, **kwargs).status_code for _ in range(count)]
+
+    def test_list_scope(self):
+        """Listing preferences has its own rate."""
+        self.client.force_login(self.user)
+        self.assertEqual(self.get_statuses(self.list_url, 3), [200, 200, 429])
+
+        # Other actions are only subject to the overall limits.
+        changes_url = reverse('preferences:preference-changes')
+        self.assertEqual(self.get_statuses(changes_url, 3), [200, 200, 200])
+
+    def test_coalesced(self):
+        """Requests which would receive the response to an identical request are throttled."""
+        self.client.force_login(self.user)
+        self.assertEqual(self.get_statuses(self.list_url, 2), [200, 200])
+
+        # Act as though an identical request is being handled whose response would be shared.
+        request = RequestFactory().get(self.list_url)
+        request.user = self.user
+        caches['default'].set(
+            '{}:lock:{}'.format(coalescing.KEY_PREFIX, coalescing.request_key(request)), 'other')
+        with mock.patch('preferences.coalescing._follow', return_value=(200, [], b'shared')):
+            self.assertEqual(self.get_statuses(self.list_url, 1), [429])
+
+    def test_per_user(self):
+        """Users are limited separately from each other."""
+        self.client.force_login(self.user)
+        self.assertEqual(self.get_statuses(self.list_url, 3), [200, 200, 429])
+        self.client.force_login(get_user_model().objects.create(username='spqr2'))
+        self.assertEqual(self.get_statuses(self.list_url, 3), [200, 200, 429])
+
+    def test_per_token(self):
+        """Token clients are limited by token."""
+        changes_url = reverse('preferences:preference-changes')
+        tokens = [
+            Token.objects.create(user=self.user),
+            Token.objects.create(user=get_user_model().objects.create(username='spqr2')),
+        ]
+        for token in tokens:
+            self.assertEqual(
+                self.get_statuses(
+                    changes_url, 4, HTTP_AUTHORIZATION='Token {}'.format(token.key)),
+                [200, 200, 200, 429])
+
+    def test_export(self):
+        """Exports are limited and over-limit responses say when to retry."""
+        self.client.force_login(self.user)
+        export_url = reverse('preferences:export')
+        self.assertEqual(self.client.get(export_url).status_code, 200)
+        r = self.client.get(export_url)
+        self.assertEqual(r.status_code, 429)
+        self.assertGreater(int(r['Retry-After']), 0)
@@ -1,8 +1,437 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+
+from preferences.models import Preference
+from project.test.budget import budget
 
 
 class ExampleTests(TestCase):
     def test_get(self):
         r = self.client.get(reverse('preferences:example'))
         self.assertEqual(r.status_code, 200)
+
+
+class PreferenceViewSetTestCase(TestCase):
+    """
+    Base class for tests of the preference API which creates some users, each with a short history
+    of preferences.
+
+    """
+    #: Number of users to create
+    user_count = 12
+
+    def setUp(self):
+        User = get_user_model()
+        self.now = timezone.now()
+        self.users = []
+        for idx in range(self.user_count):
+            user = User.objects.create(username='test{:04d}'.format(idx))
+            self.users.append(user)
+            for days_ago in (2, 1):
+                Preference.objects.create(
+                    user=user, institution='INST{}'.format(idx % 3), allow_capture=days_ago == 1,
+                    created_at=self.now - datetime.timedelta(days=days_ago, minutes=idx))
+        self.list_url = reverse('preferences:preference-list')
+
+        # The API requires authentication. This user has no preferences of their own.
+        self.client.force_login(User.objects.create(username='reader0001'))
+
+    def get_all(self, url, query_count=None):
+        """
+        Follow next links from *url* returning the concatenated results. If *query_count* is not
+        None, assert that each page takes that many queries.
+
+        """
+        results = []
+        while url is not None:
+            if query_count is not None:
+                with self.assertNumQueries(query_count):
+                    r = self.client.get(url)
+            else:
+                r = self.client.get(url)
+            self.assertEqual(r.status_code, 200)
+            body = r.json()
+            results.extend(body['results'])
+            url = body['next']
+        return results
+
+
+class PreferenceListTests(PreferenceViewSetTestCase):
+    def test_list_current(self):
+        """Listing returns the current preference for each user, newest first."""
+        results = self.get_all(self.list_url)
+        self.assertEqual(len(results), len(self.users))
+        self.assertTrue(all(p['allow_capture'] for p in results))
+        self.assertEqual(
+            [p['user'] for p in results], [user.username for user in self.users])
+
+    def test_cursor_pagination(self):
+        """Paging through all results visits every current preference once."""
+        results = self.get_all(self.list_url + '?page_size=5')
+        self.assertEqual(
+            sorted(p['user'] for p in results), sorted(user.username for user in self.users))
+
+    def test_query_count_independent_of_page_size(self):
+        """Each page takes the same number of queries whatever the page size."""
+        # One query each for the session and user, one for the conditional GET validators and
+        # one for the page itself.
+        self.get_all(self.list_url + '?page_size=2', query_count=4)
+        self.get_all(self.list_url + '?page_size=100', query_count=4)
+
+    def test_filter_user(self):
+        """Preferences may be filtered by username."""
+        results = self.get_all(self.list_url + '?user=test0003')
+        self.assertEqual([p['user'] for p in results], ['test0003'])
+
+    def test_filter_institution(self):
+        """Preferences may be filtered by institution."""
+        results = self.get_all(self.list_url + '?institution=INST1')
+        self.assertEqual(len(results), len(self.users) // 3)
+        self.assertTrue(all(p['institution'] == 'INST1' for p in results))
+
+    def test_filter_updated_since(self):
+        """Preferences may be filtered by the time they were expressed."""
+        since = self.now - datetime.timedelta(days=1, minutes=3)
+        results = self.get_all(
+            self.list_url + '?' + 'updated_since=' + since.isoformat().replace('+', '%2B'))
+        self.assertEqual(
+            [p['user'] for p in results], [user.username for user in self.users[:4]])
+
+    def test_anonymous(self):
+        """Anonymous users cannot list preferences, retrieve them or poll for changes."""
+        self.client.logout()
+        p = Preference.objects.filter(user=self.users[0]).first()
+        for url in (self.list_url, reverse('preferences:preference-changes'),
+                    reverse('preferences:preference-detail', kwargs={'pk': p.pk})):
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class PreferenceCreateTests(PreferenceViewSetTestCase):
+    def test_anonymous_create_fails(self):
+        """Anonymous users cannot express preferences."""
+        self.client.logout()
+        r = self.client.post(self.list_url, {'allow_capture': False})
+        self.assertEqual(r.status_code, 403)
+
+    def test_create(self):
+        """Authenticated users express a new preference for themselves."""
+        user = self.users[0]
+        self.client.force_login(user)
+        r = self.client.post(self.list_url, {'allow_capture': False, 'user': 'test0001'})
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(r.json()['user'], user.username)
+        self.assertFalse(Preference.objects.current().get(user=user).allow_capture)
+        self.assertEqual(Preference.objects.filter(user=user).count(), 3)
+
+    def test_retrieve_superseded(self):
+        """Superseded preferences may still be retrieved by id."""
+        oldest = Preference.objects.filter(user=self.users[0]).last()
+        r = self.client.get(reverse('preferences:preference-detail', kwargs={'pk': oldest.pk}))
+        self.assertEqual(r.status_code, 200)
+        self.assertFalse(r.json()['allow_capture'])
+
+
+class PreferenceChangesTests(PreferenceViewSetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.changes_url = reverse('preferences:preference-changes')
+
+    def test_all_changes(self):
+        """Polling from the start returns every preference in the order recorded."""
+        r = self.client.get(self.changes_url + '?limit=1000')
+        self.assertEqual(r.status_code, 200)
+        body = r.json()
+        ids = list(Preference.objects.order_by('id').values_list('id', flat=True))
+        self.assertEqual([p['id'] for p in body['results']], ids)
+        self.assertEqual(body['token'], ids[-1])
+        self.assertFalse(body['has_more'])
+
+    def test_changes_since_token(self):
+        """Polling with a token returns only newer preferences and a new token."""
+        token = self.client.get(self.changes_url + '?limit=1000').json()['token']
+
+        # No changes: same token is returned
+        body = self.client.get(self.changes_url + '?since={}'.format(token)).json()
+        self.assertEqual(body['results'], [])
+        self.assertEqual(body['token'], token)
+
+        # A new preference is reported
+        p = Preference.objects.create(user=self.users[3], allow_capture=False)
+        body = self.client.get(self.changes_url + '?since={}'.format(token)).json()
+        self.assertEqual([r['id'] for r in body['results']], [p.id])
+        self.assertEqual(body['token'], p.id)
+
+    def test_limit(self):
+        """Results are limited and has_more indicates more are available."""
+        seen = []
+        token = 0
+        while True:
+            # One query each for the session, the user and the changes.
+            with self.assertNumQueries(3):
+                body = self.client.get(
+                    self.changes_url + '?limit=5&since={}'.format(token)).json()
+            self.assertLessEqual(len(body['results']), 5)
+            seen.extend(r['id'] for r in body['results'])
+            token = body['token']
+            if not body['has_more']:
+                break
+        self.assertEqual(
+            seen, list(Preference.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_filter(self):
+        """The changes feed may be filtered."""
+        body = self.client.get(self.changes_url + '?user=test0002').json()
+        self.assertEqual(len(body['results']), 2)
+        self.assertTrue(all(r['user'] == 'test0002' for r in body['results']))
+
+    def test_delay(self):
+        """
+        The feed stops at the first recently inserted preference, since a transaction holding a
+        smaller id may still be open, and returns it once the delay has passed.
+
+        """
+        settled_at = self.now - datetime.timedelta(minutes=1)
+        Preference.objects.update(recorded_at=settled_at)
+        token = Preference.objects.order_by('-id').values_list('id', flat=True).first()
+        recent = Preference.objects.create(user=self.users[0], allow_capture=False)
+        settled = Preference.objects.create(user=self.users[1], allow_capture=False)
+        Preference.objects.filter(id=settled.id).update(recorded_at=settled_at)
+
+        with self.settings(PREFERENCES_CHANGES_DELAY=30):
+            body = self.client.get(self.changes_url + '?since={}'.format(token - 1)).json()
+            self.assertEqual([r['id'] for r in body['results']], [token])
+            self.assertEqual(body['token'], token)
+            self.assertFalse(body['has_more'])
+
+            Preference.objects.filter(id=recent.id).update(recorded_at=settled_at)
+            body = self.client.get(self.changes_url + '?since={}'.format(token)).json()
+            self.assertEqual([r['id'] for r in body['results']], [recent.id, settled.id])
+
+    def test_recorded_at(self):
+        """Preferences are stamped with the time they are inserted, including in bulk."""
+        created_at = self.now - datetime.timedelta(days=9)
+        preferences = [
+            Preference(user=user, allow_capture=False, created_at=created_at)
+            for user in self.users[:2]
+        ]
+        before = timezone.now()
+        Preference.objects.bulk_create(preferences[:1])
+        preferences[1].save()
+        recorded = Preference.objects.filter(created_at=created_at).values_list(
+            'recorded_at', flat=True)
+        self.assertEqual(len(recorded), 2)
+        self.assertTrue(all(recorded_at >= before for recorded_at in recorded))
+
+    def test_bad_token(self):
+        """Malformed tokens are rejected."""
+        for since in ('foo', '-1'):
+            r = self.client.get(self.changes_url + '?since=' + since)
+            self.assertEqual(r.status_code, 400)
+
+
+class PreferenceConditionalGetTests(PreferenceViewSetTestCase):
+    def test_list_not_modified(self):
+        """An unchanged list results in 304 Not Modified using only the validator query."""
+        r = self.client.get(self.list_url)
+        self.assertEqual(r.status_code, 200)
+        self.assertIn('ETag', r)
+        self.assertNotIn('Last-Modified', r)
+
+        # One query each for the session and the user, and the validator query.
+        with self.assertNumQueries(3):
+            r2 = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r2.status_code, 304)
+
+    def test_list_modified(self):
+        """Expressing or deleting a preference changes the list ETag."""
+        r = self.client.get(self.list_url)
+        etag = r['ETag']
+        p = Preference.objects.create(
+            user=self.users[0], allow_capture=False,
+            created_at=self.now + datetime.timedelta(minutes=1))
+
+        r2 = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r2.status_code, 200)
+        self.assertNotEqual(r2['ETag'], etag)
+        etag = r2['ETag']
+
+        Preference.objects.filter(user=self.users[1]).delete()
+        r4 = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r4.status_code, 200)
+        self.assertNotEqual(r4['ETag'], etag)
+        etag = r4['ETag']
+
+        # Deleting the newest preference makes an older one current again
+        p.delete()
+        r5 = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r5.status_code, 200)
+        self.assertNotEqual(r5['ETag'], etag)
+
+    def test_list_modified_by_import(self):
+        """Preferences recorded with a past creation time change the list ETag."""
+        r = self.client.get(self.list_url)
+        user = get_user_model().objects.create(username='test9999')
+        Preference.objects.create(
+            user=user, allow_capture=False, created_at=self.now - datetime.timedelta(days=9))
+
+        r2 = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r2.status_code, 200)
+
+    def test_list_etag_per_format(self):
+        """Different representations of the list have different ETags."""
+        json_etag = self.client.get(self.list_url + '?format=json')['ETag']
+        api_etag = self.client.get(self.list_url + '?format=api')['ETag']
+        self.assertNotEqual(json_etag, api_etag)
+
+    def test_filtered_list_etag(self):
+        """Filtered lists are not modified until a preference is expressed or deleted."""
+        url = self.list_url + '?institution=INST0'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # The ETag is shared by all filters and so changes even if the new preference does not
+        # match the filter.
+        Preference.objects.create(user=self.users[1], institution='INST1', allow_capture=False)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_filtered_list_user_leaves(self):
+        """A user whose new preference no longer matches the filter changes the filtered list."""
+        url = self.list_url + '?institution=INST0'
+        r = self.client.get(url)
+        Preference.objects.create(
+            user=self.users[0], institution='INST1', allow_capture=True,
+            created_at=self.now + datetime.timedelta(minutes=1))
+
+        r2 = self.client.get(url, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r2.status_code, 200)
+        self.assertNotIn('test0000', [p['user'] for p in r2.json()['results']])
+
+    def test_detail_not_modified(self):
+        """Preference detail supports conditional GET."""
+        p = Preference.objects.filter(user=self.users[0]).first()
+        url = reverse('preferences:preference-detail', kwargs={'pk': p.pk})
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        with self.assertNumQueries(3):
+            r2 = self.client.get(url, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r2.status_code, 304)
+
+    def test_detail_missing(self):
+        """Missing preferences still result in 404."""
+        url = reverse('preferences:preference-detail', kwargs={'pk': 1000000})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class PreferenceBatchTests(PreferenceViewSetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = get_user_model().objects.create(username='staff0001', is_staff=True)
+        self.batch_url = reverse('preferences:preference-batch')
+
+    def post(self, items):
+        return self.client.post(self.batch_url, json.dumps(items), content_type='application/json')
+
+    def test_non_staff_forbidden(self):
+        """Only staff users may express preferences for others."""
+        self.client.force_login(self.users[0])
+        r = self.post([{'user': 'test0001', 'allow_capture': True}])
+        self.assertEqual(r.status_code, 403)
+
+    def test_batch(self):
+        """Valid items are created and invalid ones are reported, each in its place."""
+        self.client.force_login(self.staff)
+        r = self.post([
+            {'user': 'test0001', 'allow_capture': False, 'institution': 'UIS'},
+            {'user': 'nobody', 'allow_capture': True},
+            {'user': 'test0002'},
+            {'user': 'test0001', 'allow_capture': True, 'request_hold': True},
+        ])
+        self.assertEqual(r.status_code, 200)
+        results = r.json()['results']
+        self.assertEqual([result['status'] for result in results], [201, 400, 400, 201])
+        self.assertIn('user', results[1]['errors'])
+        self.assertIn('allow_capture', results[2]['errors'])
+        self.assertEqual(results[0]['preference']['institution'], 'UIS')
+
+        # The last item for a user becomes their current preference.
+        current = Preference.objects.current().get(user=self.users[1])
+        self.assertEqual((current.allow_capture, current.request_hold), (True, True))
+        self.assertEqual(Preference.objects.count(), 2 * self.user_count + 2)
+
+    def test_queries(self):
+        """The number of queries does not depend on the size of the batch."""
+        self.client.force_login(self.staff)
+        # Each user's previous preference is in one of three institutions and so both batches
+        # change the same summaries.
+        items = [{'user': user.username, 'allow_capture': False} for user in self.users]
+        with CaptureQueriesContext(connection) as small:
+            self.post(items[:3])
+        with CaptureQueriesContext(connection) as large:
+            self.post(items)
+        self.assertEqual(len(small), len(large))
+
+    def test_too_large(self):
+        """Batches must be lists of limited size."""
+        self.client.force_login(self.staff)
+        self.assertEqual(self.post({'user': 'test0001'}).status_code, 400)
+        self.assertEqual(
+            self.post([{'user': 'test0001', 'allow_capture': True}] * 1001).status_code, 400)
+
+
+class ExportTests(PreferenceViewSetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('preferences:export')
+        self.staff = get_user_model().objects.create(username='staff0001', is_staff=True)
+
+    def get_content(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf8')
+
+    def test_requires_staff(self):
+        """Non-staff users are redirected to log in."""
+        self.client.force_login(self.users[0])
+        r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 302)
+
+    @override_settings(PREFERENCES_EXPORT_CHUNK_SIZE=5)
+    def test_export_csv(self):
+        """The current preferences are streamed as CSV."""
+        self.client.force_login(self.staff)
+        r = self.client.get(self.url)
+        self.assertTrue(r.streaming)
+        self.assertTrue(r['Content-Type'].startswith('text/csv'))
+        self.assertIn('attachment', r['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(self.get_content(r))))
+        self.assertEqual(
+            sorted(row['user'] for row in rows), sorted(user.username for user in self.users))
+        self.assertTrue(all(row['allow_capture'] == 'True' for row in rows))
+
+    def test_export_all_jsonl(self):
+        """The entire history may be streamed as JSON Lines."""
+        self.client.force_login(self.staff)
+        content = self.get_content(self.client.get(self.url + '?format=jsonl&all=1'))
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), Preference.objects.count())
+
+    @override_settings(PREFERENCES_EXPORT_CHUNK_SIZE=5)
+    def test_export_query_count(self):
+        """Streaming an export takes a constant number of queries whatever its size."""
+        self.client.force_login(self.staff)
+        # One query each for the session, the user and the preferences.
+        with budget(queries=3):
+            self.get_content(self.client.get(self.url + '?all=1'))
+
+    def test_bad_format(self):
+        """Unknown formats are rejected."""
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(self.url + '?format=xml').status_code, 400)
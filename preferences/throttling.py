@@ -0,0 +1,87 @@
+"""
+Rate limiting of API clients.
+
+The throttles in this module are Django REST framework throttles which keep their request
+histories in the cache named by the
+:py:data:`~preferences.defaultsettings.PREFERENCES_THROTTLE_CACHE` setting. Use a cache shared
+between processes, such as memcached, in production since otherwise each worker process has its
+own limits.
+
+Requests are limited per client: token-authenticated requests by token with the ``token`` rate,
+other authenticated requests by user with the ``user`` rate and anonymous requests by IP address
+with the ``anon`` rate. Expensive views additionally have their own rate, per user or IP address,
+named by their ``throttle_scope`` attribute. Rates are set in the ``DEFAULT_THROTTLE_RATES`` key
+of the ``REST_FRAMEWORK`` setting.
+
+Plain Django views may be throttled with :py:func:`~.throttle`.
+
+"""
+import functools
+import hashlib
+import types
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from rest_framework import throttling
+from rest_framework.authtoken.models import Token
+
+
+class CacheMixin:
+    """A mixin for throttles which use the cache named by ``PREFERENCES_THROTTLE_CACHE``."""
+    @property
+    def cache(self):
+        return caches[settings.PREFERENCES_THROTTLE_CACHE]
+
+
+class AnonRateThrottle(CacheMixin, throttling.AnonRateThrottle):
+    """Limit anonymous requests by IP address."""
+
+
+class UserRateThrottle(CacheMixin, throttling.UserRateThrottle):
+    """Limit authenticated requests by user unless they are authenticated by token."""
+    def get_cache_key(self, request, view):
+        if not request.user.is_authenticated or isinstance(request.auth, Token):
+            return None
+        return super().get_cache_key(request, view)
+
+
+class TokenRateThrottle(CacheMixin, throttling.SimpleRateThrottle):
+    """Limit token-authenticated requests by token."""
+    scope = 'token'
+
+    def get_cache_key(self, request, view):
+        if not isinstance(request.auth, Token):
+            return None
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': hashlib.sha256(request.auth.key.encode('utf8')).hexdigest(),
+        }
+
+
+class ScopedRateThrottle(CacheMixin, throttling.ScopedRateThrottle):
+    """Limit requests to views with a ``throttle_scope`` attribute by user or IP address."""
+
+
+def throttle(scope):
+    """
+    Decorate a Django view so that requests to it are limited by user or IP address to the rate
+    for *scope*. Requests over the limit receive a 429 response with a ``Retry-After`` header.
+
+    """
+    view = types.SimpleNamespace(throttle_scope=scope)
+
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            throttle = ScopedRateThrottle()
+            if not throttle.allow_request(request, view):
+                response = HttpResponse(
+                    'Request was throttled.', status=429, content_type='text/plain')
+                wait = throttle.wait()
+                if wait is not None:
+                    response['Retry-After'] = '{:d}'.format(int(wait) + 1)
+                return response
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -3,12 +3,20 @@ URL routing schema for Lecture Capture Preferences.
 
 """
 
-from django.urls import path
+from django.urls import include, path
+from rest_framework import routers
 
 from . import views
 
 app_name = "preferences"
 
+router = routers.SimpleRouter()
+router.register('preferences', views.PreferenceViewSet, basename='preference')
+router.register('summaries', views.PreferenceSummaryViewSet, basename='summary')
+router.register('jobs', views.JobViewSet, basename='job')
+
 urlpatterns = [
     path('example', views.example, name='example'),
+    path('export', views.export, name='export'),
+    path('api/', include(router.urls)),
 ]
@@ -4,7 +4,36 @@ Views for Lecture Capture Preferences
 """
 
 import datetime
-from django.http import HttpResponse
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Subquery
+from django.utils.decorators import method_decorator
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import condition, require_safe
+from django_filters import rest_framework as df_filters
+from rest_framework import exceptions, mixins, pagination, permissions, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from project import replicas
+
+from . import bulk
+from . import caching
+from . import coalescing
+from . import filters
+from . import models
+from . import serializers
+from . import summaries
+from . import throttling
+
+#: Content types for each export format.
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
 
 
 # Create your views here.
@@ -16,3 +45,398 @@ def example(request):
     now = datetime.datetime.now()
     html = "<html><body>It is now %s.</body></html>" % now
     return HttpResponse(html)
+
+
+@require_safe
+@staff_member_required
+@throttling.throttle('preferences_export')
+@replicas.reads_from_replica
+def export(request):
+    """
+    Download a report of preferences. By default only current preferences are included. Pass
+    ``all=1`` to include the entire history. The ``format`` query parameter may be ``csv``, the
+    default, or ``jsonl``.
+
+    The report is streamed. Preferences are fetched from the database in chunks of
+    :py:data:`~preferences.defaultsettings.PREFERENCES_EXPORT_CHUNK_SIZE` rows using a server-side
+    cursor where the database supports it, so the memory used by the worker does not depend on the
+    size of the report.
+
+    Requests are limited to the ``preferences_export`` throttle rate per user. The report is read
+    from the database replica, if one is configured. See :py:mod:`project.replicas`.
+
+    """
+    format = request.GET.get('format', 'csv')
+    if format not in bulk.FORMATS:
+        return HttpResponseBadRequest('Unknown format: {}'.format(format))
+
+    queryset = models.Preference.objects.select_related('user').order_by('created_at', 'id')
+    if request.GET.get('all', '') in ('', '0'):
+        queryset = queryset.current()
+
+    response = StreamingHttpResponse(
+        _stream_records(queryset, format, settings.PREFERENCES_EXPORT_CHUNK_SIZE),
+        content_type=EXPORT_CONTENT_TYPES[format])
+    response['Content-Disposition'] = 'attachment; filename="preferences.{}"'.format(format)
+    return response
+
+
+class _Echo:
+    """A file-like object which returns what is written to it rather than storing it."""
+    def write(self, value):
+        return value
+
+
+def _stream_records(queryset, format, chunk_size):
+    """
+    Generate the text of an export of *queryset* in *format*. Text is generated for a chunk of rows
+    at a time to avoid the overhead of sending one small piece of text per row.
+
+    """
+    writer = bulk.RecordWriter(_Echo(), format)
+    yield writer.write_header()
+    lines = []
+    for preference in queryset.iterator(chunk_size=chunk_size):
+        lines.append(writer.write(bulk.preference_to_record(preference)))
+        if len(lines) >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+class PreferenceCursorPagination(pagination.CursorPagination):
+    """
+    Cursor-based pagination for preferences. Unlike offset pagination, the cost of fetching a page
+    does not grow with the page's position in the result set and no count query is made.
+
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+@method_decorator(replicas.reads_from_replica, name='list')
+class PreferenceViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                        mixins.CreateModelMixin, viewsets.GenericViewSet):
+    """
+    List, retrieve and express preferences.
+
+    Listing preferences returns only the current preference for each user. Retrieving a preference
+    by id returns it even if it has since been superseded. Creating a preference expresses a new
+    preference for the authenticated user. Preferences are personal to their users and the API
+    accepts requests from any origin and so every action requires authentication.
+
+    Fetching a page of preferences takes a fixed number of queries independent of the page size.
+
+    Downstream systems which want to keep a copy of preferences in sync should use the
+    :py:meth:`.changes` feed rather than repeatedly listing every preference. Staff users may
+    express preferences for many users in one request with :py:meth:`.batch`.
+
+    Listing preferences supports conditional GET via the ``ETag`` header and retrieving a
+    preference via the ``ETag`` and ``Last-Modified`` headers. The validators are computed from the
+    database with a single cheap query and, if they match, a 304 Not Modified response is returned
+    without running the main query at all.
+
+    Listing preferences is limited to the ``preferences_list`` throttle rate per user or IP address
+    in addition to the overall limits for each client. Identical concurrent requests are coalesced
+    so that only one of them is computed, although each is still authenticated and counted by the
+    throttles. See :py:mod:`preferences.coalescing`. Lists are read from
+    the database replica, if one is configured, unless the client has recently expressed a
+    preference. See :py:mod:`project.replicas`.
+
+    """
+    serializer_class = serializers.PreferenceSerializer
+    pagination_class = PreferenceCursorPagination
+    filter_backends = (df_filters.DjangoFilterBackend,)
+    filterset_class = filters.PreferenceFilter
+    permission_classes = (permissions.IsAuthenticated,)
+
+    #: Default maximum number of preferences returned from the changes feed.
+    changes_limit = 100
+
+    #: Largest maximum number of preferences which may be requested from the changes feed.
+    max_changes_limit = 1000
+
+    #: Maximum number of preferences which may be expressed by a single batch request.
+    max_batch_size = 1000
+
+    # Whether the request has been checked against the throttles.
+    _throttled = False
+
+    def dispatch(self, request, *args, **kwargs):
+        return coalescing.coalesce(super().dispatch, check=self._check_follower)(
+            request, *args, **kwargs)
+
+    def _check_follower(self, request, *args, **kwargs):
+        """
+        Authenticate a request which is about to receive the response to an identical concurrent
+        request and check it against the permissions and throttles, as :py:meth:`dispatch` would.
+        Returns a response if the request may not proceed, otherwise None.
+
+        """
+        self.args, self.kwargs = args, kwargs
+        self.request = request = self.initialize_request(request, *args, **kwargs)
+        self.headers = self.default_response_headers
+        try:
+            self.initial(request, *args, **kwargs)
+        except Exception as exc:
+            return self.finalize_response(request, self.handle_exception(exc), *args, **kwargs)
+        # If the response is not shared, the request is dispatched as usual but has already been
+        # counted by the throttles.
+        self._throttled = True
+        return None
+
+    def check_throttles(self, request):
+        if not self._throttled:
+            super().check_throttles(request)
+
+    @property
+    def throttle_scope(self):
+        # Only listing has a rate of its own. Other actions are only subject to the overall limits.
+        return 'preferences_list' if self.action == 'list' else None
+
+    def get_queryset(self):
+        queryset = models.Preference.objects.select_related('user')
+        if self.action == 'list':
+            queryset = queryset.current()
+        return queryset
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        # Preferences are only ever inserted, apart from being deleted, and so the largest id and
+        # the number of preferences deleted together identify the state of the preference table.
+        # The ETag is formed from them rather than from the filtered list, which would take as
+        # long to compute as the list itself. Any change to preferences therefore changes the ETag
+        # of every list, including those the change does not affect. Both are fetched with a
+        # single query which reads one row from the primary key index. Archiving superseded
+        # preferences does not count as deleting them since it never changes the list.
+        #
+        # There is no Last-Modified time since HTTP dates have a resolution of one second and
+        # preferences expressed within the same second as a response would not be noticed.
+        latest = (
+            models.Preference.objects.order_by('-id')
+            .annotate(deletions=Subquery(
+                models.PreferenceDeletions.objects.filter(pk=1).values('count')))
+            .values_list('id', 'deletions')
+            .first()
+        )
+        return self._conditional(
+            super().list, '{}-{}'.format(*latest) if latest is not None else 'empty', None
+        )(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        # Preferences are never modified once saved so their id and creation time are enough to
+        # identify their content.
+        created_at = (
+            models.Preference.objects.filter(pk=kwargs.get('pk'))
+            .values_list('created_at', flat=True).first()
+        )
+        if created_at is None:
+            # Fall through to the usual 404 handling
+            return super().retrieve(request, *args, **kwargs)
+        return self._conditional(
+            super().retrieve, '{}-{}'.format(kwargs.get('pk'), created_at.timestamp()), created_at
+        )(request, *args, **kwargs)
+
+    def _conditional(self, view_func, etag, last_modified):
+        """
+        Wrap *view_func* with Django's :py:func:`~django.views.decorators.http.condition` decorator
+        using the passed ETag and last modified time, which may be None. The ETag is qualified by
+        the negotiated response format since each format is a different representation.
+
+        """
+        etag = '"{}-{}"'.format(self.request.accepted_renderer.format, etag)
+        return condition(
+            etag_func=lambda *args, **kwargs: etag,
+            last_modified_func=lambda *args, **kwargs: last_modified,
+        )(view_func)
+
+    @action(detail=False, permission_classes=(permissions.IsAuthenticated,))
+    @method_decorator(caching.cache_response(
+        lambda request, *args, **kwargs: [caching.user_scope(request.user.pk)]))
+    def me(self, request):
+        """
+        Return the current preference of the authenticated user. Responses are cached until the
+        user next expresses a preference. See :py:mod:`preferences.caching`.
+
+        """
+        preference = self.get_queryset().for_users([request.user.pk]).first()
+        if preference is None:
+            raise exceptions.NotFound('You have not expressed a preference.')
+        return Response(self.get_serializer(preference).data)
+
+    @action(detail=False)
+    def changes(self, request):
+        """
+        Return preferences expressed since a change token together with a new token to pass on the
+        next call. Preferences are returned in the order they were recorded, including superseded
+        ones, so applying them in order brings a copy up to date. The ``since`` query parameter is
+        the token returned by the previous call. Omit it to start from the beginning. At most
+        ``limit`` preferences are returned. If ``has_more`` is true, call again with the new token
+        straight away.
+
+        The token is the largest preference id seen so far and the feed is a range scan of the
+        primary key, so the cost of a poll depends on the number of changes rather than the number
+        of preferences. Ids are allocated in increasing order but, on databases such as
+        PostgreSQL, do not become visible in that order: a transaction holding a smaller id may
+        commit after one holding a larger id. So that a token never passes a preference which is
+        yet to become visible, the feed stops at the first preference inserted less than
+        :py:data:`~preferences.defaultsettings.PREFERENCES_CHANGES_DELAY` seconds ago. Recent
+        preferences are returned by a later poll.
+
+        """
+        since = self._get_int_param(request, 'since', 0)
+        limit = min(self._get_int_param(request, 'limit', self.changes_limit),
+                    self.max_changes_limit)
+        if limit < 1:
+            raise exceptions.ValidationError({'limit': 'Must be a positive integer.'})
+
+        queryset = (
+            self.filter_queryset(self.get_queryset())
+            .filter(id__gt=since)
+            .order_by('id')
+        )
+
+        # Fetch one more than we need to learn if there are more changes
+        preferences = list(queryset[:limit + 1])
+        has_more = len(preferences) > limit
+        preferences = preferences[:limit]
+
+        # A transaction inserting a preference with a smaller id than a recent one may still be
+        # open. Preferences older than the delay were inserted by transactions which have since
+        # committed, as were any with smaller ids.
+        settled_before = timezone.now() - datetime.timedelta(
+            seconds=settings.PREFERENCES_CHANGES_DELAY)
+        for index, preference in enumerate(preferences):
+            if preference.recorded_at > settled_before:
+                preferences, has_more = preferences[:index], False
+                break
+
+        return Response({
+            'results': self.get_serializer(preferences, many=True).data,
+            'token': preferences[-1].id if len(preferences) > 0 else since,
+            'has_more': has_more,
+        })
+
+    @action(detail=False, methods=['post'], permission_classes=(permissions.IsAdminUser,))
+    def batch(self, request):
+        """
+        Express preferences on behalf of several users at once. Only staff users may do this. The
+        request body is a list of objects with the username of the ``user`` and the fields of
+        their new preference. At most :py:attr:`.max_batch_size` items may be sent.
+
+        The response lists a result for each item in the order they were sent. Valid items have
+        ``status`` 201 and the created ``preference``. Invalid items, including those for unknown
+        users, have ``status`` 400 and ``errors`` and are not created. If a user appears more than
+        once, their last item becomes their current preference.
+
+        Users are fetched with a single query and all valid items are inserted with a single
+        :py:meth:`~django.db.models.query.QuerySet.bulk_create` in one transaction, so the number
+        of queries does not depend on the size of the batch. Preference ids are only returned by
+        database backends, such as PostgreSQL, which report the primary keys of bulk inserts.
+
+        """
+        items = request.data
+        if not isinstance(items, list):
+            raise exceptions.ValidationError('Expected a list of preferences.')
+        if len(items) > self.max_batch_size:
+            raise exceptions.ValidationError(
+                'At most {} preferences may be sent at once.'.format(self.max_batch_size))
+
+        results, valid = [], []
+        for item in items:
+            serializer = serializers.PreferenceBatchItemSerializer(data=item)
+            if serializer.is_valid():
+                valid.append((len(results), serializer.validated_data))
+                results.append(None)
+            else:
+                results.append({'status': 400, 'errors': serializer.errors})
+
+        users = get_user_model().objects.in_bulk(
+            {data['user'] for _, data in valid}, field_name='username')
+
+        # All preferences in the batch are expressed at the same moment. Later items for a user
+        # have larger ids and so supersede earlier ones.
+        now, created = timezone.now(), []
+        for index, data in valid:
+            user = users.get(data['user'])
+            if user is None:
+                results[index] = {'status': 400, 'errors': {'user': ['Unknown user.']}}
+                continue
+            created.append((index, models.Preference(
+                user=user, institution=data.get('institution', ''),
+                allow_capture=data['allow_capture'],
+                request_hold=data.get('request_hold', False), created_at=now)))
+
+        preferences = [preference for _, preference in created]
+        with transaction.atomic():
+            # bulk_create() does not send post_save and so summaries are updated and cached
+            # responses invalidated explicitly.
+            summaries.record(preferences)
+            models.Preference.objects.bulk_create(preferences)
+            caching.invalidate(preference.user_id for preference in preferences)
+
+        for index, preference in created:
+            results[index] = {
+                'status': 201,
+                'preference': serializers.PreferenceSerializer(preference).data,
+            }
+        return Response({'results': results})
+
+    def _get_int_param(self, request, name, default):
+        value = request.query_params.get(name)
+        if value is None or value == '':
+            return default
+        try:
+            value = int(value)
+        except ValueError:
+            raise exceptions.ValidationError({name: 'Must be an integer.'})
+        if value < 0:
+            raise exceptions.ValidationError({name: 'Must not be negative.'})
+        return value
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    List and retrieve background jobs so that their progress may be followed. Only staff users may
+    see jobs. Jobs may be filtered by ``state`` and ``task``. See :py:mod:`preferences.jobs`.
+
+    """
+    queryset = models.Job.objects.all()
+    serializer_class = serializers.JobSerializer
+    # Jobs are ordered by creation time, as are preferences.
+    pagination_class = PreferenceCursorPagination
+    filter_backends = (df_filters.DjangoFilterBackend,)
+    filterset_fields = ('state', 'task')
+    permission_classes = (permissions.IsAdminUser,)
+
+
+class PreferenceSummaryPagination(pagination.CursorPagination):
+    """Cursor-based pagination for preference summaries ordered by department."""
+    ordering = ('institution',)
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+@method_decorator(
+    caching.cache_response(lambda request, *args, **kwargs: [caching.ALL]), name='list')
+@method_decorator(replicas.reads_from_replica, name='list')
+class PreferenceSummaryViewSet(viewsets.GenericViewSet, mixins.ListModelMixin):
+    """
+    List counts of preferences by department. By default, the counts are of current preferences.
+    Pass ``term``, for example ``2026-michaelmas``, for counts of the latest preference each user
+    expressed during that term. Summaries are maintained as preferences are expressed and so
+    listing them does not aggregate the preference history. See :py:mod:`preferences.summaries`.
+    Summaries are read from the database replica, if one is configured. Responses are cached until
+    any preference changes. See :py:mod:`preferences.caching`.
+
+    """
+    queryset = models.PreferenceSummary.objects.all()
+    serializer_class = serializers.PreferenceSummarySerializer
+    pagination_class = PreferenceSummaryPagination
+    filter_backends = (df_filters.DjangoFilterBackend,)
+    filterset_class = filters.PreferenceSummaryFilter
@@ -0,0 +1,21 @@
+"""
+Benchmark suite for Lecture Capture Preferences.
+
+The suite creates a test database, seeds it with a realistic volume of users and preference
+history, by default 100,000 users with ten preferences each, and then measures a set of endpoints
+in two ways:
+
+1. Serially, with the Django test client, recording the latency and number of database queries of
+   each request.
+2. Under load, with an in-process WSGI load generator which calls the WSGI application from
+   several threads at once, recording throughput and latency.
+
+The results are compared against a stored baseline and the suite fails if the 95th percentile
+latency or the query count of any endpoint has regressed beyond a tolerance. Run it via tox:
+
+.. code-block:: bash
+
+    $ ./tox.sh -e benchmark
+    $ ./tox.sh -e benchmark -- --users 10000 --history 10 --update-baseline
+
+"""
@@ -0,0 +1,191 @@
+"""
+Run the benchmark suite. See :py:mod:`project.benchmark` for an overview.
+
+"""
+import argparse
+import json
+import os
+import sys
+
+import django
+
+#: Default location of the stored baseline.
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m project.benchmark', description='Run the benchmark suite.')
+    parser.add_argument(
+        '--users', type=int, default=100000, help='number of users to seed (default: 100000)')
+    parser.add_argument(
+        '--history', type=int, default=10,
+        help='number of preferences to seed per user (default: 10)')
+    parser.add_argument(
+        '--iterations', type=int, default=50,
+        help='number of serial requests per endpoint (default: 50)')
+    parser.add_argument(
+        '--requests', type=int, default=200,
+        help='number of requests per endpoint under load (default: 200)')
+    parser.add_argument(
+        '--concurrency', type=int, default=4,
+        help='number of concurrent requests under load (default: 4)')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.5,
+        help='allowed fractional increase in p95 latency over the baseline (default: 0.5)')
+    parser.add_argument(
+        '--min-slack', type=float, default=5.0,
+        help='p95 latency increases smaller than this many milliseconds are never treated as '
+             'regressions (default: 5)')
+    parser.add_argument(
+        '--baseline', default=BASELINE_PATH, help='path to baseline (default: %(default)s)')
+    parser.add_argument(
+        '--update-baseline', action='store_true',
+        help='record the results as the new baseline for this scale instead of comparing')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    return parser.parse_args(argv)
+
+
+def scenarios(latest_id):
+    """
+    Return a list of (name, path, iteration scale) tuples describing the endpoints measured. The
+    iteration scale is applied to the number of serial and loaded requests so that slow endpoints
+    such as the export are requested fewer times.
+
+    """
+    from project.benchmark.seed import institution_name
+    return [
+        ('healthz', '/healthz', 1),
+        ('api-list', '/api/preferences/?page_size=100', 1),
+        ('api-list-filtered', '/api/preferences/?institution={}'.format(institution_name(7)), 1),
+        ('api-detail', '/api/preferences/{}/'.format(latest_id), 1),
+        ('api-changes', '/api/preferences/changes/?since={}'.format(max(0, latest_id - 100)), 1),
+        ('export', '/export?format=jsonl', 0.02),
+    ]
+
+
+def run(options, log):
+    from django.contrib.auth import get_user_model
+    from django.test.utils import override_settings
+
+    from preferences.models import Preference
+    from project.benchmark import load, seed
+
+    log('Seeding {} users with {} preferences each'.format(options.users, options.history))
+    seed.seed(users=options.users, history=options.history, progress=log)
+
+    staff = get_user_model().objects.get(username=seed.STAFF_USERNAME)
+    latest_id = Preference.objects.order_by('-id').values_list('id', flat=True).first()
+
+    results = {}
+    # Slow request logging would otherwise write every query of a slow request to the log.
+    with override_settings(REQUEST_TIMING_SLOW_THRESHOLD=None):
+        client = load.new_client(staff)
+        generator = load.WSGILoadGenerator(
+            concurrency=options.concurrency, cookie=load.session_cookie(client))
+
+        for name, path, scale in scenarios(latest_id):
+            iterations = max(5, int(options.iterations * scale))
+            requests = max(options.concurrency, int(options.requests * scale))
+            log('Measuring {} ({} serial, {} under load)'.format(name, iterations, requests))
+            # Warm up caches and lazily initialised state before measuring.
+            load.measure_serial(client, path, 1)
+            serial = load.measure_serial(client, path, iterations)
+            loaded = generator.run(path, requests)
+            results[name] = {'serial': serial, 'load': loaded}
+
+    return results
+
+
+def compare(results, baseline, tolerance, min_slack):
+    """
+    Compare *results* against *baseline*. Return a list of human-readable descriptions of
+    regressions which is empty if there are none. Endpoints missing from the baseline are not
+    compared.
+
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+
+        queries, expected_queries = result['serial']['queries'], expected['serial']['queries']
+        if queries > expected_queries:
+            regressions.append('{}: {} queries, baseline is {}'.format(
+                name, queries, expected_queries))
+
+        for phase in ('serial', 'load'):
+            p95, expected_p95 = result[phase]['p95_ms'], expected[phase]['p95_ms']
+            limit = max(expected_p95 * (1 + tolerance), expected_p95 + min_slack)
+            if p95 > limit:
+                regressions.append('{}: {} p95 is {:.2f}ms, baseline is {:.2f}ms'.format(
+                    name, phase, p95, expected_p95))
+    return regressions
+
+
+def format_table(results, baseline):
+    lines = ['{:<20} {:>8} {:>12} {:>12} {:>10} {:>14}'.format(
+        'endpoint', 'queries', 'serial p95', 'load p95', 'load rps', 'baseline p95')]
+    for name, result in results.items():
+        expected = baseline.get(name)
+        lines.append('{:<20} {:>8} {:>10.2f}ms {:>10.2f}ms {:>10.1f} {:>14}'.format(
+            name, result['serial']['queries'], result['serial']['p95_ms'],
+            result['load']['p95_ms'], result['load']['rps'],
+            '{:.2f}ms'.format(expected['serial']['p95_ms']) if expected is not None else '-'))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    django.setup()
+
+    from django.test.utils import (
+        setup_databases, setup_test_environment, teardown_databases, teardown_test_environment)
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        results = run(options, log)
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+    # Baselines are stored per data volume since latencies depend on it.
+    scale = '{}x{}'.format(options.users, options.history)
+    try:
+        with open(options.baseline) as fobj:
+            baselines = json.load(fobj)
+    except FileNotFoundError:
+        baselines = {}
+
+    print(format_table(results, baselines.get(scale, {})))
+
+    if options.output is not None:
+        with open(options.output, 'w') as fobj:
+            json.dump({scale: results}, fobj, indent=2, sort_keys=True)
+
+    if options.update_baseline:
+        baselines[scale] = results
+        with open(options.baseline, 'w') as fobj:
+            json.dump(baselines, fobj, indent=2, sort_keys=True)
+            fobj.write('\n')
+        log('Updated baseline for {} in {}'.format(scale, options.baseline))
+        return 0
+
+    if scale not in baselines:
+        log('No baseline for {}; run with --update-baseline to record one'.format(scale))
+        return 0
+
+    regressions = compare(results, baselines[scale], options.tolerance, options.min_slack)
+    for regression in regressions:
+        log('REGRESSION: ' + regression)
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
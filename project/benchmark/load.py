@@ -0,0 +1,156 @@
+"""
+Measure endpoints serially with the Django test client and under load with an in-process WSGI
+load generator.
+
+"""
+import io
+import threading
+import time
+import wsgiref.util
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+
+def percentile(values, fraction):
+    """Return the *fraction* percentile of *values* using the nearest-rank method."""
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+def summarise(durations):
+    """Summarise a list of durations in seconds as milliseconds."""
+    return {
+        'p50_ms': round(1000 * percentile(durations, 0.5), 2),
+        'p95_ms': round(1000 * percentile(durations, 0.95), 2),
+        'max_ms': round(1000 * max(durations), 2),
+    }
+
+
+def measure_serial(client, path, iterations):
+    """
+    Request *path* *iterations* times with a :py:class:`django.test.Client`. Returns a summary of
+    latencies and the largest number of database queries made by any one request.
+
+    """
+    durations, queries = [], 0
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = client.get(path, secure=True)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            durations.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError('GET {} returned {}'.format(path, response.status_code))
+        queries = max(queries, len(captured))
+
+    summary = summarise(durations)
+    summary['queries'] = queries
+    return summary
+
+
+class WSGILoadGenerator:
+    """
+    Call a WSGI application from *concurrency* threads at once, bypassing the network, to measure
+    throughput and latency under load. Requests may carry a cookie header, for example a session
+    cookie, to authenticate.
+
+    """
+    def __init__(self, application=None, concurrency=4, cookie=None):
+        self.application = application if application is not None else WSGIHandler()
+        self.concurrency = concurrency
+        self.cookie = cookie
+
+    def run(self, path, requests):
+        """
+        Make *requests* requests for *path* and return the throughput in requests per second along
+        with a summary of latencies.
+
+        """
+        if '?' in path:
+            path_info, query_string = path.split('?', 1)
+        else:
+            path_info, query_string = path, ''
+
+        durations, errors = [], []
+        remaining = [requests]
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                    start = time.perf_counter()
+                    status = self._request(path_info, query_string)
+                    duration = time.perf_counter() - start
+                    with lock:
+                        durations.append(duration)
+                        if not status.startswith('200'):
+                            errors.append(status)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        if len(errors) > 0:
+            raise RuntimeError('GET {} failed: {}'.format(path, errors[0]))
+
+        summary = summarise(durations)
+        summary['rps'] = round(requests / elapsed, 1)
+        return summary
+
+    def _request(self, path_info, query_string):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path_info,
+            'QUERY_STRING': query_string,
+            'SERVER_NAME': 'testserver',
+            'wsgi.input': io.BytesIO(),
+            'wsgi.url_scheme': 'https',
+        }
+        if self.cookie is not None:
+            environ['HTTP_COOKIE'] = self.cookie
+        wsgiref.util.setup_testing_defaults(environ)
+
+        status_holder = []
+
+        def start_response(status, headers, exc_info=None):
+            status_holder.append(status)
+
+        result = self.application(environ, start_response)
+        try:
+            for _ in result:
+                pass
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return status_holder[0]
+
+
+def session_cookie(client):
+    """Return a Cookie header value carrying the session of a logged in test client."""
+    return '; '.join('{}={}'.format(name, morsel.value) for name, morsel in client.cookies.items())
+
+
+def new_client(user=None):
+    """Return a test client, logged in as *user* if it is not None."""
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    return client
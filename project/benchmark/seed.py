@@ -0,0 +1,67 @@
+"""
+Seed the database with users and preference history for benchmarking.
+
+"""
+import datetime
+import random
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from preferences import summaries
+from preferences.models import Preference
+
+#: Number of distinct institutions preferences are spread over.
+INSTITUTION_COUNT = 150
+
+#: Username of the staff user created for endpoints which need one.
+STAFF_USERNAME = 'benchstaff'
+
+#: Number of users inserted per batch.
+BATCH_SIZE = 5000
+
+
+def institution_name(index):
+    return 'INST{:03d}'.format(index)
+
+
+def seed(users=100000, history=10, random_seed=0, progress=None):
+    """
+    Create *users* users each with *history* preferences expressed over the last two years and a
+    staff user. Rows are inserted with ``bulk_create`` in batches. Random choices are made with a
+    fixed seed so that repeated runs create the same data. Preference summaries are rebuilt once
+    all rows are inserted.
+
+    If *progress* is not None, it is called with a message after each batch.
+
+    """
+    rng = random.Random(random_seed)
+    User = get_user_model()
+
+    User.objects.bulk_create([User(username=STAFF_USERNAME, is_staff=True, is_superuser=True)])
+
+    now = timezone.now()
+    for start in range(0, users, BATCH_SIZE):
+        stop = min(start + BATCH_SIZE, users)
+        usernames = ['bench{:06d}'.format(idx) for idx in range(start, stop)]
+        User.objects.bulk_create([User(username=username) for username in usernames])
+        user_ids = (
+            User.objects.filter(username__gte=usernames[0], username__lte=usernames[-1])
+            .values_list('id', flat=True)
+        )
+
+        preferences = []
+        for user_id in user_ids:
+            institution = institution_name(rng.randrange(INSTITUTION_COUNT))
+            for _ in range(history):
+                preferences.append(Preference(
+                    user_id=user_id, institution=institution,
+                    allow_capture=rng.random() < 0.8, request_hold=rng.random() < 0.1,
+                    created_at=now - datetime.timedelta(seconds=rng.randrange(2 * 365 * 86400)),
+                ))
+        Preference.objects.bulk_create(preferences)
+
+        if progress is not None:
+            progress('Seeded {} of {} users'.format(stop, users))
+
+    summaries.refresh()
@@ -0,0 +1,142 @@
+"""
+Prometheus metrics for the Lecture Capture Preferences project.
+
+Metrics are exposed in the Prometheus text format by the :py:func:`~.metrics` view. They are
+collected using the `prometheus_client <https://github.com/prometheus/client_python>`_ library.
+
+Metrics describe the internals of the service and so are only served to clients which send the
+bearer token in the :py:data:`~project.settings.base.METRICS_BEARER_TOKEN` setting, and, like
+every other endpoint, only over HTTPS. Configure Prometheus to scrape with the ``https`` scheme
+and the token as its ``bearer_token``. If no token is set, the endpoint responds 404 Not Found.
+
+When served by several gunicorn worker processes, set the ``PROMETHEUS_MULTIPROC_DIR`` environment
+variable to an empty directory writable by all workers. Each worker then writes its metrics to
+files in that directory and the :py:func:`~.metrics` view aggregates the files from all workers, so
+that whichever worker answers a scrape reports totals for the whole server. The bundled
+``gunicorn.conf.py`` clears the directory on start up and tidies up after workers which exit. The
+directory is created on import of this module if it does not exist so that other processes, such as
+management commands and job workers, may record metrics too.
+
+"""
+import hmac
+import os
+
+import prometheus_client
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+from prometheus_client import multiprocess
+
+from preferences import authentication, caching, coalescing, lookup
+
+# prometheus_client opens its files in PROMETHEUS_MULTIPROC_DIR on the first write to a metric
+# and fails if the directory is missing. Only the gunicorn master creates it, so make sure it
+# exists for any other process.
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+#: Histogram buckets, in seconds, for request latency.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+#: Histogram buckets for the number of database queries made by a request.
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+REQUESTS = prometheus_client.Counter(
+    'preferences_http_requests_total', 'Number of HTTP requests processed',
+    ['view', 'method', 'status'])
+
+REQUEST_LATENCY = prometheus_client.Histogram(
+    'preferences_http_request_duration_seconds', 'Time taken to process HTTP requests',
+    ['view'], buckets=LATENCY_BUCKETS)
+
+REQUEST_DB_QUERIES = prometheus_client.Histogram(
+    'preferences_http_request_db_queries', 'Number of database queries made per HTTP request',
+    ['view'], buckets=QUERY_COUNT_BUCKETS)
+
+DB_QUERY_DURATION = prometheus_client.Counter(
+    'preferences_db_query_duration_seconds', 'Total time spent making database queries',
+    ['view'])
+
+DB_CONNECTIONS = prometheus_client.Counter(
+    'preferences_db_connections_total', 'Number of database connections opened', ['alias'])
+
+CACHE_REQUESTS = prometheus_client.Counter(
+    'preferences_cache_requests_total',
+    'Number of lookups in the Lookup, API token and response caches', ['cache', 'result'])
+
+COALESCED_REQUESTS = prometheus_client.Counter(
+    'preferences_coalesced_requests_total',
+    'Number of requests to views which coalesce identical concurrent requests', ['outcome'])
+
+
+def observe_request(view, method, status, duration, db_queries, db_duration):
+    """
+    Record metrics for a processed request. Called by
+    :py:class:`~project.middleware.RequestTimingMiddleware`.
+
+    """
+    view = view if view is not None else '<unresolved>'
+    REQUESTS.labels(view=view, method=method, status=str(status)).inc()
+    REQUEST_LATENCY.labels(view=view).observe(duration)
+    REQUEST_DB_QUERIES.labels(view=view).observe(db_queries)
+    DB_QUERY_DURATION.labels(view=view).inc(db_duration)
+
+
+@receiver(connection_created)
+def _count_connection(sender, connection, **kwargs):
+    DB_CONNECTIONS.labels(alias=connection.alias).inc()
+
+
+def _count_cache_access(cache, hits, misses):
+    if hits > 0:
+        CACHE_REQUESTS.labels(cache=cache, result='hit').inc(hits)
+    if misses > 0:
+        CACHE_REQUESTS.labels(cache=cache, result='miss').inc(misses)
+
+
+@receiver(lookup.cache_accessed)
+def _count_lookup_cache(sender, kind, hits, misses, **kwargs):
+    _count_cache_access('lookup_{}'.format(kind), hits, misses)
+
+
+@receiver(authentication.cache_accessed)
+def _count_token_cache(sender, hits, misses, **kwargs):
+    _count_cache_access('token', hits, misses)
+
+
+@receiver(caching.cache_accessed)
+def _count_response_cache(sender, hits, misses, **kwargs):
+    _count_cache_access('response', hits, misses)
+
+
+@receiver(coalescing.request_coalesced)
+def _count_coalesced_request(sender, outcome, **kwargs):
+    COALESCED_REQUESTS.labels(outcome=outcome).inc()
+
+
+def metrics(request):
+    """
+    Render metrics in the Prometheus text format. If ``PROMETHEUS_MULTIPROC_DIR`` is set, metrics
+    are aggregated across all worker processes. Requests must send the
+    :py:data:`~project.settings.base.METRICS_BEARER_TOKEN` as a bearer token.
+
+    """
+    token = settings.METRICS_BEARER_TOKEN
+    if token is None:
+        raise Http404('Metrics are not enabled')
+    if not hmac.compare_digest(
+            request.META.get('HTTP_AUTHORIZATION', '').encode('utf8'),
+            'Bearer {}'.format(token).encode('utf8')):
+        response = HttpResponse('Unauthorized', status=401, content_type='text/plain')
+        response['WWW-Authenticate'] = 'Bearer realm="metrics"'
+        return response
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return HttpResponse(
+        prometheus_client.generate_latest(registry),
+        content_type=prometheus_client.CONTENT_TYPE_LATEST)
@@ -0,0 +1,168 @@
+"""
+Middleware for the Lecture Capture Preferences project.
+
+"""
+import json
+import logging
+import time
+from contextlib import ExitStack
+
+import django
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.dispatch import Signal
+
+from . import metrics
+
+LOG = logging.getLogger(__name__)
+
+#: Signal sent by :py:class:`~.RequestTimingMiddleware` after each request with the arguments
+#: *request*, *view*, the URL name of the view or None, *duration*, *db_queries* and
+#: *db_duration*.
+request_timed = Signal()
+
+
+class QueryRecorder:
+    """
+    A database execute wrapper which records the number of queries executed, the total time spent
+    executing them and the SQL of the first
+    :py:data:`~project.settings.base.REQUEST_TIMING_MAX_RECORDED_QUERIES` queries.
+
+    .. seealso:: https://docs.djangoproject.com/en/2.0/topics/db/instrumentation/
+
+    """
+    def __init__(self, max_recorded=None):
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+        self.max_recorded = (
+            max_recorded if max_recorded is not None
+            else settings.REQUEST_TIMING_MAX_RECORDED_QUERIES
+        )
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if len(self.queries) < self.max_recorded:
+                self.queries.append({
+                    'alias': context['connection'].alias, 'sql': sql, 'duration': duration,
+                })
+
+    def record(self):
+        """
+        Return a context manager which records queries on all database connections for the
+        current thread while it is active.
+
+        """
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(self))
+        return stack
+
+
+class RequestTimingMiddleware:
+    """
+    Record the wall-clock time taken to process each request along with the number of database
+    queries made and the time spent making them.
+
+    The timings are added to the response as a `Server-Timing
+    <https://www.w3.org/TR/server-timing/>`_ header if
+    :py:data:`~project.settings.base.REQUEST_TIMING_HEADER` is set and logged as a single line of
+    JSON to the ``project.middleware`` logger. Requests taking longer than
+    :py:data:`~project.settings.base.REQUEST_TIMING_SLOW_THRESHOLD` seconds are logged at
+    warning level along with the SQL of the queries they made. The timings are also recorded in the
+    Prometheus metrics exposed by :py:mod:`project.metrics`.
+
+    This middleware should be first in ``MIDDLEWARE`` so that the time taken by other middleware is
+    included.
+
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with recorder.record():
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        request.timing = {
+            'duration': duration, 'db_queries': recorder.count, 'db_duration': recorder.duration,
+        }
+
+        if settings.REQUEST_TIMING_HEADER:
+            response['Server-Timing'] = (
+                'total;dur={:.1f}, db;dur={:.1f};desc="{} queries"'.format(
+                    1000 * duration, 1000 * recorder.duration, recorder.count)
+            )
+
+        view_name = _view_name(request)
+        metrics.observe_request(
+            view_name, request.method, response.status_code, duration, recorder.count,
+            recorder.duration)
+        request_timed.send(
+            sender=self.__class__, request=request, view=view_name, duration=duration,
+            db_queries=recorder.count, db_duration=recorder.duration)
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': view_name,
+            'status': response.status_code,
+            'duration_ms': round(1000 * duration, 1),
+            'db_queries': recorder.count,
+            'db_duration_ms': round(1000 * recorder.duration, 1),
+        }
+
+        threshold = settings.REQUEST_TIMING_SLOW_THRESHOLD
+        if threshold is not None and duration >= threshold:
+            record['slow'] = True
+            record['queries'] = [
+                {
+                    'alias': q['alias'], 'sql': q['sql'],
+                    'duration_ms': round(1000 * q['duration'], 1),
+                }
+                for q in recorder.queries
+            ]
+            LOG.warning(json.dumps(record))
+        else:
+            LOG.info(json.dumps(record))
+
+        return response
+
+
+def _view_name(request):
+    """Return the URL name of the view which handled *request* or None if it was not resolved."""
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else None
+
+
+class DatabaseHealthCheckMiddleware:
+    """
+    Close persistent database connections which are no longer usable before processing a request
+    so that a fresh connection is opened rather than the request failing. This is only done for
+    databases with ``CONN_HEALTH_CHECKS`` set in their configuration.
+
+    Django 4.1 and later implement ``CONN_HEALTH_CHECKS`` natively and so this middleware removes
+    itself from the middleware chain on those versions.
+
+    """
+    def __init__(self, get_response):
+        if django.VERSION >= (4, 1):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        for connection in connections.all():
+            if not connection.settings_dict.get('CONN_HEALTH_CHECKS', False):
+                continue
+            if connection.connection is not None and not connection.is_usable():
+                connection.close()
+        return self.get_response(request)
@@ -0,0 +1,149 @@
+"""
+Routing of read-only queries to a read replica of the database.
+
+If a ``replica`` database is configured, see :py:data:`project.settings.base.DATABASES`, views
+decorated with :py:func:`~.reads_from_replica` make their queries against it rather than the
+primary. This is intended for expensive read-only views, such as listing preferences, exports and
+summaries, which may tolerate data a little behind the primary. All other queries, and all
+writes, use the primary.
+
+A replica lags behind the primary and so a client which has just expressed a preference might not
+see it in a list read from the replica. To avoid this, :py:class:`~.PinToPrimaryMiddleware` pins
+each client which makes a request other than ``GET``, ``HEAD`` or ``OPTIONS`` to the primary for
+:py:data:`~project.settings.base.DATABASE_REPLICA_PIN_SECONDS` seconds. Clients are identified by
+their ``Authorization`` header or, for session users, by user. Pins are kept in the default cache,
+so use a cache shared between workers in production.
+
+"""
+import contextlib
+import contextvars
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+#: Alias of the replica database connection.
+REPLICA = 'replica'
+
+#: Prefix applied to cache keys recording pinned clients.
+KEY_PREFIX = 'replicas:pinned'
+
+# Methods which do not change data and so neither pin clients nor need the primary.
+_SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Whether queries in the current context may be made against the replica.
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+class ReplicaRouter:
+    """
+    A database router which sends reads made within :py:func:`~.use_replica` to the replica, if
+    one is configured, and everything else to the primary. Migrations are only run on the primary
+    since the replica receives its schema from it.
+
+    """
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_configured():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+def replica_configured():
+    """Return True if a replica database is configured."""
+    return REPLICA in settings.DATABASES
+
+
+@contextlib.contextmanager
+def use_replica():
+    """A context manager within which reads are made against the replica, if configured."""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def reads_from_replica(view_func):
+    """
+    Decorate a Django view, or a Django REST framework view method, so that its reads are made
+    against the replica unless the request changes data or the client is pinned to the primary.
+    Streamed responses are also generated using the replica.
+
+    """
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if (not replica_configured() or request.method not in _SAFE_METHODS
+                or is_pinned(request)):
+            return view_func(request, *args, **kwargs)
+
+        with use_replica():
+            response = view_func(request, *args, **kwargs)
+        if getattr(response, 'streaming', False):
+            # Streamed content is generated after the view returns.
+            response.streaming_content = _stream_from_replica(response.streaming_content)
+        return response
+    return wrapper
+
+
+def pin(request):
+    """Pin the client which made *request* to the primary."""
+    key = _client_key(request)
+    if key is not None:
+        cache.set(key, True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(request):
+    """Return True if the client which made *request* is pinned to the primary."""
+    key = _client_key(request)
+    return key is not None and cache.get(key) is not None
+
+
+class PinToPrimaryMiddleware:
+    """
+    Pin clients which make requests which may change data to the primary. This must come after
+    :py:class:`django.contrib.auth.middleware.AuthenticationMiddleware`.
+
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if replica_configured() and request.method not in _SAFE_METHODS:
+            pin(request)
+        return response
+
+
+def _client_key(request):
+    """Return the cache key identifying the client which made *request* or None if anonymous."""
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if authorization != '':
+        ident = 'auth:' + hashlib.sha256(authorization.encode('utf8')).hexdigest()
+    else:
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        ident = 'user:{}'.format(user.pk)
+    return '{}:{}'.format(KEY_PREFIX, ident)
+
+
+def _stream_from_replica(content):
+    iterator = iter(content)
+    while True:
+        with use_replica():
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
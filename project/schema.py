@@ -0,0 +1,98 @@
+"""
+The OpenAPI schema for the API.
+
+Generating the schema introspects every view, serializer and filter in the API and so the schema
+is rendered at most once per process and then served from memory with a strong ETag. Clients
+which fetch the schema often, such as API client generators, should make conditional requests
+with ``If-None-Match`` so that an unchanged schema costs a 304 response.
+
+If the :py:data:`~project.settings.base.API_SCHEMA_ROOT` setting names a directory into which the
+:any:`writeapischema <writeapischema>` management command has written the schema, typically at
+build time, the schema is read from there rather than being generated. drf_yasg is only imported
+when the schema is generated.
+
+The schema is generated independently of any request and so does not contain a ``host``. Clients
+resolve its paths relative to the URL from which the schema was fetched.
+
+"""
+import collections
+import functools
+import hashlib
+import os
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import condition, require_safe
+
+#: Content types of the supported schema formats, keyed by the URL suffix for each format.
+FORMATS = collections.OrderedDict([
+    ('.json', 'application/json; charset=utf-8'),
+    ('.yaml', 'application/yaml; charset=utf-8'),
+])
+
+#: A rendered schema. *content* is the schema encoded as bytes and *etag* a strong ETag for it.
+Schema = collections.namedtuple('Schema', 'content etag')
+
+
+def render_schema(format):
+    """Generate the schema and return it rendered in *format* as bytes."""
+    from drf_yasg import openapi
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    generator = OpenAPISchemaGenerator(
+        openapi.Info(
+            title='Preferences API',
+            default_version='v1',
+            description='Lecture Capture Preferences API',
+            contact=openapi.Contact(email='automation@uis.cam.ac.uk'),
+            license=openapi.License(name='MIT License'),
+        ),
+        urlconf='project.urls',
+    )
+    codec_class = {'.json': OpenAPICodecJson, '.yaml': OpenAPICodecYaml}[format]
+    return codec_class(validators=[]).encode(generator.get_schema(request=None, public=True))
+
+
+def schema_path(format, root=None):
+    """
+    Return the path of the file holding the schema rendered in *format* within *root*, which
+    defaults to the :py:data:`~project.settings.base.API_SCHEMA_ROOT` setting, or None if neither
+    is set.
+
+    """
+    root = root if root is not None else getattr(settings, 'API_SCHEMA_ROOT', None)
+    if root is None:
+        return None
+    return os.path.join(root, 'swagger' + format)
+
+
+@functools.lru_cache(maxsize=None)
+def get_schema(format):
+    """
+    Return the schema rendered in *format* as a :py:class:`~.Schema`. The schema is read from
+    :py:func:`~.schema_path` if that file exists and is generated otherwise. The result is cached
+    for the lifetime of the process.
+
+    """
+    path = schema_path(format)
+    if path is not None and os.path.exists(path):
+        with open(path, 'rb') as fobj:
+            content = fobj.read()
+    else:
+        content = render_schema(format)
+    return Schema(content=content, etag='"{}"'.format(hashlib.sha256(content).hexdigest()))
+
+
+@require_safe
+@condition(etag_func=lambda request, format: get_schema(format).etag)
+def schema(request, format):
+    """
+    Serve the schema rendered in *format*, which is one of the keys of :py:data:`~.FORMATS`.
+    Requests with a matching ``If-None-Match`` header receive a 304 response.
+
+    """
+    response = HttpResponse(get_schema(format).content, content_type=FORMATS[format])
+    # Caches may store the schema but must check that it is current before using it.
+    response['Cache-Control'] = 'public, no-cache'
+    return response
@@ -39,18 +39,39 @@ INSTALLED_APPS = [
 
 #: Installed middleware
 MIDDLEWARE = [
+    'project.middleware.RequestTimingMiddleware',
+    'project.middleware.DatabaseHealthCheckMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'project.replicas.PinToPrimaryMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+#: Requests which take at least this many seconds are logged at warning level along with the SQL
+#: of the queries they made. Set from the ``DJANGO_REQUEST_TIMING_SLOW_THRESHOLD`` environment
+#: variable if present. See :py:class:`project.middleware.RequestTimingMiddleware`.
+REQUEST_TIMING_SLOW_THRESHOLD = float(
+    os.environ.get('DJANGO_REQUEST_TIMING_SLOW_THRESHOLD', '1.0'))
+
+#: Maximum number of queries per request whose SQL is retained for logging slow requests.
+REQUEST_TIMING_MAX_RECORDED_QUERIES = 100
+
+#: Bearer token which Prometheus must send in an ``Authorization: Bearer ...`` header to scrape
+#: the ``/metrics`` endpoint. Metrics are not served unless this is set. Set from the
+#: ``DJANGO_METRICS_BEARER_TOKEN`` environment variable. See :py:mod:`project.metrics`.
+METRICS_BEARER_TOKEN = os.environ.get('DJANGO_METRICS_BEARER_TOKEN') or None
+
+#: Add a Server-Timing header to responses with request and database timings.
+REQUEST_TIMING_HEADER = True
+
 #: Root URL patterns
 ROOT_URLCONF = 'project.urls'
 
@@ -77,7 +98,14 @@ WSGI_APPLICATION = 'project.wsgi.application'
 
 #: Database configuration. The default settings allow configuration of the database from
 #: environment variables. An environment variable named ``DJANGO_DB_<key>`` will override the
-#: ``DATABASES['default'][<key>]`` setting.
+#: ``DATABASES['default'][<key>]`` setting. Values for keys which Django expects to be numbers or
+#: booleans, such as ``CONN_MAX_AGE``, are converted. For ``CONN_MAX_AGE`` the value ``None`` means
+#: that connections are never closed.
+#:
+#: A read replica is configured in the same way by variables named ``DJANGO_DB_REPLICA_<key>``,
+#: which override the corresponding setting of the default database for the ``replica``
+#: connection. Usually only ``DJANGO_DB_REPLICA_HOST`` need be set. If no such variable is set,
+#: there is no replica. See :py:mod:`project.replicas`.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -86,17 +114,79 @@ DATABASES = {
 }
 
 
+def _parse_db_bool(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _parse_db_max_age(value):
+    return None if value.strip().lower() == 'none' else int(value)
+
+
+# Conversions applied to database settings set from the environment
+_db_envvar_converters = {
+    'ATOMIC_REQUESTS': _parse_db_bool,
+    'AUTOCOMMIT': _parse_db_bool,
+    'CONN_HEALTH_CHECKS': _parse_db_bool,
+    'CONN_MAX_AGE': _parse_db_max_age,
+}
+
 _db_envvar_prefix = 'DJANGO_DB_'
+_db_replica_envvar_prefix = _db_envvar_prefix + 'REPLICA_'
 for name, value in os.environ.items():
-    # Only look at variables which start with the prefix we expect
-    if not name.startswith(_db_envvar_prefix):
+    # Only look at variables which start with the prefix we expect and do not configure the replica
+    if not name.startswith(_db_envvar_prefix) or name.startswith(_db_replica_envvar_prefix):
         continue
 
     # Remove prefix
     name = name[len(_db_envvar_prefix):]
 
     # Set value
-    DATABASES['default'][name] = value
+    DATABASES['default'][name] = _db_envvar_converters.get(name, str)(value)
+
+_db_replica_settings = {
+    name[len(_db_replica_envvar_prefix):]: value for name, value in os.environ.items()
+    if name.startswith(_db_replica_envvar_prefix)
+}
+if len(_db_replica_settings) > 0:
+    # The replica is a copy of the default database and so tests use the default database for it.
+    DATABASES['replica'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    for name, value in _db_replica_settings.items():
+        DATABASES['replica'][name] = _db_envvar_converters.get(name, str)(value)
+
+#: Routing of reads by some views to the read replica, if one is configured.
+DATABASE_ROUTERS = ['project.replicas.ReplicaRouter']
+
+#: Number of seconds for which a client which changes data reads from the primary database rather
+#: than the replica so that it sees its own changes. This should exceed the replica's usual lag.
+#: Set from the ``DJANGO_REPLICA_PIN_SECONDS`` environment variable if present.
+DATABASE_REPLICA_PIN_SECONDS = float(os.environ.get('DJANGO_REPLICA_PIN_SECONDS', '10'))
+
+
+#: Cache configuration. The cache backend and its location may be set from the
+#: ``DJANGO_CACHE_BACKEND`` and ``DJANGO_CACHE_LOCATION`` environment variables. The default is a
+#: cache local to each process. Cached sessions and other caches shared between workers require a
+#: shared cache such as memcached, for which a client library must also be installed.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', ''),
+    }
+}
+
+# Session storage engines which may be selected by name
+_session_engines = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+#: Session storage. Set from the ``DJANGO_SESSION_STORE`` environment variable, which may be one
+#: of ``db`` (the default), ``cached_db``, which reads sessions from the default cache and writes
+#: them through to the database, or ``signed_cookies``, which stores sessions in a cookie signed
+#: with :py:data:`~.SECRET_KEY` and so makes no queries at all. Expired database sessions are
+#: removed by the ``purgesessions`` management command.
+SESSION_ENGINE = _session_engines[os.environ.get('DJANGO_SESSION_STORE', 'db')]
 
 
 #: Password validation
@@ -163,10 +253,31 @@ UCAMWEBAUTH_NOT_CURRENT = False
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'preferences.authentication.CachedTokenAuthentication',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'preferences.throttling.AnonRateThrottle',
+        'preferences.throttling.UserRateThrottle',
+        'preferences.throttling.TokenRateThrottle',
+        'preferences.throttling.ScopedRateThrottle',
+    ],
+    # Each rate may be overridden by an environment variable named DJANGO_THROTTLE_RATE_<scope>
+    # in upper case. A value of "none" removes the limit.
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '120/minute',
+        'user': '600/minute',
+        'token': '1200/minute',
+        'preferences_list': '120/minute',
+        'preferences_export': '10/minute',
+    },
 }
 
+_throttle_envvar_prefix = 'DJANGO_THROTTLE_RATE_'
+for name, value in os.environ.items():
+    if name.startswith(_throttle_envvar_prefix):
+        REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'][name[len(_throttle_envvar_prefix):].lower()] = (
+            None if value.strip().lower() == 'none' else value)
+
 # Allow all origins to access API.
 CORS_URLS_REGEX = r'^/api/.*$'
 CORS_ORIGIN_ALLOW_ALL = True
@@ -191,5 +302,21 @@ else:
 # load balancers.
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
+#: Static files are collected with hashes of their content in their names and with gzip and, if
+#: the brotli package is installed, Brotli compressed variants alongside. WhiteNoise serves files
+#: with hashed names with a far-future ``Cache-Control: immutable`` header and picks the smallest
+#: variant the client accepts. Run ``./manage.py check --deploy --tag staticfiles`` after
+#: collecting static files to confirm that every file is hashed and compressed.
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 STATIC_ROOT = os.environ.get('DJANGO_STATIC_ROOT', os.path.join(BASE_DIR, 'build', 'static'))
+
+#: Only the hashed copies of static files are kept so that every file served may be cached
+#: forever. Templates must refer to static files via ``{% static %}``.
+WHITENOISE_KEEP_ONLY_HASHED_FILES = True
+
+#: Directory from which the pre-rendered OpenAPI schema is served, if present. Set from the
+#: ``DJANGO_API_SCHEMA_ROOT`` environment variable. The schema is written into this directory by
+#: the ``writeapischema`` management command. If unset, or if the directory does not contain the
+#: schema, the schema is generated on the first request to each process. See
+#: :py:mod:`project.schema`.
+API_SCHEMA_ROOT = os.environ.get('DJANGO_API_SCHEMA_ROOT')
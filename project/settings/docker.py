@@ -21,6 +21,10 @@ LOGGING = {
         'simple': {
             'format': '%(levelname)s "%(message)s"'
         },
+        # Request timings are logged with a JSON message which is not quoted.
+        'structured': {
+            'format': '%(levelname)s %(asctime)s %(name)s %(message)s'
+        },
     },
     'handlers': {
         'console': {
@@ -28,6 +32,11 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'verbose',
         },
+        'structured_console': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
     },
     'loggers': {
         '': {
@@ -35,6 +44,11 @@ LOGGING = {
             'propagate': True,
             'level': 'INFO'
         },
+        'project.middleware': {
+            'handlers': ['structured_console'],
+            'propagate': False,
+            'level': 'INFO'
+        },
     }
 }
 
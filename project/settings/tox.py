@@ -16,6 +16,37 @@ from .base import *  # noqa: F401, F403
 #: when running tests.
 TEST_RUNNER = 'project.test.runner.BufferedDiscoverRunner'
 
+#: JSON file giving the maximum number of SQL queries and duration of requests to each view made
+#: by the test suite. See :py:mod:`project.test.budget`.
+TEST_VIEW_BUDGETS = os.path.join(BASE_DIR, 'project', 'test', 'view_budgets.json')  # noqa: F405
+
+#: Create test databases from cached, pre-migrated templates. See :py:mod:`project.test.databases`.
+TEST_DATABASE_TEMPLATES = True
+
+#: Directory in which SQLite test database templates are cached. Set from the
+#: ``TOX_TEST_DATABASE_TEMPLATE_DIR`` environment variable. If unset, SQLite test databases are
+#: created afresh on each run.
+TEST_DATABASE_TEMPLATE_DIR = os.environ.get('TOX_TEST_DATABASE_TEMPLATE_DIR')
+
+# SQLite test databases are in memory by default. Templates require that they are files.
+_default_db = DATABASES['default']  # noqa: F405
+if (TEST_DATABASE_TEMPLATE_DIR is not None and
+        _default_db['ENGINE'] == 'django.db.backends.sqlite3'):
+    _default_db.setdefault('TEST', {}).setdefault(
+        'NAME', os.path.splitext(_default_db['NAME'])[0] + '-test.sqlite3')
+
+#: Throttles record requests in a cache which discards them so that the many requests made by the
+#: test suite are not limited. Tests of throttling use a real cache.
+CACHES = dict(
+    CACHES,  # noqa: F405
+    throttle={'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+)
+PREFERENCES_THROTTLE_CACHE = 'throttle'
+
+#: Preferences created by tests are returned by the changes feed straight away. Tests of the delay
+#: override this.
+PREFERENCES_CHANGES_DELAY = 0
+
 #: Static files are collected into a directory determined by the tox
 #: configuration. See the tox.ini file.
 STATIC_ROOT = os.environ.get('TOX_STATIC_ROOT')
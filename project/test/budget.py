@@ -0,0 +1,136 @@
+"""
+Performance budgets for tests.
+
+A budget is a maximum number of SQL queries and a maximum wall-clock duration. Budgets may be
+declared in two ways:
+
+1. For a block of test code with :py:class:`~.budget`, which may be used as a decorator on a test
+   method or :py:class:`~django.test.TestCase` class or as a context manager. Exceeding the budget
+   fails the test with :py:exc:`~.BudgetExceeded`.
+
+2. For a view in a JSON *view budget file* mapping URL names to budgets. For example:
+
+   .. code-block:: json
+
+       {
+           "preferences:preference-list": {"queries": 4, "duration": 0.5}
+       }
+
+   The file is read by :py:class:`~project.test.runner.BufferedDiscoverRunner` and each request
+   made during a test to a view with a budget is checked against it. Either key may be omitted.
+   Requests making more queries than their view's budget fail the test. Wall-clock time depends on
+   the machine and on how many tests run in parallel, and so requests taking longer than their
+   view's duration budget are only reported after the tests have run.
+   Queries made while the body of a streaming response is consumed happen after the view has
+   returned and so are not counted against the view; use :py:class:`~.budget` for those.
+
+"""
+import functools
+import inspect
+import json
+import time
+import unittest
+
+from project.middleware import QueryRecorder
+
+
+class BudgetExceeded(AssertionError):
+    """Raised when code exceeds its query or duration budget."""
+
+
+class Budget:
+    """
+    A query and duration budget. Either limit may be None in which case it is not checked.
+
+    :param queries: Maximum number of SQL queries.
+    :param duration: Maximum duration in seconds.
+
+    """
+    def __init__(self, queries=None, duration=None):
+        self.queries = queries
+        self.duration = duration
+
+    def violations(self, queries, duration):
+        """
+        Return a list of human-readable descriptions of the ways in which *queries* queries made
+        over *duration* seconds exceed this budget. The duration is not checked if *duration* is
+        None.
+
+        """
+        violations = []
+        if self.queries is not None and queries > self.queries:
+            violations.append('{} queries exceeds budget of {}'.format(queries, self.queries))
+        if self.duration is not None and duration is not None and duration > self.duration:
+            violations.append('{:.3f}s exceeds budget of {:.3f}s'.format(duration, self.duration))
+        return violations
+
+    @classmethod
+    def from_dict(cls, value):
+        return cls(queries=value.get('queries'), duration=value.get('duration'))
+
+
+class budget(Budget):
+    """
+    Fail a test if the code it wraps makes more than *queries* SQL queries on any database or takes
+    longer than *duration* seconds. May be used as a decorator on test methods and test case
+    classes or as a context manager:
+
+    .. code-block:: python
+
+        class MyTests(TestCase):
+            @budget(queries=2)
+            def test_list(self):
+                self.client.get(reverse('preferences:preference-list'))
+
+            def test_detail(self):
+                with budget(queries=1, duration=0.1):
+                    self.client.get(...)
+
+    When decorating a class, each test method is given its own budget. Queries made in
+    ``setUp()`` are not counted.
+
+    """
+    def __enter__(self):
+        self._recorder = QueryRecorder(max_recorded=0)
+        self._context = self._recorder.record()
+        self._context.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self._start
+        self._context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return False
+        violations = self.violations(self._recorder.count, duration)
+        if len(violations) > 0:
+            raise BudgetExceeded('; '.join(violations))
+        return False
+
+    def __call__(self, decorated):
+        if inspect.isclass(decorated):
+            if not issubclass(decorated, unittest.TestCase):
+                raise TypeError('Only TestCase subclasses may be decorated with budget')
+            loader = unittest.TestLoader()
+            for name in loader.getTestCaseNames(decorated):
+                setattr(decorated, name, self._decorate(getattr(decorated, name)))
+            return decorated
+        return self._decorate(decorated)
+
+    def _decorate(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Use a fresh instance so that nested and repeated uses do not share state.
+            with budget(queries=self.queries, duration=self.duration):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def load_view_budgets(path):
+    """
+    Read a view budget file and return a dictionary mapping URL names to :py:class:`~.Budget`
+    instances.
+
+    """
+    with open(path) as fobj:
+        return {view: Budget.from_dict(value) for view, value in json.load(fobj).items()}
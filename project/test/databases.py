@@ -0,0 +1,210 @@
+"""
+Cached, pre-migrated template test databases.
+
+Creating a test database means applying every migration of every installed app, which takes a
+growing share of the test suite's run time as the number of migrations grows. The
+:py:class:`~project.test.runner.BufferedDiscoverRunner` instead keeps a migrated copy of each test
+database, a *template*, and creates subsequent test databases by copying it. The copy is then
+migrated as usual, which is a no-op when the template is up to date.
+
+Templates are identified by a fingerprint of the migrations and unmigrated models of all
+installed apps and of the Django version and database engine so that changing any of these causes
+a new template to be made. Old templates are removed when a new one is saved.
+
+SQLite templates are stored as files in a cache directory and are only supported when the test
+database is a file rather than in memory. PostgreSQL templates are databases named ``tpl_``
+followed by a hash of the test database's name and the fingerprint, and are copied with
+``CREATE DATABASE ... TEMPLATE``.
+
+"""
+import abc
+import contextlib
+import glob
+import hashlib
+import os
+import shutil
+import sys
+
+import django
+from django.apps import apps
+from django.db.migrations.loader import MigrationLoader
+
+
+def schema_fingerprint(connection):
+    """
+    Return a hex digest which changes whenever the schema created for *connection* by migrating
+    would change.
+
+    """
+    hasher = hashlib.sha256()
+    hasher.update(django.get_version().encode('utf8'))
+    hasher.update(connection.settings_dict['ENGINE'].encode('utf8'))
+
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    paths = [
+        (repr(key), sys.modules[migration.__module__].__file__)
+        for key, migration in loader.disk_migrations.items()
+    ]
+    for app_label in loader.unmigrated_apps:
+        models_module = apps.get_app_config(app_label).models_module
+        if models_module is not None and getattr(models_module, '__file__', None) is not None:
+            paths.append((app_label, models_module.__file__))
+
+    for key, path in sorted(paths):
+        hasher.update(key.encode('utf8'))
+        with open(path, 'rb') as fobj:
+            hasher.update(fobj.read())
+
+    return hasher.hexdigest()
+
+
+class TemplateDatabase(abc.ABC):
+    """
+    A pre-migrated template for the test database of *connection*. Subclasses store templates for
+    a particular database vendor. Use :py:func:`~.get_template` to construct an instance
+    appropriate for a connection.
+
+    """
+    def __init__(self, connection, cache_dir=None):
+        self.connection = connection
+        self.cache_dir = cache_dir
+        self.fingerprint = schema_fingerprint(connection)
+
+        # The connection's settings are changed to refer to the test database once it has been
+        # created and so the name must be determined beforehand.
+        self.test_database_name = connection.creation._get_test_db_name()
+
+    @abc.abstractmethod
+    def exists(self):
+        """Return True if an up to date template exists."""
+
+    @abc.abstractmethod
+    def restore(self):
+        """Replace the test database with a copy of the template."""
+
+    @abc.abstractmethod
+    def save(self):
+        """Save the migrated test database as the template, replacing any old templates."""
+
+    @contextlib.contextmanager
+    def keep_test_database(self):
+        """
+        Return a context manager within which the connection keeps any existing test database
+        rather than creating a new one. Clones made for parallel test runs are unaffected.
+
+        """
+        creation = self.connection.creation
+        create_test_db = creation.create_test_db
+
+        def create_restored_test_db(*args, **kwargs):
+            kwargs['keepdb'] = True
+            return create_test_db(*args, **kwargs)
+
+        creation.create_test_db = create_restored_test_db
+        try:
+            yield
+        finally:
+            del creation.create_test_db
+
+
+class SQLiteTemplateDatabase(TemplateDatabase):
+    @property
+    def path(self):
+        return os.path.join(
+            self.cache_dir, '{}-{}.sqlite3'.format(self.connection.alias, self.fingerprint))
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def restore(self):
+        _copy_file(self.path, self.test_database_name)
+
+    def save(self):
+        self.connection.close()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        stale = glob.glob(os.path.join(
+            self.cache_dir, '{}-*.sqlite3'.format(glob.escape(self.connection.alias))))
+        _copy_file(self.test_database_name, self.path)
+        for path in stale:
+            if path != self.path:
+                os.remove(path)
+
+
+class PostgreSQLTemplateDatabase(TemplateDatabase):
+    # PostgreSQL identifiers are limited to 63 characters. Template names are "tpl_", a hash of the
+    # test database's name, so that names of any length fit, and the whole fingerprint in base 36.
+    # Test databases and their clones for parallel runs are named after the test database and so
+    # no test database begins with the prefix of its templates.
+
+    @property
+    def prefix(self):
+        digest = hashlib.sha256(self.test_database_name.encode('utf8')).hexdigest()
+        return 'tpl_{}_'.format(digest[:8])
+
+    @property
+    def name(self):
+        return self.prefix + _base36(int(self.fingerprint, 16)).rjust(50, '0')
+
+    def exists(self):
+        with _nodb_cursor(self.connection) as cursor:
+            cursor.execute('SELECT 1 FROM pg_catalog.pg_database WHERE datname = %s', [self.name])
+            return cursor.fetchone() is not None
+
+    def restore(self):
+        quote_name = self.connection.ops.quote_name
+        with _nodb_cursor(self.connection) as cursor:
+            cursor.execute('DROP DATABASE IF EXISTS {}'.format(
+                quote_name(self.test_database_name)))
+            cursor.execute('CREATE DATABASE {} WITH TEMPLATE {}'.format(
+                quote_name(self.test_database_name), quote_name(self.name)))
+
+    def save(self):
+        quote_name = self.connection.ops.quote_name
+        # CREATE DATABASE ... TEMPLATE requires that there are no connections to the template.
+        self.connection.close()
+        with _nodb_cursor(self.connection) as cursor:
+            cursor.execute(
+                'SELECT datname FROM pg_catalog.pg_database WHERE datname LIKE %s',
+                [self.prefix.replace('_', '\\_') + '%'])
+            for (name,) in cursor.fetchall():
+                cursor.execute('DROP DATABASE {}'.format(quote_name(name)))
+            cursor.execute('CREATE DATABASE {} WITH TEMPLATE {}'.format(
+                quote_name(self.name), quote_name(self.test_database_name)))
+
+
+def _base36(value):
+    digits = []
+    while value > 0:
+        value, digit = divmod(value, 36)
+        digits.append('0123456789abcdefghijklmnopqrstuvwxyz'[digit])
+    return ''.join(reversed(digits)) or '0'
+
+
+def get_template(connection, cache_dir):
+    """
+    Return a :py:class:`~.TemplateDatabase` for the test database of *connection* or None if
+    templates are not supported for it. SQLite templates are stored in *cache_dir*.
+
+    """
+    if connection.vendor == 'postgresql':
+        return PostgreSQLTemplateDatabase(connection)
+    if connection.vendor == 'sqlite' and cache_dir is not None:
+        template = SQLiteTemplateDatabase(connection, cache_dir)
+        if not connection.creation.is_in_memory_db(template.test_database_name):
+            return template
+    return None
+
+
+def _copy_file(source, destination):
+    """Copy *source* to *destination* atomically."""
+    temporary = '{}.{}.tmp'.format(destination, os.getpid())
+    shutil.copyfile(source, temporary)
+    os.replace(temporary, destination)
+
+
+def _nodb_cursor(connection):
+    """Return a cursor for *connection* which is not connected to a particular database."""
+    if hasattr(connection, '_nodb_cursor'):
+        # Django 3.1 and later
+        return connection._nodb_cursor()
+    return connection._nodb_connection.cursor()
@@ -2,9 +2,21 @@
 Custom test suite runner.
 
 """
+import contextlib
+import functools
+import sys
+import time
 import unittest
 
 import django.test.runner
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import get_unique_databases_and_mirrors
+
+from project.middleware import QueryRecorder, request_timed
+
+from .budget import BudgetExceeded, load_view_budgets
+from .databases import get_template
 
 
 class BufferedTextTestRunner(unittest.TextTestRunner):
@@ -22,6 +34,167 @@ class BufferedTextTestRunner(unittest.TextTestRunner):
                                 tb_locals=tb_locals, **kwargs)
 
 
+class BudgetTestResultMixin:
+    """
+    A mixin for :py:class:`unittest.TestResult` sub-classes which records the number of SQL
+    queries made and the wall-clock time taken by each test and by each request a test makes.
+
+    Requests to views listed in *view_budgets*, a dictionary mapping URL names to
+    :py:class:`~project.test.budget.Budget` instances, are checked against their budget. A test
+    which would otherwise pass fails if any request it makes exceeds its view's query budget.
+    Requests exceeding their view's duration budget are listed by :py:meth:`~.print_budget_report`
+    but do not fail the test, since wall-clock time varies between machines and with the number of
+    tests run in parallel.
+
+    If *measure* is False, tests are run in other processes which do the measuring and report
+    their measurements via :py:meth:`~.addBudgetTimings`.
+
+    """
+    def __init__(self, *args, view_budgets=None, measure=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.view_budgets = view_budgets if view_budgets is not None else {}
+        self.measure = measure
+
+        #: A list of (test id, queries, duration) tuples for each test run.
+        self.test_timings = []
+
+        #: A dictionary mapping URL names to dictionaries with the keys ``requests``,
+        #: ``queries`` and ``duration`` giving the number of requests made to the view and the
+        #: largest number of queries and duration of any of them.
+        self.view_timings = {}
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._violations, self._requests = [], []
+        if not self.measure:
+            return
+        self._recorder = QueryRecorder(max_recorded=0)
+        self._recording = self._recorder.record()
+        self._recording.__enter__()
+        request_timed.connect(self._request_timed)
+        self._start = time.perf_counter()
+
+    def stopTest(self, test):
+        if self.measure:
+            duration = time.perf_counter() - self._start
+            request_timed.disconnect(self._request_timed)
+            self._recording.__exit__(None, None, None)
+            self.addBudgetTimings(test, self._recorder.count, duration, self._requests)
+        super().stopTest(test)
+
+    def addBudgetTimings(self, test, queries, duration, requests):
+        """
+        Record that *test* made *queries* queries and took *duration* seconds. *requests* is a
+        list of (view, queries, duration) tuples for each request made by the test.
+
+        """
+        self.test_timings.append((test.id(), queries, duration))
+        for view, db_queries, request_duration in requests:
+            timings = self.view_timings.setdefault(
+                view, {'requests': 0, 'queries': 0, 'duration': 0.0})
+            timings['requests'] += 1
+            timings['queries'] = max(timings['queries'], db_queries)
+            timings['duration'] = max(timings['duration'], request_duration)
+
+    def addSuccess(self, test):
+        if len(self._violations) > 0:
+            try:
+                raise BudgetExceeded('\n'.join(self._violations))
+            except BudgetExceeded:
+                self.addFailure(test, sys.exc_info())
+            return
+        super().addSuccess(test)
+
+    def _request_timed(self, sender, request, view, duration, db_queries, **kwargs):
+        self._requests.append((view, db_queries, duration))
+
+        budget = self.view_budgets.get(view)
+        if budget is None:
+            return
+        for violation in budget.violations(db_queries, None):
+            self._violations.append('{} {} ({}): {}'.format(
+                request.method, request.get_full_path(), view, violation))
+
+    def print_budget_report(self, limit):
+        """
+        Print the *limit* slowest tests along with the number of queries each made and the largest
+        number of queries and duration of any request to each view. Views any of whose requests
+        took longer than their duration budget are listed at the end.
+
+        """
+        if limit <= 0 or len(self.test_timings) == 0:
+            return
+
+        self.stream.writeln()
+        self.stream.writeln('Slowest tests:')
+        self.stream.writeln('{:>8} {:>10}  {}'.format('queries', 'duration', 'test'))
+        slowest = sorted(self.test_timings, key=lambda timing: timing[2], reverse=True)
+        for test_id, queries, duration in slowest[:limit]:
+            self.stream.writeln('{:>8} {:>9.3f}s  {}'.format(queries, duration, test_id))
+
+        if len(self.view_timings) == 0:
+            return
+
+        self.stream.writeln()
+        self.stream.writeln('Requests by view (largest observed):')
+        self.stream.writeln('{:>8} {:>8} {:>10} {:>12}  {}'.format(
+            'requests', 'queries', 'duration', 'budget', 'view'))
+        for view, timings in sorted(self.view_timings.items(), key=lambda item: str(item[0])):
+            budget = self.view_budgets.get(view)
+            self.stream.writeln('{:>8} {:>8} {:>9.3f}s {:>12}  {}'.format(
+                timings['requests'], timings['queries'], timings['duration'],
+                _format_budget(budget), view if view is not None else '<unresolved>'))
+
+        overruns = [
+            (view, timings['duration'], self.view_budgets[view].duration)
+            for view, timings in sorted(self.view_timings.items(), key=lambda item: str(item[0]))
+            if view in self.view_budgets and self.view_budgets[view].duration is not None
+            and timings['duration'] > self.view_budgets[view].duration
+        ]
+        if len(overruns) == 0:
+            return
+
+        self.stream.writeln()
+        self.stream.writeln('Duration budgets exceeded (not failures):')
+        for view, duration, limit in overruns:
+            self.stream.writeln('{:>9.3f}s > {:.3f}s  {}'.format(duration, limit, view))
+
+
+class BudgetTextTestResult(BudgetTestResultMixin, unittest.TextTestResult):
+    """A :py:class:`unittest.TextTestResult` which checks and reports budgets."""
+
+
+class BudgetDebugSQLTextTestResult(
+        BudgetTestResultMixin, django.test.runner.DebugSQLTextTestResult):
+    """A :py:class:`~django.test.runner.DebugSQLTextTestResult` which checks budgets."""
+
+
+class BudgetRemoteTestResult(BudgetTestResultMixin, django.test.runner.RemoteTestResult):
+    """
+    A :py:class:`~django.test.runner.RemoteTestResult` which checks budgets in a parallel test
+    worker and sends its measurements to the main process.
+
+    """
+    #: View budgets checked by workers. Set by the main process before the workers are forked.
+    worker_view_budgets = {}
+
+    def __init__(self):
+        super().__init__(view_budgets=self.worker_view_budgets)
+
+    def addBudgetTimings(self, test, queries, duration, requests):
+        super().addBudgetTimings(test, queries, duration, requests)
+        self.events.append(('addBudgetTimings', self.test_index, queries, duration, requests))
+
+
+class BudgetRemoteTestRunner(django.test.runner.RemoteTestRunner):
+    resultclass = BudgetRemoteTestResult
+
+
+class BudgetParallelTestSuite(django.test.runner.ParallelTestSuite):
+    """A :py:class:`~django.test.runner.ParallelTestSuite` whose workers check budgets."""
+    runner_class = BudgetRemoteTestRunner
+
+
 class BufferedDiscoverRunner(django.test.runner.DiscoverRunner):
     """
     A sub-class of :py:class:`django.test.runner.DiscoverRunner` which has
@@ -31,5 +204,95 @@ class BufferedDiscoverRunner(django.test.runner.DiscoverRunner):
     The upshot of this is that output to stdout and stderror is captured and
     only reported on test failure.
 
+    In addition, requests made by tests are checked against the view budget
+    file named by the :py:data:`~project.settings.tox.TEST_VIEW_BUDGETS`
+    setting, or the ``--view-budgets`` option, and a report of the slowest
+    tests and the queries made by each view is printed after the run. See
+    :py:mod:`project.test.budget`.
+
+    Tests may be run in parallel with ``--parallel``. Test databases are
+    created from cached, pre-migrated templates if the
+    :py:data:`~project.settings.tox.TEST_DATABASE_TEMPLATES` setting is True
+    unless ``--no-template-db`` is given. See :py:mod:`project.test.databases`.
+
     """
     test_runner = BufferedTextTestRunner
+    parallel_test_suite = BudgetParallelTestSuite
+
+    def __init__(self, view_budgets=None, budget_report=10, template_db=True, **kwargs):
+        super().__init__(**kwargs)
+        if view_budgets is None:
+            view_budgets = getattr(settings, 'TEST_VIEW_BUDGETS', None)
+        self.view_budgets = load_view_budgets(view_budgets) if view_budgets else {}
+        self.budget_report = budget_report
+        self.template_db = template_db and getattr(settings, 'TEST_DATABASE_TEMPLATES', False)
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--view-budgets', metavar='PATH',
+            help='JSON file of per-view query and duration budgets. Defaults to the '
+                 'TEST_VIEW_BUDGETS setting.')
+        parser.add_argument(
+            '--budget-report', metavar='N', type=int, default=10,
+            help='Number of slowest tests to report. Set to 0 to disable the report.')
+        parser.add_argument(
+            '--no-template-db', action='store_false', dest='template_db',
+            help='Do not create test databases from cached, pre-migrated templates.')
+
+    def setup_databases(self, **kwargs):
+        if not self.template_db:
+            return super().setup_databases(**kwargs)
+
+        templates = []
+        test_databases, _ = get_unique_databases_and_mirrors()
+        for _, aliases in test_databases.values():
+            alias = DEFAULT_DB_ALIAS if DEFAULT_DB_ALIAS in aliases else sorted(aliases)[0]
+            template = get_template(
+                connections[alias], getattr(settings, 'TEST_DATABASE_TEMPLATE_DIR', None))
+            if template is None:
+                if self.verbosity >= 1:
+                    print('Test database templates are not supported for alias '
+                          '{!r}.'.format(alias))
+                return super().setup_databases(**kwargs)
+            templates.append(template)
+
+        if all(template.exists() for template in templates):
+            if self.verbosity >= 1:
+                print('Restoring test databases from templates...')
+            with contextlib.ExitStack() as stack:
+                for template in templates:
+                    template.restore()
+                    stack.enter_context(template.keep_test_database())
+                return super().setup_databases(**kwargs)
+
+        old_config = super().setup_databases(**kwargs)
+        if self.verbosity >= 1:
+            print('Saving test database templates...')
+        for template in templates:
+            template.save()
+        return old_config
+
+    def get_resultclass(self):
+        resultclass = (
+            BudgetDebugSQLTextTestResult if self.debug_sql else BudgetTextTestResult
+        )
+        return functools.partial(
+            resultclass, view_budgets=self.view_budgets, measure=self.parallel <= 1)
+
+    def run_suite(self, suite, **kwargs):
+        # Parallel test workers are forked from this process and so inherit the view budgets.
+        BudgetRemoteTestResult.worker_view_budgets = self.view_budgets
+        result = super().run_suite(suite, **kwargs)
+        if isinstance(result, BudgetTestResultMixin):
+            result.print_budget_report(self.budget_report)
+        return result
+
+
+def _format_budget(budget):
+    if budget is None:
+        return '-'
+    return '{}q/{}'.format(
+        budget.queries if budget.queries is not None else '-',
+        '{:.2f}s'.format(budget.duration) if budget.duration is not None else '-')
@@ -0,0 +1,162 @@
+"""
+Test query and duration budgets and their enforcement by the test runner.
+
+"""
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from project.test.budget import Budget, BudgetExceeded, budget, load_view_budgets
+from project.test.runner import BudgetRemoteTestResult, BudgetTextTestResult
+
+
+def make_queries(count):
+    for _ in range(count):
+        get_user_model().objects.exists()
+
+
+class BudgetTests(TestCase):
+    def test_context_manager(self):
+        """Code within its budget passes and code exceeding it raises BudgetExceeded."""
+        with budget(queries=2):
+            make_queries(2)
+        with self.assertRaises(BudgetExceeded):
+            with budget(queries=2):
+                make_queries(3)
+
+    def test_duration(self):
+        """Duration budgets are checked."""
+        with self.assertRaises(BudgetExceeded):
+            with budget(duration=0):
+                make_queries(1)
+
+    def test_decorator(self):
+        """Functions may be decorated with a budget."""
+        decorated = budget(queries=1)(make_queries)
+        decorated(1)
+        with self.assertRaises(BudgetExceeded):
+            decorated(2)
+
+    def test_class_decorator(self):
+        """Each test method of a decorated class is given its own budget."""
+        # Test cases run within another test case must not be Django test cases since those close
+        # database connections when they finish.
+        @budget(queries=1)
+        class Tests(unittest.TestCase):
+            def test_within(self):
+                make_queries(1)
+
+            def test_exceeds(self):
+                make_queries(2)
+
+        result = unittest.TestResult()
+        unittest.TestLoader().loadTestsFromTestCase(Tests).run(result)
+        self.assertEqual(result.testsRun, 2)
+        self.assertEqual(
+            [test.id().split('.')[-1] for test, _ in result.failures], ['test_exceeds'])
+
+    def test_exception_propagates(self):
+        """Exceptions raised within a budget are not masked."""
+        with self.assertRaises(ValueError):
+            with budget(queries=0):
+                make_queries(1)
+                raise ValueError()
+
+    def test_load_view_budgets(self):
+        """View budget files map URL names to budgets."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'budgets.json')
+            with open(path, 'w') as fobj:
+                json.dump({'healthz': {'queries': 0}}, fobj)
+            budgets = load_view_budgets(path)
+        self.assertEqual(budgets['healthz'].queries, 0)
+        self.assertIsNone(budgets['healthz'].duration)
+
+
+class BudgetTestResultTests(TestCase):
+    def run_test(self, test_method, view_budgets):
+        class Tests(unittest.TestCase):
+            client = Client()
+            test = test_method
+
+        result = BudgetTextTestResult(
+            unittest.runner._WritelnDecorator(io.StringIO()), True, 0, view_budgets=view_budgets)
+        Tests('test').run(result)
+        return result
+
+    def test_view_budget_exceeded(self):
+        """Tests making requests which exceed their view's budget fail."""
+        def test(self):
+            self.client.get(reverse('preferences:summary-list'))
+
+        result = self.run_test(test, {'preferences:summary-list': Budget(queries=0)})
+        self.assertEqual(len(result.failures), 1)
+        self.assertIn('preferences:summary-list', result.failures[0][1])
+        self.assertIn('BudgetExceeded', result.failures[0][1])
+
+    def test_view_budget_met(self):
+        """Tests making requests within their view's budget pass and are reported."""
+        def test(self):
+            self.client.get(reverse('preferences:summary-list'))
+
+        result = self.run_test(test, {'preferences:summary-list': Budget(queries=10)})
+        self.assertTrue(result.wasSuccessful())
+        self.assertEqual(len(result.test_timings), 1)
+        self.assertEqual(result.view_timings['preferences:summary-list']['requests'], 1)
+
+        result.print_budget_report(10)
+        report = result.stream.getvalue()
+        self.assertIn('Slowest tests', report)
+        self.assertIn('preferences:summary-list', report)
+
+    def test_view_duration_reported(self):
+        """Requests exceeding their view's duration budget are reported but do not fail."""
+        def test(self):
+            self.client.get(reverse('preferences:summary-list'))
+
+        result = self.run_test(test, {'preferences:summary-list': Budget(duration=0)})
+        self.assertTrue(result.wasSuccessful())
+
+        result.print_budget_report(10)
+        report = result.stream.getvalue()
+        self.assertIn('Duration budgets exceeded', report)
+        self.assertIn('> 0.000s  preferences:summary-list', report)
+
+    def test_failing_test_unchanged(self):
+        """Tests which fail for other reasons are reported as normal."""
+        def test(self):
+            self.client.get(reverse('preferences:summary-list'))
+            self.fail('expected')
+
+        result = self.run_test(test, {'preferences:summary-list': Budget(queries=0)})
+        self.assertEqual(len(result.failures), 1)
+        self.assertIn('expected', result.failures[0][1])
+
+    def test_remote_result(self):
+        """Measurements made in parallel test workers are passed to the main process."""
+        class Tests(unittest.TestCase):
+            client = Client()
+
+            def test(self):
+                self.client.get(reverse('preferences:summary-list'))
+
+        remote = BudgetRemoteTestResult()
+        Tests('test').run(remote)
+        self.assertIn('addBudgetTimings', [event[0] for event in remote.events])
+
+        # Replay the events as django.test.runner.ParallelTestSuite does.
+        result = BudgetTextTestResult(
+            unittest.runner._WritelnDecorator(io.StringIO()), True, 0, measure=False)
+        for event in remote.events:
+            handler = getattr(result, event[0], None)
+            if handler is not None:
+                handler(Tests('test'), *event[2:])
+        self.assertTrue(result.wasSuccessful())
+        self.assertEqual(len(result.test_timings), 1)
+        self.assertEqual(result.view_timings['preferences:summary-list']['requests'], 1)
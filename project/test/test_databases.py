@@ -0,0 +1,104 @@
+"""
+Test cached, pre-migrated template test databases.
+
+"""
+import os
+import tempfile
+from unittest import mock
+
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase
+
+from project.test.databases import (
+    PostgreSQLTemplateDatabase, SQLiteTemplateDatabase, get_template, schema_fingerprint)
+
+
+class SchemaFingerprintTests(SimpleTestCase):
+    def test_stable(self):
+        """The fingerprint does not change if the migrations do not."""
+        self.assertEqual(schema_fingerprint(connection), schema_fingerprint(connection))
+
+
+class SQLiteTemplateDatabaseTests(SimpleTestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache_dir = os.path.join(tmpdir.name, 'cache')
+
+        self.connection = DatabaseWrapper({
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(tmpdir.name, 'db.sqlite3'),
+            'TEST': {'NAME': os.path.join(tmpdir.name, 'test.sqlite3')},
+            'ATOMIC_REQUESTS': False, 'AUTOCOMMIT': True, 'CONN_MAX_AGE': 0, 'OPTIONS': {},
+            'TIME_ZONE': None, 'USER': '', 'PASSWORD': '', 'HOST': '', 'PORT': '',
+        }, alias='template_test')
+        self.addCleanup(self.connection.close)
+
+        # Act as though the test database has been created.
+        self.connection.settings_dict['NAME'] = self.connection.settings_dict['TEST']['NAME']
+        with self.connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE example (value INTEGER)')
+            cursor.execute('INSERT INTO example VALUES (1)')
+
+    def count(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM example')
+            return cursor.fetchone()[0]
+
+    def test_save_and_restore(self):
+        """A saved template replaces the test database when restored."""
+        template = SQLiteTemplateDatabase(self.connection, self.cache_dir)
+        self.assertFalse(template.exists())
+        template.save()
+        self.assertTrue(template.exists())
+
+        with self.connection.cursor() as cursor:
+            cursor.execute('INSERT INTO example VALUES (2)')
+        self.assertEqual(self.count(), 2)
+
+        self.connection.close()
+        template.restore()
+        self.assertEqual(self.count(), 1)
+
+    def test_stale_templates_removed(self):
+        """Saving a template removes templates with other fingerprints."""
+        old = SQLiteTemplateDatabase(self.connection, self.cache_dir)
+        old.fingerprint = 'old'
+        old.save()
+
+        new = SQLiteTemplateDatabase(self.connection, self.cache_dir)
+        new.save()
+        self.assertFalse(old.exists())
+        self.assertTrue(new.exists())
+
+    def test_in_memory_unsupported(self):
+        """Templates are not supported for in-memory test databases."""
+        self.connection.settings_dict['TEST']['NAME'] = None
+        self.assertIsNone(get_template(self.connection, self.cache_dir))
+
+    def test_no_cache_dir_unsupported(self):
+        """SQLite templates require a cache directory."""
+        self.assertIsNone(get_template(self.connection, None))
+
+
+class PostgreSQLTemplateDatabaseTests(SimpleTestCase):
+    def test_long_name(self):
+        """Template names fit in an identifier and differ by fingerprint however long the name."""
+        # Only the test database name is used and so no PostgreSQL connection is needed.
+        test_connection = DatabaseWrapper({
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'preferences',
+            'TEST': {'NAME': 'test_' + 'x' * 80},
+        }, alias='template_test')
+        names = set()
+        for fingerprint in ('a' * 64, 'a' * 40 + 'b' * 24, 'f' * 64):
+            with mock.patch('project.test.databases.schema_fingerprint', return_value=fingerprint):
+                template = PostgreSQLTemplateDatabase(test_connection)
+            self.assertLessEqual(len(template.name), 63)
+            self.assertTrue(template.name.startswith(template.prefix))
+            names.add(template.name)
+        self.assertEqual(len(names), 3)
+
+        # Removing stale templates must not remove the test database or its parallel clones.
+        for name in (template.test_database_name, template.test_database_name + '_1'):
+            self.assertFalse(name.startswith(template.prefix))
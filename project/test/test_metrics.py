@@ -0,0 +1,76 @@
+"""
+Test the Prometheus metrics endpoint.
+
+"""
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from prometheus_client import REGISTRY
+
+from preferences import authentication, caching, lookup
+
+
+@override_settings(METRICS_BEARER_TOKEN='secret')
+class MetricsTests(TestCase):
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_metrics(self):
+        """The metrics endpoint returns metrics in the Prometheus text format."""
+        r = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'preferences_http_requests_total', r.content)
+
+    def test_unauthorized(self):
+        """Metrics are only served to clients which send the bearer token."""
+        for authorization in ('', 'Bearer wrong', 'Token secret'):
+            r = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION=authorization)
+            self.assertEqual(r.status_code, 401)
+            self.assertNotIn(b'preferences_http_requests_total', r.content)
+        self.assertEqual(r['WWW-Authenticate'], 'Bearer realm="metrics"')
+
+    def test_disabled(self):
+        """Metrics are not served unless a bearer token is configured."""
+        with self.settings(METRICS_BEARER_TOKEN=None):
+            r = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer None')
+        self.assertEqual(r.status_code, 404)
+
+    def test_request_counted(self):
+        """Requests are counted per view and their latency and queries recorded."""
+        labels = {'view': 'preferences:preference-list'}
+        before = self.sample(
+            'preferences_http_requests_total', method='GET', status='200', **labels)
+        latency_before = self.sample('preferences_http_request_duration_seconds_count', **labels)
+        queries_before = self.sample('preferences_http_request_db_queries_sum', **labels)
+
+        self.client.force_login(get_user_model().objects.create(username='spqr1'))
+        self.client.get(reverse('preferences:preference-list'))
+
+        self.assertEqual(
+            self.sample('preferences_http_requests_total', method='GET', status='200', **labels),
+            before + 1)
+        self.assertEqual(
+            self.sample('preferences_http_request_duration_seconds_count', **labels),
+            latency_before + 1)
+        self.assertEqual(
+            self.sample('preferences_http_request_db_queries_sum', **labels), queries_before + 4)
+
+    def test_cache_counted(self):
+        """Lookup, token and response cache hits and misses are counted."""
+        for cache, send in (
+                ('lookup_person', lambda: lookup.cache_accessed.send(
+                    sender=None, kind='person', hits=3, misses=1)),
+                ('token', lambda: authentication.cache_accessed.send(
+                    sender=None, hits=3, misses=1)),
+                ('response', lambda: caching.cache_accessed.send(
+                    sender=None, hits=3, misses=1))):
+            labels = {'cache': cache}
+            hits = self.sample('preferences_cache_requests_total', result='hit', **labels)
+            misses = self.sample('preferences_cache_requests_total', result='miss', **labels)
+            send()
+            self.assertEqual(
+                self.sample('preferences_cache_requests_total', result='hit', **labels), hits + 3)
+            self.assertEqual(
+                self.sample('preferences_cache_requests_total', result='miss', **labels),
+                misses + 1)
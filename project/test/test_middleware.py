@@ -0,0 +1,94 @@
+"""
+Test project-wide middleware.
+
+"""
+import json
+from unittest import mock
+
+import django
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from project.middleware import DatabaseHealthCheckMiddleware
+
+
+class RequestTimingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create(username='spqr1'))
+
+    def test_server_timing_header(self):
+        """Responses have a Server-Timing header."""
+        r = self.client.get(reverse('preferences:preference-list'))
+        self.assertIn('total;dur=', r['Server-Timing'])
+        self.assertIn('db;dur=', r['Server-Timing'])
+
+    @override_settings(REQUEST_TIMING_HEADER=False)
+    def test_no_server_timing_header(self):
+        """The Server-Timing header may be disabled."""
+        r = self.client.get(reverse('preferences:preference-list'))
+        self.assertNotIn('Server-Timing', r)
+
+    def test_log(self):
+        """Each request is logged with its timings and query count."""
+        with self.assertLogs('project.middleware', 'INFO') as logs:
+            self.client.get(reverse('preferences:preference-list'))
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].levelname, 'INFO')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'preferences:preference-list')
+        self.assertEqual(record['status'], 200)
+        # One query each for the session, the user, the conditional GET validators and the page.
+        self.assertEqual(record['db_queries'], 4)
+        self.assertNotIn('queries', record)
+
+    @override_settings(REQUEST_TIMING_SLOW_THRESHOLD=0)
+    def test_slow_request(self):
+        """Slow requests are logged as warnings with their SQL."""
+        with self.assertLogs('project.middleware', 'WARNING') as logs:
+            self.client.get(reverse('preferences:preference-list'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertTrue(record['slow'])
+        self.assertEqual(len(record['queries']), 4)
+        self.assertIn('preferences_preference', record['queries'][-1]['sql'])
+
+    @override_settings(REQUEST_TIMING_SLOW_THRESHOLD=0, REQUEST_TIMING_MAX_RECORDED_QUERIES=1)
+    def test_recorded_query_limit(self):
+        """Only a limited number of queries are recorded."""
+        with self.assertLogs('project.middleware', 'WARNING') as logs:
+            self.client.get(reverse('preferences:preference-list'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['db_queries'], 4)
+        self.assertEqual(len(record['queries']), 1)
+
+
+@mock.patch.dict(connection.settings_dict, {'CONN_HEALTH_CHECKS': True})
+class DatabaseHealthCheckMiddlewareTests(TestCase):
+    def setUp(self):
+        if django.VERSION >= (4, 1):
+            self.skipTest('Django implements CONN_HEALTH_CHECKS natively')
+        self.middleware = DatabaseHealthCheckMiddleware(lambda request: HttpResponse())
+        self.request = RequestFactory().get('/')
+        connection.ensure_connection()
+
+    def test_unusable_connection_closed(self):
+        """Unusable connections are closed before the request is processed."""
+        with mock.patch.object(connection, 'is_usable', return_value=False), \
+                mock.patch.object(connection, 'close') as close:
+            self.middleware(self.request)
+        close.assert_called_once_with()
+
+    def test_usable_connection_kept(self):
+        """Usable connections are left open."""
+        with mock.patch.object(connection, 'close') as close:
+            self.middleware(self.request)
+        close.assert_not_called()
+
+    def test_health_checks_disabled(self):
+        """Connections are not checked unless CONN_HEALTH_CHECKS is set."""
+        connection.settings_dict['CONN_HEALTH_CHECKS'] = False
+        with mock.patch.object(connection, 'is_usable') as is_usable:
+            self.middleware(self.request)
+        is_usable.assert_not_called()
@@ -0,0 +1,109 @@
+"""
+Test routing of reads to the database replica.
+
+"""
+import os
+import runpy
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from preferences.models import Preference
+from project import replicas
+
+BASE_SETTINGS = os.path.join(settings.BASE_DIR, 'project', 'settings', 'base.py')
+
+
+@replicas.reads_from_replica
+def read_view(request):
+    return HttpResponse(router.db_for_read(Preference))
+
+
+@replicas.reads_from_replica
+def streaming_view(request):
+    return StreamingHttpResponse(
+        router.db_for_read(Preference) for _ in range(2))
+
+
+@override_settings(
+    DATABASES=dict(settings.DATABASES, replica=settings.DATABASES['default']),
+    DATABASE_REPLICA_PIN_SECONDS=60)
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        # Pins are kept in the cache.
+        cache.clear()
+        self.factory = RequestFactory()
+        self.user = get_user_model().objects.create(username='test0001')
+
+    def get(self, view, **extra):
+        request = self.factory.get('/', **extra)
+        request.user = self.user
+        response = view(request)
+        return b''.join(response) if response.streaming else response.content
+
+    def test_outside_views(self):
+        """Reads outside decorated views and all writes use the primary."""
+        self.assertEqual(router.db_for_read(Preference), 'default')
+        with replicas.use_replica():
+            self.assertEqual(router.db_for_read(Preference), 'replica')
+            self.assertEqual(router.db_for_write(Preference), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'preferences'))
+
+    def test_reads_from_replica(self):
+        """Decorated views read from the replica."""
+        self.assertEqual(self.get(read_view), b'replica')
+
+    def test_streaming(self):
+        """Streamed content is generated using the replica."""
+        self.assertEqual(self.get(streaming_view), b'replicareplica')
+
+    def test_no_replica(self):
+        """Without a replica, decorated views read from the primary."""
+        with self.settings(DATABASES={'default': settings.DATABASES['default']}):
+            self.assertEqual(self.get(read_view), b'default')
+
+    def test_pinned_after_write(self):
+        """Clients which change data read from the primary until the pin expires."""
+        request = self.factory.post('/')
+        request.user = self.user
+        replicas.PinToPrimaryMiddleware(lambda request: HttpResponse())(request)
+        self.assertEqual(self.get(read_view), b'default')
+
+        # Token clients are pinned by their Authorization header rather than by user.
+        self.assertEqual(self.get(read_view, HTTP_AUTHORIZATION='Token x'), b'replica')
+
+        with mock.patch.object(replicas.cache, 'get', return_value=None):
+            self.assertEqual(self.get(read_view), b'replica')
+
+    def test_safe_requests_do_not_pin(self):
+        """Requests which do not change data do not pin clients."""
+        replicas.PinToPrimaryMiddleware(read_view)(self.factory.get('/'))
+        self.assertEqual(self.get(read_view), b'replica')
+
+
+class ReplicaSettingsTests(TestCase):
+    def load(self, environ):
+        with mock.patch.dict(os.environ, environ, clear=True):
+            return runpy.run_path(BASE_SETTINGS)['DATABASES']
+
+    def test_no_replica(self):
+        """There is no replica unless one is configured."""
+        self.assertEqual(set(self.load({'DJANGO_DB_HOST': 'primary'}).keys()), {'default'})
+
+    def test_replica(self):
+        """Replica settings override those of the primary for the replica only."""
+        databases = self.load({
+            'DJANGO_DB_ENGINE': 'django.db.backends.postgresql', 'DJANGO_DB_HOST': 'primary',
+            'DJANGO_DB_REPLICA_HOST': 'replica', 'DJANGO_DB_REPLICA_CONN_MAX_AGE': '60',
+        })
+        self.assertEqual(databases['default']['HOST'], 'primary')
+        self.assertNotIn('REPLICA_HOST', databases['default'])
+        self.assertEqual(databases['replica']['HOST'], 'replica')
+        self.assertEqual(databases['replica']['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(databases['replica']['CONN_MAX_AGE'], 60)
+        self.assertEqual(databases['replica']['TEST'], {'MIRROR': 'default'})
@@ -2,8 +2,14 @@
 Test basic functionality of project-specific views.
 
 """
+import os
+import tempfile
+from unittest import mock
+
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+
+from project import schema
 
 
 class StatusTest(TestCase):
@@ -11,3 +17,42 @@ class StatusTest(TestCase):
         """GET-ing status page should succeed."""
         r = self.client.get(reverse('status'))
         self.assertEqual(r.status_code, 200)
+
+
+class SchemaTest(TestCase):
+    def setUp(self):
+        schema.get_schema.cache_clear()
+        self.addCleanup(schema.get_schema.cache_clear)
+        self.url = reverse('schema-json', kwargs={'format': '.json'})
+
+    def test_schema(self):
+        """The OpenAPI schema is served."""
+        r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 200)
+        self.assertIn('/preferences/', r.json()['paths'])
+
+    def test_etag(self):
+        """The schema has a strong ETag and requests which match it receive a 304 response."""
+        r = self.client.get(self.url)
+        self.assertTrue(r['ETag'].startswith('"'))
+        r = self.client.get(self.url, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.content, b'')
+
+    def test_generated_once(self):
+        """The schema is only generated on the first request."""
+        with mock.patch('project.schema.render_schema', return_value=b'{}') as render_schema:
+            for _ in range(3):
+                self.assertEqual(self.client.get(self.url).status_code, 200)
+        render_schema.assert_called_once_with('.json')
+
+    def test_pre_rendered(self):
+        """A schema written to API_SCHEMA_ROOT is served instead of being generated."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, 'swagger.json'), 'wb') as fobj:
+                fobj.write(b'{"paths": {}}')
+            with override_settings(API_SCHEMA_ROOT=tmpdir):
+                with mock.patch('project.schema.render_schema') as render_schema:
+                    r = self.client.get(self.url)
+        self.assertEqual(r.json(), {'paths': {}})
+        render_schema.assert_not_called()
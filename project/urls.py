@@ -17,12 +17,12 @@ from django.conf import settings
 from django.contrib import admin
 from django.http import HttpResponse
 from django.urls import path, include, re_path
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
-from rest_framework import permissions
 
 import automationcommon.views
 
+import project.metrics
+import project.schema
+
 # Django debug toolbar is only installed in developer builds
 try:
     import debug_toolbar
@@ -30,24 +30,13 @@ try:
 except ImportError:
     HAVE_DDT = False
 
-schema_view = get_schema_view(
-   openapi.Info(
-      title='Preferences API',
-      default_version='v1',
-      description='Lecture Capture Preferences API',
-      contact=openapi.Contact(email='automation@uis.cam.ac.uk'),
-      license=openapi.License(name='MIT License'),
-   ),
-   public=True,
-   permission_classes=(permissions.AllowAny,),
-   urlconf='project.urls',
-)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('ucamwebauth.urls')),
     path('status', automationcommon.views.status, name='status'),
     path('healthz', lambda request: HttpResponse('ok', content_type="text/plain"), name='healthz'),
+    path('metrics', project.metrics.metrics, name='metrics'),
     path('', include(
         'preferences.urls',
         namespace='preferences'
@@ -58,8 +47,7 @@ urlpatterns = [
 
     # API documentation
     re_path(
-        r'^api/swagger(?P<format>\.json|\.yaml)$',
-        schema_view.without_ui(cache_timeout=None), name='schema-json'),
+        r'^api/swagger(?P<format>\.json|\.yaml)$', project.schema.schema, name='schema-json'),
 ]
 
 # Selectively enable django debug toolbar URLs. Only if the toolbar is